@@ -0,0 +1,83 @@
+"""
+benchmark_import_films
+
+Times import_films.py's per-row write path against its --bulk write path on a
+synthetic TSV. Each path imports into its own freshly migrated scratch SQLite
+database, so the project's db.sqlite3 is never touched.
+
+    python benchmark_import_films.py --films 50000 --batch-size 500
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "top_films_forum.settings")
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+
+import import_films
+from top_films.models import Film, Person, Genre, Language
+
+
+def write_synthetic_tsv(path, num_films, seed=86):
+    """Writes a TSV in the finder's format, with credits drawn from realistically sized name pools"""
+    rng = random.Random(seed)
+    genres = [f"Genre {i}" for i in range(28)]
+    languages = [f"Language {i}" for i in range(60)]
+    people = [f"Person {i}" for i in range(max(10, num_films * 2))]
+    with open(path, 'wt', encoding="utf-8") as tsv_file:
+        for rank in range(1, num_films + 1):
+            tsv_file.write("\t".join([
+                str(rank), f"tt{rank:07}", f"Synthetic Film {rank}", str(rng.randint(1920, 2022)),
+                ", ".join(rng.sample(genres, rng.randint(1, 3))), ", ".join(rng.sample(people, rng.randint(1, 2))),
+                ", ".join(rng.sample(people, 3)), "A synthetic plot.", "N/A", rng.choice(languages),
+                f"{rng.uniform(5, 10):.1f}", str(rng.randint(40, 100)),
+            ]))
+            tsv_file.write("\n")
+
+
+def _use_scratch_db(path):
+    connection.close()
+    connection.settings_dict['NAME'] = path
+    call_command('migrate', verbosity=0)
+
+
+def run_benchmark(num_films, batch_size, skip_per_row=False):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tsv_path = os.path.join(tmp_dir, 'films.tsv')
+        write_synthetic_tsv(tsv_path, num_films)
+        modes = [('bulk', lambda: import_films.bulk_import_films(tsv_path, batch_size=batch_size))]
+        if not skip_per_row:
+            modes.insert(0, ('per-row', lambda: import_films.import_films(tsv_path)))
+        for mode, run_import in modes:
+            _use_scratch_db(os.path.join(tmp_dir, f'{mode}.sqlite3'))
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                run_import()
+                elapsed = time.perf_counter() - start
+            counts = (Film.objects.count(), Person.objects.count(), Genre.objects.count(), Language.objects.count())
+            results[mode] = elapsed
+            print(f"{mode:>8}: {elapsed:9.2f}s  ({num_films / elapsed:9.0f} films/s)  "
+                  f"films={counts[0]} people={counts[1]} genres={counts[2]} languages={counts[3]}")
+        connection.close()
+    if 'per-row' in results:
+        print(f"Speed-up: {results['per-row'] / results['bulk']:.1f}x")
+    return results
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Benchmarks the per-row and bulk import paths on a synthetic TSV.")
+    argparser.add_argument("--films", type=int, default=50000, help="Number of synthetic films to generate")
+    argparser.add_argument("--batch-size", type=int, default=import_films.DEFAULT_BATCH_SIZE)
+    argparser.add_argument("--skip-per-row", action="store_true", help="Only time the bulk path")
+    ns = argparser.parse_args()
+    run_benchmark(ns.films, ns.batch_size, ns.skip_per_row)
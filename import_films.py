@@ -1,15 +1,29 @@
 import os
+import hashlib
 import argparse
 import django
 
-os.environ["DJANGO_SETTINGS_MODULE"] = "top_films_forum.settings"
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "top_films_forum.settings")
 django.setup()
 
+from django.db import transaction
+from django.utils.text import slugify
+
 from top_films.models import *
+from top_films import search, page_cache, counters, similar_films
+from top_films.change_tracking import touch, ID_CHUNK_SIZE
+
+DEFAULT_BATCH_SIZE = 500
+
+# The Film columns a TSV row sets, besides its language and credits
+SYNCED_FIELDS = ('ranking', 'title', 'year', 'plot', 'poster_url', 'imdb_rating', 'meta_score')
+# credit list -> (through table, related name lookup, related model)
+SYNCED_CREDITS = {
+    'genres': (Film.genres.through, 'genre__name', Genre),
+    'directors': (Film.directors.through, 'person__name', Person),
+    'actors': (Film.actors.through, 'person__name', Person),
+}
 
-argparser = argparse.ArgumentParser(description="This script imports films and their related metadata from an appropriately formatted TSV file.")
-argparser.add_argument("tsv_path", help="Absolute or relative path of the source TSV file")
-ns = argparser.parse_args()
 
 def _get_aux_rec_ids(modelClass, data_string):
     obj_ids = []
@@ -23,25 +37,321 @@ def _get_aux_rec_ids(modelClass, data_string):
     return obj_ids
 
 
-with open(ns.tsv_path, 'rt', encoding="utf-8") as tsv_file:
-    film_num = 1
-    for film_data in tsv_file:
-        ranking, ttcode, title, year, genres, directors, actors, plot, poster_url, language, rating, meta_score = film_data.split("\t")
-        if Film.objects.filter(title=title):
-            print(f'--> Skipping the film "{title}" as it already exists in the database...')
+def _parse_film_row(film_data):
+    """Splits a TSV line into a dict of Film field values and related-name lists"""
+    ranking, ttcode, title, year, genres, directors, actors, plot, poster_url, language, rating, meta_score = film_data.split("\t")
+    if "N/A" in meta_score:
+        meta_score = 80
+    return {
+        'ranking': int(ranking), 'ttcode': ttcode, 'title': title, 'year': int(year), 'plot': plot,
+        'poster_url': poster_url, 'imdb_rating': float(rating), 'meta_score': int(meta_score),
+        'language': language, 'genres': genres.split(", "), 'directors': directors.split(", "),
+        'actors': actors.split(", "),
+    }
+
+
+def import_films(tsv_path):
+    """Imports the TSV one film at a time, looking up each related record individually"""
+    with open(tsv_path, 'rt', encoding="utf-8") as tsv_file:
+        film_num = 1
+        for film_data in tsv_file:
+            ranking, ttcode, title, year, genres, directors, actors, plot, poster_url, language, rating, meta_score = film_data.split("\t")
+            if Film.objects.filter(title=title):
+                print(f'--> Skipping the film "{title}" as it already exists in the database...')
+                continue
+            genre_ids = _get_aux_rec_ids(Genre, genres)
+            director_ids = _get_aux_rec_ids(Person, directors)
+            actor_ids = _get_aux_rec_ids(Person, actors)
+            language = Language.objects.get_or_create(name=language)[0]
+            if "N/A" in meta_score:
+                meta_score = 80
+            f = Film.objects.create(
+                    ranking=int(ranking), ttcode=ttcode, title=title, year=int(year), language=language,
+                    plot=plot, poster_url=poster_url, imdb_rating=float(rating), meta_score=int(meta_score)
+            )
+            f.genres.set(genre_ids)
+            f.actors.set(actor_ids)
+            f.directors.set(director_ids)
+            print(f'{film_num:3} - Added the film "{title}" to the database')
+            film_num += 1
+
+
+def _fetch_ids(modelClass, field, values, batch_size):
+    """Returns a value->id dict for the given field values, querying in chunks to respect SQLite's parameter limit"""
+    values = list(values)
+    step = min(batch_size, 900)
+    value_ids = {}
+    for i in range(0, len(values), step):
+        value_ids.update(modelClass.objects.filter(**{f'{field}__in': values[i:i + step]}).values_list(field, 'id'))
+    return value_ids
+
+
+def _ensure_named_records(modelClass, name_ids, names, batch_size):
+    """Bulk-creates any of the given names missing from name_ids, adding the new ids to name_ids"""
+    missing = {name for name in names if name not in name_ids}
+    if not missing:
+        return
+    # bulk_create() bypasses Model.save(), so the slug has to be filled in here
+    modelClass.objects.bulk_create([modelClass(name=name, slug=slugify(name)) for name in missing],
+                                   batch_size=batch_size)
+    name_ids.update(_fetch_ids(modelClass, 'name', missing, batch_size))
+
+
+def _import_film_batch(rows, name_maps, batch_size):
+    """Imports a batch of parsed rows; returns the ids of the genres, people and languages they list"""
+    genre_ids, person_ids, language_ids = name_maps
+    _ensure_named_records(Genre, genre_ids, {g for row in rows for g in row['genres']}, batch_size)
+    _ensure_named_records(Person, person_ids, {p for row in rows for p in row['directors'] + row['actors']}, batch_size)
+    _ensure_named_records(Language, language_ids, {row['language'] for row in rows}, batch_size)
+
+    Film.objects.bulk_create([
+        Film(ranking=row['ranking'], ttcode=row['ttcode'], title=row['title'], year=row['year'],
+             language_id=language_ids[row['language']], plot=row['plot'], poster_url=row['poster_url'],
+             imdb_rating=row['imdb_rating'], meta_score=row['meta_score'])
+        for row in rows
+    ], batch_size=batch_size)
+    film_ids = _fetch_ids(Film, 'title', [row['title'] for row in rows], batch_size)
+
+    GenreLink, DirectorLink, ActorLink = Film.genres.through, Film.directors.through, Film.actors.through
+    genre_links, director_links, actor_links = [], [], []
+    for row in rows:
+        film_id = film_ids[row['title']]
+        genre_links.extend(GenreLink(film_id=film_id, genre_id=genre_ids[name]) for name in dict.fromkeys(row['genres']))
+        director_links.extend(DirectorLink(film_id=film_id, person_id=person_ids[name]) for name in dict.fromkeys(row['directors']))
+        actor_links.extend(ActorLink(film_id=film_id, person_id=person_ids[name]) for name in dict.fromkeys(row['actors']))
+    GenreLink.objects.bulk_create(genre_links, batch_size=batch_size)
+    DirectorLink.objects.bulk_create(director_links, batch_size=batch_size)
+    ActorLink.objects.bulk_create(actor_links, batch_size=batch_size)
+    return ({link.genre_id for link in genre_links}, {link.person_id for link in director_links + actor_links},
+            {language_ids[row['language']] for row in rows})
+
+
+def bulk_import_films(tsv_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Set-based counterpart of import_films(). Name->id maps for Genre/Person/Language are
+    preloaded once, and missing records, films and M2M link rows are all written with
+    bulk_create() in batches of batch_size, inside a single transaction. The search index,
+    counters and similar films are rebuilt, the genres, people and languages that gained films
+    touched (see top_films/change_tracking.py) and the catalog page cache invalidated at the end.
+    """
+    num_added = num_skipped = 0
+    with transaction.atomic():
+        existing_titles = set(Film.objects.values_list('title', flat=True))
+        name_maps = tuple(dict(modelClass.objects.values_list('name', 'id')) for modelClass in (Genre, Person, Language))
+        linked_ids = {Genre: set(), Person: set(), Language: set()}
+        batch = []
+        with open(tsv_path, 'rt', encoding="utf-8") as tsv_file:
+            for film_data in tsv_file:
+                row = _parse_film_row(film_data)
+                if row['title'] in existing_titles:
+                    print(f'--> Skipping the film "{row["title"]}" as it already exists in the database...')
+                    num_skipped += 1
+                    continue
+                existing_titles.add(row['title'])
+                batch.append(row)
+                if len(batch) == batch_size:
+                    for ids, new_ids in zip(linked_ids.values(), _import_film_batch(batch, name_maps, batch_size)):
+                        ids |= new_ids
+                    num_added += len(batch)
+                    print(f'{num_added:6} films added...')
+                    batch = []
+        if batch:
+            for ids, new_ids in zip(linked_ids.values(), _import_film_batch(batch, name_maps, batch_size)):
+                ids |= new_ids
+            num_added += len(batch)
+        # bulk_create() doesn't send the signals that keep the search index, counters, similar films,
+        # change timestamps and page cache in sync
+        search.rebuild_index(['film', 'person'])
+        for model, field, source, fk in counters.COUNTERS:
+            if model is not Film:
+                counters.recount(model, field, source, fk)
+        similar_films.rebuild()
+        for model, ids in linked_ids.items():
+            ids = sorted(ids)
+            for start in range(0, len(ids), ID_CHUNK_SIZE):
+                touch(model.objects.filter(pk__in=ids[start:start + ID_CHUNK_SIZE]))
+    page_cache.bump_catalog_version()
+    print(f'Added {num_added} films to the database ({num_skipped} skipped)')
+    return num_added
+
+
+def _fingerprint(film):
+    """Digest of a film's synced state, be it a parsed TSV row or one loaded by _current_films()"""
+    state = (tuple(film[field] for field in SYNCED_FIELDS), film['language'],
+             tuple(tuple(sorted(set(film[credit]))) for credit in SYNCED_CREDITS))
+    return hashlib.sha1(repr(state).encode()).digest()
+
+
+def _current_films():
+    """
+    Returns ({ttcode: film state}, [ids of surplus films sharing a ttcode]), with each film's
+    state in the shape of _parse_film_row()'s rows, plus its id
+    """
+    films, duplicate_ids = {}, []
+    by_id = {}
+    for film_id, ttcode, language, *values in Film.objects.order_by('id').values_list(
+            'id', 'ttcode', 'language__name', *SYNCED_FIELDS):
+        if ttcode in films:
+            duplicate_ids.append(film_id)
             continue
-        genre_ids = _get_aux_rec_ids(Genre, genres)
-        director_ids = _get_aux_rec_ids(Person, directors)
-        actor_ids = _get_aux_rec_ids(Person, actors)
-        language = Language.objects.get_or_create(name=language)[0]
-        if "N/A" in meta_score:
-            meta_score = 80
-        f = Film.objects.create(
-                ranking=int(ranking), ttcode=ttcode, title=title, year=int(year), language=language,
-                plot=plot, poster_url=poster_url, imdb_rating=float(rating), meta_score=int(meta_score)
-        )
-        f.genres.set(genre_ids)
-        f.actors.set(actor_ids)
-        f.directors.set(director_ids)
-        print(f'{film_num:3} - Added the film "{title}" to the database')
-        film_num += 1
+        films[ttcode] = by_id[film_id] = dict(zip(SYNCED_FIELDS, values), id=film_id, ttcode=ttcode, language=language,
+                                              **{credit: set() for credit in SYNCED_CREDITS})
+    for credit, (through, name_lookup, _) in SYNCED_CREDITS.items():
+        for film_id, name in through.objects.values_list('film_id', name_lookup):
+            if film_id in by_id:
+                by_id[film_id][credit].add(name)
+    return films, duplicate_ids
+
+
+def diff_films(tsv_path):
+    """
+    Compares the TSV with the films in the database, matched on their IMDB code, and
+    returns the minimal changes taking the database to the TSV's state:
+    {'insert': [row], 'update': [(film, row, {field: (old, new)})], 'remove': [film], 'unchanged': n}.
+    Credit changes are given as (names removed, names added).
+    """
+    current, duplicate_ids = _current_films()
+    plan = {'insert': [], 'update': [], 'remove': [], 'unchanged': 0}
+    seen_ttcodes, seen_rankings = set(), set()
+    with open(tsv_path, 'rt', encoding="utf-8") as tsv_file:
+        for film_data in tsv_file:
+            if not film_data.strip():
+                continue
+            row = _parse_film_row(film_data.rstrip("\n"))
+            if row['ttcode'] in seen_ttcodes or row['ranking'] in seen_rankings:
+                raise ValueError(f'The TSV lists "{row["title"]}" twice, or its ranking {row["ranking"]} twice')
+            seen_ttcodes.add(row['ttcode'])
+            seen_rankings.add(row['ranking'])
+            film = current.get(row['ttcode'])
+            if film is None:
+                plan['insert'].append(row)
+            elif _fingerprint(film) == _fingerprint(row):
+                plan['unchanged'] += 1
+            else:
+                changes = {field: (film[field], row[field]) for field in SYNCED_FIELDS + ('language',)
+                           if film[field] != row[field]}
+                for credit in SYNCED_CREDITS:
+                    names = set(row[credit])
+                    if names != film[credit]:
+                        changes[credit] = (film[credit] - names, names - film[credit])
+                plan['update'].append((film, row, changes))
+    plan['remove'] = [film for ttcode, film in current.items() if ttcode not in seen_ttcodes]
+    plan['remove'] += [{'id': film_id, 'ranking': None, 'title': None} for film_id in duplicate_ids]
+    return plan
+
+
+def _related_ids(modelClass, names):
+    """name->id dict for names, creating the missing records through save(), so that their signals are sent"""
+    name_ids = _fetch_ids(modelClass, 'name', names, DEFAULT_BATCH_SIZE)
+    for name in set(names) - name_ids.keys():
+        name_ids[name] = modelClass.objects.create(name=name).id
+    return name_ids
+
+
+def apply_film_changes(plan):
+    """
+    Applies a diff_films() plan in one transaction. Films are removed first, so that a
+    new film may take a removed film's title, and re-ranked films never share a ranking
+    outside the transaction. Every write goes through the ORM's signal-sending paths, so
+    the counters, search index, similar films, change timestamps and page cache follow
+    the changed films alone, with no full rebuild.
+    """
+    rows = plan['insert'] + [row for _, row, _ in plan['update']]
+    with transaction.atomic():
+        Film.objects.filter(pk__in=[film['id'] for film in plan['remove']]).delete()
+        language_ids = _related_ids(Language, {row['language'] for row in rows})
+        credit_ids = {
+            Genre: _related_ids(Genre, {name for row in rows for name in row['genres']}),
+            Person: _related_ids(Person, {name for row in rows for name in row['directors'] + row['actors']}),
+        }
+
+        films = Film.objects.in_bulk([film['id'] for film, _, _ in plan['update']])
+        for film, row, changes in plan['update']:
+            instance = films[film['id']]
+            scalar_changes = [field for field in SYNCED_FIELDS if field in changes]
+            for field in scalar_changes:
+                setattr(instance, field, row[field])
+            if 'language' in changes:
+                instance.language_id = language_ids[row['language']]
+            if scalar_changes or 'language' in changes:
+                instance.save()
+            for credit, (_, _, modelClass) in SYNCED_CREDITS.items():
+                if credit in changes:
+                    removed, added = changes[credit]
+                    related = getattr(instance, credit)
+                    if removed:
+                        related.remove(*(credit_ids[modelClass][name] for name in removed))
+                    if added:
+                        related.add(*(credit_ids[modelClass][name] for name in added))
+
+        for row in plan['insert']:
+            film = Film.objects.create(language_id=language_ids[row['language']],
+                                       **{field: row[field] for field in SYNCED_FIELDS + ('ttcode',)})
+            for credit, (_, _, modelClass) in SYNCED_CREDITS.items():
+                getattr(film, credit).set([credit_ids[modelClass][name] for name in dict.fromkeys(row[credit])])
+
+
+def _print_sync_report(plan):
+    def label(film):
+        return f'#{film["ranking"]} "{film["title"]}"' if film['title'] is not None else f'duplicate film {film["id"]}'
+
+    for row in plan['insert']:
+        print(f'  + {label(row)} ({row["year"]})')
+    for film, row, changes in sorted(plan['update'], key=lambda update: update[1]['ranking']):
+        details = []
+        for field, change in changes.items():
+            if field in SYNCED_CREDITS:
+                removed, added = change
+                details.append(f'{field} ' + ' '.join([f'-"{name}"' for name in sorted(removed)] +
+                                                       [f'+"{name}"' for name in sorted(added)]))
+            elif field == 'plot':
+                details.append('plot')
+            else:
+                details.append(f'{field} {change[0]!r} -> {change[1]!r}')
+        print(f'  ~ {label(row)}: ' + '; '.join(details))
+    removed_ids = [film['id'] for film in plan['remove']]
+    activity = {film_id: (comments, favs) for film_id, comments, favs in Film.objects.filter(pk__in=removed_ids).values_list(
+        'id', 'comment_count', 'fav_count')} if removed_ids else {}
+    for film in plan['remove']:
+        comments, favs = activity.get(film['id'], (0, 0))
+        print(f'  - {label(film)}, with {comments} comments and {favs} favs')
+    num_reranked = sum('ranking' in changes for _, _, changes in plan['update'])
+    print(f'{len(plan["insert"])} films to insert, {len(plan["update"])} to update ({num_reranked} re-ranked), '
+          f'{len(plan["remove"])} to remove; {plan["unchanged"]} unchanged')
+
+
+def sync_films(tsv_path, dry_run=False):
+    """
+    Takes the database to the state of the TSV chart: films are matched on their IMDB code,
+    and each row's fingerprint is compared with the film's current one, so that only new,
+    changed and dropped films are written (see diff_films() and apply_film_changes()).
+    Dropped films are deleted along with their comments and favs. With dry_run, only the
+    change report is printed. Re-syncing an unchanged chart takes four read queries.
+    """
+    plan = diff_films(tsv_path)
+    _print_sync_report(plan)
+    if dry_run:
+        print("Dry run: nothing was changed")
+    elif plan['insert'] or plan['update'] or plan['remove']:
+        apply_film_changes(plan)
+        print("Changes applied")
+    return plan
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="This script imports films and their related metadata from an appropriately formatted TSV file.")
+    argparser.add_argument("tsv_path", help="Absolute or relative path of the source TSV file")
+    argparser.add_argument("--bulk", action="store_true", help="Use the set-based bulk write path (recommended for large files)")
+    argparser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per bulk INSERT in --bulk mode")
+    argparser.add_argument("--sync", action="store_true",
+                           help="Make the database match the TSV: insert new films, update changed ones, remove dropped ones")
+    argparser.add_argument("--dry-run", action="store_true", help="With --sync, only report the changes it would make")
+    ns = argparser.parse_args()
+    if ns.dry_run and not ns.sync:
+        argparser.error("--dry-run only applies to --sync")
+    if ns.sync:
+        sync_films(ns.tsv_path, dry_run=ns.dry_run)
+    elif ns.bulk:
+        bulk_import_films(ns.tsv_path, batch_size=ns.batch_size)
+    else:
+        import_films(ns.tsv_path)
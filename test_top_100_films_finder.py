@@ -0,0 +1,145 @@
+"""
+test_top_100_films_finder
+
+Tests of top_100_films_finder.py's OMDb client against a stand-in OMDb served by
+http.server on a local port, so they run offline.
+
+    python -m unittest test_top_100_films_finder
+"""
+
+import json
+import time
+import random
+import threading
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+import top_100_films_finder as finder
+
+
+class StandInOmdbHandler(BaseHTTPRequestHandler):
+    """Answers ?i=<tt code> with a record titled after the code, after a random delay"""
+
+    def do_GET(self):
+        server = self.server
+        tt_code = parse_qs(urlparse(self.path).query)['i'][0]
+        with server.lock:
+            server.requests.append((time.monotonic(), tt_code))
+            statuses = server.failures.get(tt_code)
+            status = statuses.pop(0) if statuses else 200
+        time.sleep(random.uniform(0, server.max_delay))
+        if status != 200:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if tt_code in server.missing:
+            record = {'Response': 'False', 'Error': 'Incorrect IMDb ID.'}
+        else:
+            record = {'Response': 'True', 'Title': f'Film {tt_code}'}
+        body = json.dumps(record).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInOmdb(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInOmdbHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        # tt code -> statuses of its next responses, e.g. [503, 429] before a 200
+        self.failures = {}
+        self.missing = set()
+        self.max_delay = 0.02
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+
+class FetchFilmsFromOmdbTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInOmdb()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        # The client reports each retry on stdout
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def client(self, **options):
+        client = finder.HttpClient(**{'rate_limit': 0, 'backoff_base': 0.01, **options})
+        self.addCleanup(client.close)
+        return client
+
+    def fetch(self, tt_codes, client, concurrency=8):
+        return list(finder.fetch_films_from_omdb(tt_codes, client, concurrency, api_url=self.server.url))
+
+    def test_results_in_input_order(self):
+        tt_codes = [f'tt{n:07d}' for n in range(40)]
+        self.server.missing.add(tt_codes[7])
+        films = self.fetch(tt_codes, self.client(concurrency=8))
+        self.assertIsNone(films[7])
+        self.assertEqual([film and film['Title'] for film in films],
+                         [None if n == 7 else f'Film {code}' for n, code in enumerate(tt_codes)])
+        # Each code was requested once, by workers answered after random delays
+        self.assertEqual(sorted(code for _, code in self.server.requests), tt_codes)
+
+    def test_retries_429s_and_5xxs(self):
+        self.server.failures = {'tt0000001': [503, 429], 'tt0000002': [500]}
+        films = self.fetch(['tt0000001', 'tt0000002', 'tt0000003'], self.client(retries=3))
+        self.assertEqual([film['Title'] for film in films], ['Film tt0000001', 'Film tt0000002', 'Film tt0000003'])
+        requested = [code for _, code in self.server.requests]
+        self.assertEqual([requested.count(code) for code in ('tt0000001', 'tt0000002', 'tt0000003')], [3, 2, 1])
+
+    def test_gives_up_after_the_last_retry(self):
+        self.server.failures = {'tt0000001': [503] * 5}
+        client = self.client(retries=3)
+        with self.assertRaises(requests.HTTPError):
+            client.get(f"{self.server.url}?i=tt0000001")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_backoff_delay(self):
+        client = self.client(backoff_base=0.5, backoff_cap=8.0)
+        for attempt in range(8):
+            delays = [client.backoff_delay(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= min(8.0, 0.5 * 2 ** attempt) for delay in delays))
+
+    def test_rate_limit(self):
+        rate = 40
+        self.server.max_delay = 0
+        self.fetch([f'tt{n:07d}' for n in range(12)], self.client(concurrency=8, rate_limit=rate))
+        starts = sorted(started for started, _ in self.server.requests)
+        # 12 requests start at least 11 intervals apart in all, however many workers send them
+        self.assertGreaterEqual(starts[-1] - starts[0], 0.9 * 11 / rate)
+
+    def test_omdb_errors_are_cached_briefly(self):
+        self.server.missing.add('tt0000002')
+        cache = finder.ResponseCache(os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'cache.sqlite3'))
+        self.assertIsNone(self.fetch(['tt0000001', 'tt0000002'], self.client(cache=cache))[1])
+        ttls = {key: expires_at - stored_at for key, expires_at, stored_at in cache._db.execute(
+            "SELECT key, expires_at, last_access FROM entries")}
+        # An unknown id or exhausted API key may be a transient answer, so it isn't replayed for a week
+        self.assertAlmostEqual(ttls['omdb:tt0000001'], finder.OMDB_TTL, delta=1)
+        self.assertAlmostEqual(ttls['omdb:tt0000002'], finder.ERROR_TTL, delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
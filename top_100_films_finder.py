@@ -19,35 +19,194 @@ This program generates a TSV containing the details of the top 100 films on IMDB
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import os
 import re
+import sys
 import json
-from pathlib import Path
+import time
+import random
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 
 OMDB_API_KEY = "e39bd8ef"
+OMDB_API_URL = "http://www.omdbapi.com/"
+IMDB_CHART_URL = "https://www.imdb.com/chart/top/"
 
-def _get_url(url):
-    res = None
-    for i in range(3):
-        try:
-            res = requests.get(url, timeout=15)
-        except Exception:
-            if i == 2:
-                print(f"Could not fetch the URL ({url}).\nPlease check your internet connection.")
-                sys.exit()
-            else:
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE_LIMIT = 10.0  # requests per second, shared by all workers
+
+DEFAULT_CACHE_PATH = ".finder_cache.sqlite3"
+DEFAULT_CACHE_MAX_MB = 64
+CHART_TTL = 60 * 60  # the chart page is revalidated hourly
+OMDB_TTL = 7 * 24 * 60 * 60  # OMDb records rarely change, so they are kept for a week
+ERROR_TTL = 10 * 60  # errors answered with a 200 (e.g. OMDb's request limit) may be transient
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces request start-times so at most `rate` begin per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ResponseCache:
+    """
+    A size-bounded, on-disk LRU cache of response bodies, stored in a SQLite file. Each entry
+    has its own expiry time, and keeps the ETag/Last-Modified validators of the response it
+    came from so that an expired entry can be revalidated with a conditional GET.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, last_modified TEXT,
+                expires_at REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def get(self, key):
+        """Returns the (body, etag, last_modified, is_fresh) tuple cached under key, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, etag, last_modified, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        body, etag, last_modified, expires_at = row
+        return body, etag, last_modified, expires_at > now
+
+    def put(self, key, body, ttl, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, etag, last_modified, now + ttl, now, len(body.encode('utf-8'))))
+            self._evict()
+
+    def refresh(self, key, ttl):
+        """Extends an entry's lifetime after the server has confirmed it is still valid"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE entries SET expires_at = ?, last_access = ? WHERE key = ?", (now + ttl, now, key))
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self):
+        self._db.close()
+
+
+class HttpClient:
+    """
+    A requests.Session wrapper shared by the fetch workers. Connections are pooled and
+    kept alive across requests, every request passes through the rate limiter, and failed
+    requests (network errors, 429s and 5xx responses) are retried with exponential backoff
+    and full jitter. An optional ResponseCache is consulted by _get_url() before any request
+    is made; in offline mode the cache is the only source of responses.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate_limit=DEFAULT_RATE_LIMIT,
+                 retries=3, backoff_base=0.5, backoff_cap=8.0, timeout=15, cache=None, offline=False):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(concurrency, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+
+    def backoff_delay(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def get(self, url, headers=None):
+        for attempt in range(self.retries):
+            self.limiter.wait()
+            try:
+                res = self.session.get(url, headers=headers, timeout=self.timeout)
+                if res.status_code == 429 or res.status_code >= 500:
+                    raise requests.HTTPError(f"HTTP {res.status_code}", response=res)
+                return res
+            except requests.RequestException:
+                if attempt == self.retries - 1:
+                    raise
                 print("URL Connection Failure. Retrying...")
-    return res
+                time.sleep(self.backoff_delay(attempt))
+
+    def close(self):
+        self.session.close()
+        if self.cache:
+            self.cache.close()
+
+
+def _get_url(url, client, cache_key=None, ttl=CHART_TTL, is_error=None):
+    """
+    Returns the body of url, served from the client's cache when it holds a fresh (or revalidated) copy.
+    Bodies that is_error(body) flags are cached for ERROR_TTL rather than ttl.
+    """
+    cache_key = cache_key or url
+    cached = client.cache.get(cache_key) if client.cache else None
+    if cached and (cached[3] or client.offline):
+        return cached[0]
+    if client.offline:
+        print(f"The URL ({url}) is not in the cache, so it cannot be fetched in offline mode.")
+        sys.exit()
+
+    headers = {}
+    if cached:
+        if cached[1]:
+            headers['If-None-Match'] = cached[1]
+        if cached[2]:
+            headers['If-Modified-Since'] = cached[2]
+    try:
+        res = client.get(url, headers=headers)
+    except requests.RequestException:
+        print(f"Could not fetch the URL ({url}).\nPlease check your internet connection.")
+        sys.exit()
 
+    body = cached[0] if res.status_code == 304 and cached else res.text
+    if is_error and is_error(body):
+        ttl = ERROR_TTL
+    if res.status_code == 304 and cached:
+        client.cache.refresh(cache_key, ttl)
+    elif client.cache and res.ok:
+        client.cache.put(cache_key, body, ttl, res.headers.get('ETag'), res.headers.get('Last-Modified'))
+    return body
 
-def _fetch_top_100_title_codes():
+
+def _fetch_top_100_title_codes(client, chart_url=IMDB_CHART_URL):
     film_codes = []
-    res = _get_url("https://www.imdb.com/chart/top/")
-    soup = BeautifulSoup(res.text, 'html.parser')
+    soup = BeautifulSoup(_get_url(chart_url, client), 'html.parser')
     films = soup.find_all('td', class_='titleColumn')[:100]
     for film in films:
         fcode = re.findall(r'/(tt\d+)/', film.find('a')['href'])[0]
@@ -55,27 +214,66 @@ def _fetch_top_100_title_codes():
     return film_codes
 
 
-def _get_film_data_from_omdb(tt_code):
-    query_url = f"http://www.omdbapi.com/?apikey={OMDB_API_KEY}&i={tt_code}"
-    res = _get_url(query_url)
-    response = json.loads(res.text)
+def _is_omdb_error(body):
+    """OMDb answers unknown title codes and exhausted API keys with a 200 whose Response is 'False'"""
+    try:
+        return json.loads(body).get('Response') == 'False'
+    except ValueError:
+        return True
+
+
+def _get_film_data_from_omdb(tt_code, client, api_url=OMDB_API_URL):
+    query_url = f"{api_url}?{urlencode({'apikey': OMDB_API_KEY, 'i': tt_code})}"
+    response = json.loads(_get_url(query_url, client, cache_key=f"omdb:{tt_code}", ttl=OMDB_TTL,
+                                   is_error=_is_omdb_error))
     if response['Response'] == 'False':
         return None
     return response
 
 
-def generate_top_100_tsv():
-    film_rank = 1
-    print("Fetching Top 100 Title Codes...")
-    top_film_codes = _fetch_top_100_title_codes()
-    print("Generating Top-100 TSV...")
-    with open('top_100_films.tsv', 'w+t', encoding="utf-8") as films_index_file:
-        for film_code in top_film_codes:
-            print(f"{film_rank:3}/100")
-            fdata = _get_film_data_from_omdb(film_code)
-            films_index_file.write("\t".join([
-                str(film_rank), film_code, fdata['Title'], fdata['Year'], fdata['Genre'], fdata['Director'], fdata['Actors'],
-                fdata['Plot'], fdata['Poster'], fdata['Language'], fdata['imdbRating'], fdata['Metascore']
-            ]))
-            films_index_file.write("\n")
-            film_rank += 1
+def fetch_films_from_omdb(tt_codes, client, concurrency=DEFAULT_CONCURRENCY, api_url=OMDB_API_URL):
+    """Yields the OMDb record (or None) of each title code, fetched concurrently but yielded in input order"""
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        yield from pool.map(lambda tt_code: _get_film_data_from_omdb(tt_code, client, api_url), tt_codes)
+
+
+def generate_top_100_tsv(output_path='top_100_films.tsv', concurrency=DEFAULT_CONCURRENCY,
+                         rate_limit=DEFAULT_RATE_LIMIT, chart_url=IMDB_CHART_URL, api_url=OMDB_API_URL,
+                         cache=None, offline=False):
+    client = HttpClient(concurrency=concurrency, rate_limit=rate_limit, cache=cache, offline=offline)
+    try:
+        print("Fetching Top 100 Title Codes...")
+        top_film_codes = _fetch_top_100_title_codes(client, chart_url)
+        print("Generating Top-100 TSV...")
+        with open(output_path, 'w+t', encoding="utf-8") as films_index_file:
+            film_data = fetch_films_from_omdb(top_film_codes, client, concurrency, api_url)
+            for film_rank, (film_code, fdata) in enumerate(zip(top_film_codes, film_data), start=1):
+                print(f"{film_rank:3}/{len(top_film_codes)}")
+                if fdata is None:
+                    print(f"--> OMDb has no record of {film_code}, skipping...")
+                    continue
+                films_index_file.write("\t".join([
+                    str(film_rank), film_code, fdata['Title'], fdata['Year'], fdata['Genre'], fdata['Director'], fdata['Actors'],
+                    fdata['Plot'], fdata['Poster'], fdata['Language'], fdata['imdbRating'], fdata['Metascore']
+                ]))
+                films_index_file.write("\n")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Generates a TSV containing the details of the top 100 films on IMDB.")
+    argparser.add_argument("-o", "--output", default="top_100_films.tsv", help="Path of the TSV file to write")
+    argparser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Max. number of OMDb requests in flight")
+    argparser.add_argument("--rate-limit", type=float, default=DEFAULT_RATE_LIMIT, help="Max. requests started per second (0 = unlimited)")
+    argparser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="Path of the on-disk response cache")
+    argparser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help="Size bound of the response cache")
+    argparser.add_argument("--no-cache", action="store_true", help="Fetch everything afresh without reading or writing the cache")
+    argparser.add_argument("--offline", action="store_true", help="Build the TSV entirely from the cache, without any network access")
+    argparser.add_argument("--chart-url", default=IMDB_CHART_URL, help=argparse.SUPPRESS)
+    argparser.add_argument("--api-url", default=OMDB_API_URL, help=argparse.SUPPRESS)
+    ns = argparser.parse_args()
+    if ns.offline and ns.no_cache:
+        argparser.error("--offline requires the response cache")
+    cache = None if ns.no_cache else ResponseCache(ns.cache_path, int(ns.cache_max_mb * 1024 * 1024))
+    generate_top_100_tsv(ns.output, ns.concurrency, ns.rate_limit, ns.chart_url, ns.api_url, cache, ns.offline)
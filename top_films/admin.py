@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.db import models
-from django.db.models import Count
+from django.db.models import Prefetch, prefetch_related_objects
 from django.forms import TextInput, ModelForm
 from django.core.exceptions import ValidationError
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
@@ -12,6 +12,27 @@ admin.site.site_title = "Top 100 Films"
 admin.site.site_header = "Top 100 Films - Admin Panel"
 admin.site.index_title = "Admin Home Page"
 
+
+def film_links_prefetch(lookup):
+    """Prefetches a film relation with just the fields show_film_links() renders"""
+    # language is needed to match Language.film_set's prefetched films to their language
+    return Prefetch(lookup, queryset=Film.objects.only('id', 'title', 'language').order_by('ranking'))
+
+
+class ChangeFormPrefetchMixin:
+    """
+    Prefetches change_form_prefetch for the object of a change form only, so that the
+    changelist doesn't load the (possibly large) relations its rows never display
+    """
+    change_form_prefetch = ()
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None and self.change_form_prefetch:
+            prefetch_related_objects([obj], *self.change_form_prefetch)
+        return obj
+
+
 class FilmEraFilter(admin.SimpleListFilter):
     title = 'Film Era'
     parameter_name = 'era'
@@ -60,11 +81,21 @@ class FilmAdmin(admin.ModelAdmin):
     fields = ['title', 'ttcode', ('ranking', 'watched'), 'imdb_rating', 'meta_score', 'year', 'plot',
               'poster_url', 'display_poster', 'language', 'genres', ('directors','actors')]
     readonly_fields = ['display_poster']
+    # The catalog has far too many people to list as <select> options
+    autocomplete_fields = ['directors', 'actors']
     formfield_overrides = {
         models.CharField: {'widget': TextInput(attrs={'size': '86'})}
     }
     save_on_top = True
 
+    def get_queryset(self, request):
+        # Backs display_directors/display_actors/display_genres, one query per relation per page
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('directors', queryset=Person.objects.only('id', 'name')),
+            Prefetch('actors', queryset=Person.objects.only('id', 'name')),
+            Prefetch('genres', queryset=Genre.objects.only('id', 'name')),
+        )
+
     def mark_as_watched(self, request, queryset):
         queryset.update(watched=True)
 
@@ -82,12 +113,11 @@ class RoleFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == 'director':
-            return queryset.annotate(num_directed=Count('films_directed')).filter(num_directed__gt=0)
+            return queryset.filter(num_directed__gt=0)
         elif self.value() == 'actor':
-            return queryset.annotate(num_acted=Count('films_acted_in')).filter(num_acted__gt=0)
+            return queryset.filter(num_acted__gt=0)
         elif self.value() == 'both':
-            return queryset.annotate(num_acted=Count('films_acted_in')).annotate(
-                                     num_directed=Count('films_directed')).filter(num_directed__gt=0, num_acted__gt=0)
+            return queryset.filter(num_directed__gt=0, num_acted__gt=0)
         else:
             return queryset
 
@@ -101,17 +131,18 @@ class PersonAdmin(admin.ModelAdmin):
     readonly_fields = ['display_director_credits', 'display_acting_credits']
     ordering = ['name']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            film_links_prefetch('films_directed'), film_links_prefetch('films_acted_in'))
+
 
 @admin.register(Genre)
-class GenreAdmin(admin.ModelAdmin):
+class GenreAdmin(ChangeFormPrefetchMixin, admin.ModelAdmin):
     list_display = ['name', 'display_num_films']
     fields = ['name', 'display_num_films', 'display_films']
     readonly_fields = ['display_num_films', 'display_films']
     ordering = ['name']
-
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.annotate(film_count=Count('films'))
+    change_form_prefetch = [film_links_prefetch('films')]
 
     def display_num_films(self, instance):
         return instance.film_count
@@ -120,14 +151,12 @@ class GenreAdmin(admin.ModelAdmin):
 
 
 @admin.register(Language)
-class LanguageAdmin(admin.ModelAdmin):
+class LanguageAdmin(ChangeFormPrefetchMixin, admin.ModelAdmin):
     list_display = ['name', 'display_num_films']
     fields = ['name', 'display_num_films', 'display_films']
     readonly_fields = ['display_num_films', 'display_films']
-
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.annotate(film_count=Count('film')).order_by('-film_count')
+    ordering = ['-film_count']
+    change_form_prefetch = [film_links_prefetch('film_set')]
 
     def display_num_films(self, instance):
         return instance.film_count
@@ -138,7 +167,9 @@ class LanguageAdmin(admin.ModelAdmin):
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ['comment', 'film', 'author']
+    list_select_related = ['film', 'author']
     search_fields = ['comment', 'film__title', 'author__username']
+    autocomplete_fields = ['film', 'author']
 
 
 class ProfileInline(admin.StackedInline):
@@ -147,6 +178,9 @@ class ProfileInline(admin.StackedInline):
     fields = ['bio', 'display_fav_films']
     readonly_fields = ['bio', 'display_fav_films']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(film_links_prefetch('fav_films'))
+
 class UserAdmin(BaseUserAdmin):
     inlines = (ProfileInline,)
 
@@ -0,0 +1,252 @@
+"""
+Read-only JSON API, version 1, mounted under /api/v1/:
+
+    films         films/<ranking>
+    people        people/<slug>
+    genres        genres/<slug>
+    languages     languages/<slug>
+    comments      comments/<id>       (comments?film=<ranking> lists one film's comments)
+
+?fields=a,b,c picks the fields of each object, among them embedded relations such as a
+film's genres or a person's films_acted_in; each resource has a default set. Lists are
+paged by ?limit=n (at most MAX_PAGE_SIZE) and the opaque ?cursor= of the previous page's
+next_cursor. Like the comment threads' cursors (see views.get_comments_page), it holds
+the sort key of the last object sent rather than an OFFSET, so every page costs the same
+however deep it is.
+
+Objects are built straight from QuerySet.values() rows, without instantiating any model: a
+page takes one query for its rows, joining the foreign keys asked for, plus one query per
+embedded many-valued relation, over the ids of the whole page. Every response carries a
+strong ETag of its body, and is answered with a bodiless 304 Not Modified when the
+request's If-None-Match matches it.
+"""
+
+import json
+import base64
+
+from django.db.models import Q
+from django.http import JsonResponse
+from django.urls import path
+from django.utils.cache import get_conditional_response, set_response_etag
+from django.views.decorators.http import require_safe
+
+from .models import Film, Person, Genre, Language, Comment
+from .routers import replica_reads
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class One:
+    """A foreign key, embedded as an object whose {key: values() lookup} columns are joined into the page's query"""
+
+    def __init__(self, **columns):
+        self.columns = columns
+
+
+class Many:
+    """A many-valued relation, embedded as a list of objects loaded for a whole page in one query"""
+
+    def __init__(self, queryset, owner_column, **columns):
+        self.queryset = queryset
+        self.owner_column = owner_column
+        self.columns = columns
+
+    def load(self, owner_ids):
+        """Returns {owner id: [embedded object, ...]} for owner_ids"""
+        embedded = {owner_id: [] for owner_id in owner_ids}
+        keys = tuple(self.columns)
+        for owner_id, *values in self.queryset.filter(**{f'{self.owner_column}__in': owner_ids}).values_list(
+                self.owner_column, *self.columns.values()):
+            embedded[owner_id].append(dict(zip(keys, values)))
+        return embedded
+
+
+def _films_of(queryset, owner_column, prefix):
+    return Many(queryset.order_by(f'{prefix}ranking'), owner_column, id=f'{prefix}id',
+                ranking=f'{prefix}ranking', title=f'{prefix}title', year=f'{prefix}year')
+
+
+def _people_of(through):
+    return Many(through.objects.order_by('id'), 'film_id', id='person__id', name='person__name', slug='person__slug')
+
+
+class Resource:
+    """
+    An API resource: its rows, the lookup identifying an object in its detail URL, the
+    unique key its lists are sorted and paged by, and its fields -- each a values()
+    lookup, a One or a Many -- along with the fields sent when ?fields= is not given
+    """
+
+    def __init__(self, queryset, lookup, ordering, fields, default_fields, filters=None):
+        self.queryset = queryset
+        self.lookup = lookup
+        self.ordering = ordering
+        self.fields = fields
+        self.default_fields = default_fields
+        self.filters = filters or {}  # query parameter -> lookup its value is matched against
+
+    def field_names(self, requested):
+        """The field names listed in a ?fields= value, raising ValueError on unknown ones"""
+        if not requested:
+            return self.default_fields
+        names = list(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}; available: {', '.join(self.fields)}")
+        return names
+
+    def rows(self, queryset, field_names):
+        """The values() rows of queryset, with the columns of field_names and of the sort key"""
+        columns = {'id', *self.ordering}
+        for name in field_names:
+            spec = self.fields[name]
+            if isinstance(spec, str):
+                columns.add(spec)
+            elif isinstance(spec, One):
+                columns.update(spec.columns.values())
+        return list(queryset.values(*columns))
+
+    def serialize(self, rows, field_names):
+        embedded = {
+            name: self.fields[name].load([row['id'] for row in rows])
+            for name in field_names if isinstance(self.fields[name], Many)
+        }
+        objects = []
+        for row in rows:
+            obj = {}
+            for name in field_names:
+                spec = self.fields[name]
+                if isinstance(spec, str):
+                    obj[name] = row[spec]
+                elif isinstance(spec, One):
+                    obj[name] = {key: row[column] for key, column in spec.columns.items()}
+                else:
+                    obj[name] = embedded[name][row['id']]
+            objects.append(obj)
+        return objects
+
+
+RESOURCES = {
+    'films': Resource(
+        Film.objects.all(), ('int', 'ranking'), ('ranking', 'id'), {
+            'id': 'id', 'ranking': 'ranking', 'title': 'title', 'year': 'year', 'ttcode': 'ttcode',
+            'imdb_rating': 'imdb_rating', 'meta_score': 'meta_score', 'plot': 'plot', 'poster_url': 'poster_url',
+            'fav_count': 'fav_count', 'watchlist_count': 'watchlist_count', 'comment_count': 'comment_count',
+            'updated_at': 'updated_at', 'last_activity_at': 'last_activity_at',
+            'language': One(id='language__id', name='language__name', slug='language__slug'),
+            'genres': Many(Film.genres.through.objects.order_by('genre__name'), 'film_id',
+                           id='genre__id', name='genre__name', slug='genre__slug'),
+            'directors': _people_of(Film.directors.through),
+            'actors': _people_of(Film.actors.through),
+        }, ['id', 'ranking', 'title', 'year', 'imdb_rating', 'meta_score', 'language', 'genres', 'directors'],
+    ),
+    'people': Resource(
+        Person.objects.all(), ('slug', 'slug'), ('name', 'id'), {
+            'id': 'id', 'name': 'name', 'slug': 'slug', 'notes': 'notes',
+            'num_directed': 'num_directed', 'num_acted': 'num_acted', 'updated_at': 'updated_at',
+            'films_directed': _films_of(Film.directors.through.objects, 'person_id', 'film__'),
+            'films_acted_in': _films_of(Film.actors.through.objects, 'person_id', 'film__'),
+        }, ['id', 'name', 'slug', 'num_directed', 'num_acted'],
+    ),
+    'genres': Resource(
+        Genre.objects.all(), ('slug', 'slug'), ('name', 'id'), {
+            'id': 'id', 'name': 'name', 'slug': 'slug', 'film_count': 'film_count', 'updated_at': 'updated_at',
+            'films': _films_of(Film.genres.through.objects, 'genre_id', 'film__'),
+        }, ['id', 'name', 'slug', 'film_count'],
+    ),
+    'languages': Resource(
+        Language.objects.all(), ('slug', 'slug'), ('name', 'id'), {
+            'id': 'id', 'name': 'name', 'slug': 'slug', 'film_count': 'film_count', 'updated_at': 'updated_at',
+            'films': _films_of(Film.objects, 'language_id', ''),
+        }, ['id', 'name', 'slug', 'film_count'],
+    ),
+    'comments': Resource(
+        Comment.objects.all(), ('int', 'id'), ('id',), {
+            'id': 'id', 'comment': 'comment', 'created_at': 'created_at', 'updated_at': 'updated_at',
+            'film': One(id='film__id', ranking='film__ranking', title='film__title'),
+            'author': One(id='author__id', username='author__username'),
+        }, ['id', 'comment', 'created_at', 'film', 'author'], filters={'film': 'film__ranking'},
+    ),
+}
+
+
+def _encode_cursor(resource, row):
+    key = json.dumps([row[field] for field in resource.ordering])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _after_cursor(resource, cursor):
+    """A filter for the rows sorting after the one cursor was made from, raising ValueError if it is malformed"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != len(resource.ordering):
+        raise ValueError("Malformed cursor")
+    after = Q()
+    for i, field in enumerate(resource.ordering):
+        after |= Q(**dict(zip(resource.ordering[:i], key[:i])), **{f'{field}__gt': key[i]})
+    return after
+
+
+def _error(message, status=400):
+    return JsonResponse({"op_succeeded": False, "error": message}, status=status)
+
+
+def _conditional_json(request, payload):
+    """JsonResponse of payload with a strong ETag, or a 304 if it matches the request's If-None-Match"""
+    response = set_response_etag(JsonResponse(payload, status=200))
+    return get_conditional_response(request, etag=response.headers['ETag'], response=response)
+
+
+@require_safe
+@replica_reads
+def list_view(request, resource):
+    """A page of a resource's objects, in the order of its sort key, and the cursor of the next page"""
+    try:
+        field_names = resource.field_names(request.GET.get('fields'))
+        limit = request.GET.get('limit', str(DEFAULT_PAGE_SIZE))
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("limit must be a positive integer")
+        limit = min(int(limit), MAX_PAGE_SIZE)
+        rows = resource.queryset.order_by(*resource.ordering)
+        for param, lookup in resource.filters.items():
+            if request.GET.get(param):
+                rows = rows.filter(**{lookup: request.GET[param]})
+        if request.GET.get('cursor'):
+            rows = rows.filter(_after_cursor(resource, request.GET['cursor']))
+    except (ValueError, TypeError) as e:
+        return _error(str(e))
+    page = resource.rows(rows[:limit + 1], field_names)
+    next_cursor = _encode_cursor(resource, page[limit - 1]) if len(page) > limit else None
+    return _conditional_json(request, {
+        "op_succeeded": True,
+        "results": resource.serialize(page[:limit], field_names),
+        "next_cursor": next_cursor,
+    })
+
+
+@require_safe
+@replica_reads
+def detail_view(request, resource, key):
+    """A single object of a resource, by the lookup of its detail URL"""
+    try:
+        field_names = resource.field_names(request.GET.get('fields'))
+    except ValueError as e:
+        return _error(str(e))
+    rows = resource.rows(resource.queryset.filter(**{resource.lookup[1]: key})[:1], field_names)
+    if not rows:
+        return _error("Not found", status=404)
+    return _conditional_json(request, {"op_succeeded": True, "result": resource.serialize(rows, field_names)[0]})
+
+
+app_name = 'api'
+urlpatterns = [
+    url_pattern
+    for name, resource in RESOURCES.items()
+    for url_pattern in (
+        path(name, list_view, {'resource': resource}, name=f'{name}-list'),
+        path(f'{name}/<{resource.lookup[0]}:key>', detail_view, {'resource': resource}, name=f'{name}-detail'),
+    )
+]
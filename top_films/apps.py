@@ -7,3 +7,9 @@ class TopFilmsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'top_films'
     verbose_name = "Top 100 Films"
+
+    def ready(self):
+        # Connects the signal handlers of the search index, page cache, counters, metrics, live comments,
+        # recommendations, similar films, user cache and change tracking
+        from . import (search, page_cache, counters, metrics, live, recommendations, similar_films, identity,
+                       change_tracking)
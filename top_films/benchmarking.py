@@ -0,0 +1,149 @@
+"""
+Helpers shared by the benchmark management commands: switching to a scratch SQLite
+database, seeding it with a synthetic dataset of configurable scale, and summarising
+latency samples. write_imdb_datasets() writes synthetic IMDb dataset files for the
+IMDb import.
+
+Seeding uses bulk_create() in fixed-size chunks, so memory use stays flat however many
+rows are generated. As bulk_create() sends no signals, the derived data (counters, search
+index, recommendations, similar films, page-cache version) is rebuilt once seeding is done.
+"""
+
+import gzip
+import math
+import random
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from .models import User, Film, Person, Genre, Language, Comment, Profile
+from . import counters, search, page_cache, recommendations, similar_films
+
+SEED_CHUNK_SIZE = 10000
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+def use_scratch_database(path):
+    """Points the default connection at the SQLite file at path, and migrates it"""
+    connection.close()
+    connection.settings_dict['NAME'] = str(path)
+    call_command('migrate', verbosity=0)
+
+
+def percentile(samples, pct):
+    """Linearly-interpolated percentile of a list of numbers"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _chunked_create(model, count, make_obj):
+    for start in range(0, count, SEED_CHUNK_SIZE):
+        model.objects.bulk_create([make_obj(i) for i in range(start, min(start + SEED_CHUNK_SIZE, count))])
+
+
+def _zipf_index(rng, size, skew=1.2):
+    """Picks an index in [0, size) with a long-tailed popularity, as real forum activity has"""
+    return min(int(rng.paretovariate(skew)) - 1, size - 1)
+
+
+def seed_synthetic_dataset(films, people, users, comments, favs_per_user=10, seed=86, log=print):
+    """
+    Fills the (empty) current database with a synthetic catalog and forum of the given
+    scale. Rankings run from 1 to films, slugs are 'person-<n>', 'genre-<n>' and
+    'language-<n>', and usernames are 'user<n>', all sharing BENCHMARK_PASSWORD.
+    """
+    rng = random.Random(seed)
+    num_genres, num_languages = 25, 50
+    with transaction.atomic():
+        log(f"Seeding {num_genres} genres, {num_languages} languages and {people} people...")
+        _chunked_create(Genre, num_genres, lambda i: Genre(id=i + 1, name=f"Genre {i}", slug=f"genre-{i}"))
+        _chunked_create(Language, num_languages, lambda i: Language(id=i + 1, name=f"Language {i}", slug=f"language-{i}"))
+        _chunked_create(Person, people, lambda i: Person(id=i + 1, name=f"Person {i}", slug=f"person-{i}"))
+
+        log(f"Seeding {films} films and their credits...")
+        _chunked_create(Film, films, lambda i: Film(
+            id=i + 1, ranking=i + 1, ttcode=f"tt{i:08}", title=f"Synthetic Film {i}", year=rng.randint(1920, 2022),
+            imdb_rating=round(rng.uniform(5, 10), 1), meta_score=rng.randint(30, 100),
+            plot=f"The synthetic plot of film number {i}.", poster_url="",
+            language_id=_zipf_index(rng, num_languages) + 1))
+        for through, per_film, num_targets, target_fk in (
+                (Film.genres.through, 2, num_genres, 'genre_id'),
+                (Film.directors.through, 1, people, 'person_id'),
+                (Film.actors.through, 4, people, 'person_id')):
+            for start in range(0, films, SEED_CHUNK_SIZE):
+                through.objects.bulk_create([
+                    through(film_id=film_id, **{target_fk: target_id})
+                    for film_id in range(start + 1, min(start + SEED_CHUNK_SIZE, films) + 1)
+                    for target_id in rng.sample(range(1, num_targets + 1), min(per_film, num_targets))
+                ])
+
+        log(f"Seeding {users} users with {favs_per_user} favs and watchlist entries each...")
+        password = make_password(BENCHMARK_PASSWORD)
+        _chunked_create(User, users, lambda i: User(id=i + 1, username=f"user{i}", password=password))
+        _chunked_create(Profile, users, lambda i: Profile(id=i + 1, user_id=i + 1))
+        users_per_chunk = max(SEED_CHUNK_SIZE // max(favs_per_user, 1), 1)
+        for through in (Profile.fav_films.through, Profile.films_to_watch.through):
+            for start in range(0, users, users_per_chunk):
+                stop = min(start + users_per_chunk, users)
+                through.objects.bulk_create([
+                    through(profile_id=profile_id, film_id=film_id + 1)
+                    for profile_id in range(start + 1, stop + 1)
+                    for film_id in {_zipf_index(rng, films) for _ in range(favs_per_user)}
+                ])
+
+        log(f"Seeding {comments} comments...")
+        if users:
+            _chunked_create(Comment, comments, lambda i: Comment(
+                comment=f"Synthetic comment number {i} about this film.", film_id=_zipf_index(rng, films) + 1,
+                author_id=rng.randint(1, users)))
+
+        log("Rebuilding counters, the search index, the recommendations and the similar films...")
+        counters.recount_all()
+        search.rebuild_index()
+        recommendations.rebuild()
+        similar_films.rebuild()
+    page_cache.bump_catalog_version()
+
+
+IMDB_TITLE_TYPES = ['movie'] * 4 + ['tvEpisode'] * 5 + ['short']
+IMDB_CATEGORIES = ['director', 'actor', 'actress', 'actor', 'actress', 'writer', 'producer', 'composer', 'self']
+
+
+def write_imdb_datasets(directory, titles, people, seed=86):
+    """
+    Writes synthetic title.basics, title.ratings, title.principals and name.basics .tsv.gz
+    files in the IMDb datasets' format into directory. A mix of title types, adult titles,
+    unrated titles, missing years and repeated titles and names exercises the import's filters
+    and name clashes.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    genres = [f"Genre {i}" for i in range(25)]
+    with gzip.open(directory / 'name.basics.tsv.gz', 'wt', encoding='utf-8', compresslevel=1) as names:
+        names.write("nconst\tprimaryName\tbirthYear\tdeathYear\tprimaryProfession\tknownForTitles\n")
+        for i in range(1, people + 1):
+            names.write(f"nm{i:07d}\tPerson {i % max(people * 9 // 10, 1)}\t{rng.randint(1900, 2000)}\t\\N\t"
+                        f"actor\t\\N\n")
+    with gzip.open(directory / 'title.basics.tsv.gz', 'wt', encoding='utf-8', compresslevel=1) as basics, \
+            gzip.open(directory / 'title.ratings.tsv.gz', 'wt', encoding='utf-8', compresslevel=1) as ratings, \
+            gzip.open(directory / 'title.principals.tsv.gz', 'wt', encoding='utf-8', compresslevel=1) as principals:
+        basics.write("tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\t"
+                     "runtimeMinutes\tgenres\n")
+        ratings.write("tconst\taverageRating\tnumVotes\n")
+        principals.write("tconst\tordering\tnconst\tcategory\tjob\tcharacters\n")
+        for i in range(1, titles + 1):
+            title = f"Synthetic Title {i % max(titles * 8 // 10, 1)}"
+            year = rng.randint(1900, 2024) if rng.random() > 0.02 else '\\N'
+            basics.write(f"tt{i:07d}\t{rng.choice(IMDB_TITLE_TYPES)}\t{title}\t{title}\t{int(rng.random() < 0.01)}\t"
+                         f"{year}\t\\N\t{rng.randint(60, 200)}\t{','.join(rng.sample(genres, rng.randint(1, 3)))}\n")
+            if rng.random() < 0.9:
+                ratings.write(f"tt{i:07d}\t{rng.randint(10, 100) / 10}\t{int(rng.paretovariate(0.8)) * 10}\n")
+            for ordering in range(1, rng.randint(6, 10) + 1):
+                principals.write(f"tt{i:07d}\t{ordering}\tnm{rng.randint(1, people):07d}\t"
+                                 f"{rng.choice(IMDB_CATEGORIES)}\t\\N\t\\N\n")
@@ -0,0 +1,221 @@
+"""
+Change tracking for conditional GETs of the catalog's HTML pages.
+
+Film, Person, Genre, Language and Comment have an updated_at timestamp, set by save(). The
+handlers below also bump it wherever a page shows data changed elsewhere: a film's page
+names its directors, actors, genres and language, and the pages of people, genres and
+languages list their films. Films additionally have a last_activity_at timestamp, bumped
+when comments on them are posted, edited or deleted, when a commenter is renamed, and when
+their "fans also liked" or similar films are recomputed (see touch_film_activity()).
+
+conditional_page() decorates a view with a validator, which computes the page's ETag and
+Last-Modified with one indexed query, before the view runs. Anonymous GET/HEAD requests
+whose If-None-Match or If-Modified-Since still matches are answered 304 Not Modified
+without running the view at all; other responses carry the validators as headers.
+Logged-in users' pages are personalised, so they are always rendered in full. List pages
+only get an ETag, which also counts their rows: deleting a row leaves no newer timestamp
+behind for a Last-Modified to move to.
+
+Writes that bypass signals (bulk_create(), QuerySet.update()) should touch() the rows
+whose pages they change.
+"""
+
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.db.models import Count, Max, Q
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Film, Person, Genre, Language, Comment
+
+# Film ids per IN (...) list, within SQLite's limit on query parameters
+ID_CHUNK_SIZE = 500
+
+# through table -> (model on the other side of the film, its column)
+_CREDITS = {
+    Film.directors.through: (Person, 'person_id'),
+    Film.actors.through: (Person, 'person_id'),
+    Film.genres.through: (Genre, 'genre_id'),
+}
+
+
+def touch(queryset, field='updated_at'):
+    """Marks the rows of queryset as changed now"""
+    return queryset.update(**{field: timezone.now()})
+
+
+def touch_film_activity(film_ids=None):
+    """Bumps the last_activity_at of the films with the given ids (all films by default)"""
+    if film_ids is None:
+        touch(Film.objects.all(), 'last_activity_at')
+        return
+    film_ids = list(film_ids)
+    for start in range(0, len(film_ids), ID_CHUNK_SIZE):
+        touch(Film.objects.filter(pk__in=film_ids[start:start + ID_CHUNK_SIZE]), 'last_activity_at')
+
+
+def _films_of_person(person):
+    return Film.objects.filter(Q(directors=person) | Q(actors=person))
+
+
+@receiver(m2m_changed)
+def touch_credits(sender, instance, action, reverse, pk_set, **kwargs):
+    if sender not in _CREDITS:
+        return
+    model, column = _CREDITS[sender]
+    owner_column, other_column = (column, 'film_id') if reverse else ('film_id', column)
+    if action == 'pre_clear':
+        # Remember which rows are about to lose a credit, as post_clear has no pk_set
+        instance._tracking_cleared_ids = list(
+            sender.objects.filter(**{owner_column: instance.pk}).values_list(other_column, flat=True))
+        return
+    if action == 'post_clear':
+        other_ids = instance.__dict__.pop('_tracking_cleared_ids', [])
+    elif action in ('post_add', 'post_remove'):
+        other_ids = list(pk_set or ())
+    else:
+        return
+    if not other_ids:
+        return
+    film_ids, other_model_ids = (other_ids, [instance.pk]) if reverse else ([instance.pk], other_ids)
+    touch(Film.objects.filter(pk__in=film_ids))
+    touch(model.objects.filter(pk__in=other_model_ids))
+
+
+@receiver(pre_save, sender=Film)
+def remember_film_language(sender, instance, **kwargs):
+    instance._tracking_old_language_id = None
+    if instance.pk:
+        instance._tracking_old_language_id = Film.objects.filter(pk=instance.pk).values_list(
+            'language_id', flat=True).first()
+
+
+def _touch_film_listings(film, language_ids):
+    touch(Person.objects.filter(Q(films_directed=film) | Q(films_acted_in=film)))
+    touch(Genre.objects.filter(films=film))
+    touch(Language.objects.filter(pk__in=language_ids))
+
+
+@receiver(post_save, sender=Film)
+def touch_film_listings(sender, instance, **kwargs):
+    language_ids = {instance.language_id, instance.__dict__.pop('_tracking_old_language_id', None)} - {None}
+    _touch_film_listings(instance, language_ids)
+
+
+@receiver(pre_delete, sender=Film)
+def touch_deleted_film_listings(sender, instance, **kwargs):
+    # Deleting a film cascades to its M2M rows without sending m2m_changed
+    _touch_film_listings(instance, [instance.language_id])
+
+
+@receiver(post_save, sender=Person)
+@receiver(pre_delete, sender=Person)
+def touch_person_films(sender, instance, created=False, **kwargs):
+    if not created:
+        touch(_films_of_person(instance))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def touch_genre_films(sender, instance, created=False, **kwargs):
+    if not created:
+        touch(Film.objects.filter(genres=instance))
+
+
+@receiver(post_save, sender=Language)
+def touch_language_films(sender, instance, created, **kwargs):
+    if not created:
+        touch(Film.objects.filter(language=instance))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_commented_film(sender, instance, **kwargs):
+    touch_film_activity([instance.film_id])
+
+
+@receiver(post_save, sender=User)
+def touch_films_commented_by(sender, instance, created, update_fields, **kwargs):
+    # Comments show their author's username; logins only save last_login
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    touch(Film.objects.filter(pk__in=Comment.objects.filter(author=instance).values('film_id')), 'last_activity_at')
+
+
+def _timestamp_etag(*timestamps):
+    # Weak, as the pages embed a freshly masked CSRF token in every rendering
+    return 'W/"{}"'.format('-'.join(str(int(timestamp.timestamp() * 1000000)) for timestamp in timestamps))
+
+
+def list_validator(queryset):
+    """Validator of a list page showing the rows of queryset: an ETag of their count and latest updated_at"""
+    def validator(request, *args, **kwargs):
+        summary = queryset.aggregate(count=Count('pk'), latest=Max('updated_at'))
+        latest = int(summary['latest'].timestamp() * 1000000) if summary['latest'] else 0
+        return f'W/"{summary["count"]}-{latest}"', None
+    return validator
+
+
+def detail_validator(queryset, lookup='slug', timestamp_fields=('updated_at',)):
+    """Validator of the detail page of the row of queryset matching the URL's lookup argument"""
+    def validator(request, *args, **kwargs):
+        timestamps = queryset.filter(**{lookup: kwargs[lookup]}).values_list(*timestamp_fields)[:1]
+        if not timestamps:
+            return None
+        return _timestamp_etag(*timestamps[0]), int(max(timestamps[0]).timestamp())
+    return validator
+
+
+def _is_conditional(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def _add_validators(response, etag, last_modified):
+    if response.status_code == 200:
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return response
+
+
+def conditional_page(validator):
+    """
+    View decorator answering anonymous GET/HEAD requests with 304 Not Modified when the
+    (etag, last_modified) validator(request, *args, **kwargs) computes still matches their
+    If-None-Match or If-Modified-Since. A validator returns None when it can't tell, e.g.
+    when the page's object doesn't exist, and the view then runs as usual.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                # Resolving request.user may query the session and user tables
+                if not await sync_to_async(_is_conditional)(request):
+                    return await view_func(request, *args, **kwargs)
+                validators = await sync_to_async(validator)(request, *args, **kwargs)
+                if validators is None:
+                    return await view_func(request, *args, **kwargs)
+                not_modified = get_conditional_response(request, *validators)
+                if not_modified is not None:
+                    return not_modified
+                return _add_validators(await view_func(request, *args, **kwargs), *validators)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_conditional(request):
+                return view_func(request, *args, **kwargs)
+            validators = validator(request, *args, **kwargs)
+            if validators is None:
+                return view_func(request, *args, **kwargs)
+            not_modified = get_conditional_response(request, *validators)
+            if not_modified is not None:
+                return not_modified
+            return _add_validators(view_func(request, *args, **kwargs), *validators)
+        return wrapper
+    return decorator
@@ -0,0 +1,114 @@
+"""
+Maintenance of the denormalized counter columns: Person.num_directed/num_acted,
+Genre.film_count, Language.film_count and Film.comment_count/fav_count/watchlist_count.
+
+Rather than incrementing and decrementing, every handler recounts the affected rows from
+their source table with a correlated COUNT sub-query. This keeps the counters exact even
+for removals of rows that weren't there, and costs one indexed UPDATE per write. Writes
+that bypass signals (bulk_create(), QuerySet.update()) should be followed by recount(),
+which the `recount` management command runs for every counter.
+"""
+
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Film, Person, Genre, Language, Comment, Profile
+
+# (counted model, counter field, source model, source foreign-key column)
+COUNTERS = [
+    (Person, 'num_directed', Film.directors.through, 'person_id'),
+    (Person, 'num_acted', Film.actors.through, 'person_id'),
+    (Genre, 'film_count', Film.genres.through, 'genre_id'),
+    (Language, 'film_count', Film, 'language_id'),
+    (Film, 'comment_count', Comment, 'film_id'),
+    (Film, 'fav_count', Profile.fav_films.through, 'film_id'),
+    (Film, 'watchlist_count', Profile.films_to_watch.through, 'film_id'),
+]
+
+_M2M_COUNTERS = {source: (model, field, fk) for model, field, source, fk in COUNTERS if source._meta.auto_created}
+
+
+def recount(model, field, source, fk, ids=None):
+    """Recomputes model.field from source for the rows with the given ids (all rows by default)"""
+    source_count = source.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(
+        n=Count('*')).values('n')
+    rows = model.objects.all() if ids is None else model.objects.filter(pk__in=ids)
+    return rows.update(**{field: Coalesce(Subquery(source_count), 0)})
+
+
+def recount_all():
+    for counter in COUNTERS:
+        recount(*counter)
+
+
+@receiver(m2m_changed)
+def recount_m2m_targets(sender, instance, action, reverse, pk_set, **kwargs):
+    if sender not in _M2M_COUNTERS:
+        return
+    model, field, fk = _M2M_COUNTERS[sender]
+    if reverse:
+        # The instance is the counted object itself, e.g. person.films_directed.add(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            recount(model, field, sender, fk, [instance.pk])
+    elif action == 'pre_clear':
+        # Remember which targets are about to lose a row, as post_clear has no pk_set
+        owner_fk = next(f.attname for f in sender._meta.fields if f.is_relation and f.attname != fk)
+        instance._counter_cleared_ids = list(sender.objects.filter(**{owner_fk: instance.pk}).values_list(fk, flat=True))
+    elif action == 'post_clear':
+        recount(model, field, sender, fk, instance.__dict__.pop('_counter_cleared_ids', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        recount(model, field, sender, fk, pk_set)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def recount_film_comments(sender, instance, **kwargs):
+    recount(Film, 'comment_count', Comment, 'film_id', [instance.film_id])
+
+
+@receiver(pre_save, sender=Film)
+def remember_film_language(sender, instance, **kwargs):
+    instance._counter_old_language_id = None
+    if instance.pk:
+        instance._counter_old_language_id = Film.objects.filter(pk=instance.pk).values_list(
+            'language_id', flat=True).first()
+
+
+@receiver(post_save, sender=Film)
+def recount_film_language(sender, instance, **kwargs):
+    language_ids = {instance.language_id, instance.__dict__.pop('_counter_old_language_id', None)} - {None}
+    recount(Language, 'film_count', Film, 'language_id', language_ids)
+
+
+@receiver(pre_delete, sender=Film)
+def remember_film_credits(sender, instance, **kwargs):
+    # Deleting a film cascades to its M2M rows without sending m2m_changed
+    instance._counter_credit_ids = {
+        source: list(source.objects.filter(film_id=instance.pk).values_list(fk, flat=True))
+        for source, (model, field, fk) in _M2M_COUNTERS.items() if model is not Film
+    }
+
+
+@receiver(post_delete, sender=Film)
+def recount_film_credits(sender, instance, **kwargs):
+    for source, ids in instance.__dict__.pop('_counter_credit_ids', {}).items():
+        model, field, fk = _M2M_COUNTERS[source]
+        recount(model, field, source, fk, ids)
+    recount(Language, 'film_count', Film, 'language_id', [instance.language_id])
+
+
+@receiver(pre_delete, sender=Profile)
+def remember_profile_films(sender, instance, **kwargs):
+    instance._counter_film_ids = {
+        source: list(source.objects.filter(profile_id=instance.pk).values_list('film_id', flat=True))
+        for source, (model, field, fk) in _M2M_COUNTERS.items() if model is Film
+    }
+
+
+@receiver(post_delete, sender=Profile)
+def recount_profile_films(sender, instance, **kwargs):
+    for source, ids in instance.__dict__.pop('_counter_film_ids', {}).items():
+        model, field, fk = _M2M_COUNTERS[source]
+        recount(model, field, source, fk, ids)
@@ -0,0 +1,48 @@
+"""
+Work that signal handlers batch up until the current transaction commits, so that e.g. a
+form saving several relations of a film triggers one refresh instead of one per relation.
+
+defer(callback, film_ids=[...]) registers callback with transaction.on_commit() the first
+time it is deferred in a transaction, and only adds to its ids after that. The batch is
+referenced by the connection's on-commit list alone (the thread-local registry holds it
+weakly), so when the transaction or the savepoint that registered it rolls back and Django
+drops the callback, its ids go with it instead of leaking into the next transaction.
+"""
+
+import threading
+import weakref
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+_registry = threading.local()
+
+
+class _Batch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.ids = defaultdict(set)
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        self.callback(**{name: sorted(ids) for name, ids in self.ids.items()})
+
+
+def defer(callback, using=None, **ids):
+    """
+    Calls callback(name=sorted ids, ...) after the current transaction commits (at once in
+    autocommit mode), with the union of the ids given to every defer() of callback in it
+    """
+    batches = getattr(_registry, 'batches', None)
+    if batches is None:
+        batches = _registry.batches = weakref.WeakValueDictionary()
+    key = (callback, using or DEFAULT_DB_ALIAS)
+    batch = batches.get(key)
+    is_new = batch is None or batch.done
+    if is_new:
+        batch = batches[key] = _Batch(callback)
+    for name, values in ids.items():
+        batch.ids[name].update(values)
+    if is_new:
+        transaction.on_commit(batch, using=using)
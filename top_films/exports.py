@@ -0,0 +1,134 @@
+"""
+Streaming bulk exports of the catalog, the comments and the users' fav and watchlist lists,
+as CSV or JSON Lines, optionally gzipped. Served by the staff-only export view and written
+by the export_data management command.
+
+Rows are read in primary-key order with QuerySet.iterator(), which fetches
+EXPORT_CHUNK_SIZE rows at a time and runs each prefetch_related() lookup once per chunk,
+and they are encoded and (if asked) compressed as they are read. Memory use therefore
+stays flat whatever the size of the tables. The first column of every dataset is the
+row's primary key, and an export can be restricted to the pk range (after, until], so an
+interrupted export is resumed by re-running it after the last pk received.
+"""
+
+import io
+import csv
+import json
+import zlib
+
+from django.db.models import Prefetch
+
+from .models import Film, Person, Genre, Comment, Profile
+
+EXPORT_CHUNK_SIZE = 2000
+# Encoded output is handed on in pieces of about this many bytes, rather than row by row
+OUTPUT_BUFFER_SIZE = 64 * 1024
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def _names(related):
+    return "; ".join(obj.name for obj in related.all())
+
+
+def _film_rows():
+    return Film.objects.select_related('language').prefetch_related(
+        Prefetch('directors', queryset=Person.objects.only('id', 'name')),
+        Prefetch('actors', queryset=Person.objects.only('id', 'name')),
+        Prefetch('genres', queryset=Genre.objects.only('id', 'name')),
+    )
+
+
+def _credit_rows(through):
+    return lambda: through.objects.select_related('film', 'person').only('id', 'film__id', 'film__title', 'person__id', 'person__name')
+
+
+def _list_rows(through):
+    return lambda: through.objects.select_related('profile__user', 'film').only(
+        'id', 'profile__user__id', 'profile__user__username', 'film__id', 'film__title')
+
+
+# dataset -> (queryset factory, column names, row -> column values)
+EXPORTS = {
+    'films': (_film_rows, (
+        'id', 'ranking', 'title', 'year', 'ttcode', 'imdb_rating', 'meta_score', 'language', 'genres', 'directors',
+        'actors', 'fav_count', 'watchlist_count', 'comment_count'
+    ), lambda f: (
+        f.id, f.ranking, f.title, f.year, f.ttcode, f.imdb_rating, f.meta_score, f.language.name, _names(f.genres),
+        _names(f.directors), _names(f.actors), f.fav_count, f.watchlist_count, f.comment_count
+    )),
+    'directing-credits': (_credit_rows(Film.directors.through), ('id', 'film_id', 'film', 'person_id', 'person'),
+                          lambda c: (c.id, c.film.id, c.film.title, c.person.id, c.person.name)),
+    'acting-credits': (_credit_rows(Film.actors.through), ('id', 'film_id', 'film', 'person_id', 'person'),
+                       lambda c: (c.id, c.film.id, c.film.title, c.person.id, c.person.name)),
+    'comments': (lambda: Comment.objects.select_related('film', 'author').only(
+        'id', 'film__id', 'film__title', 'author__id', 'author__username', 'created_at', 'comment'),
+        ('id', 'film_id', 'film', 'author_id', 'author', 'created_at', 'comment'),
+        lambda c: (c.id, c.film.id, c.film.title, c.author.id, c.author.username, c.created_at.isoformat(), c.comment)),
+    'favs': (_list_rows(Profile.fav_films.through), ('id', 'user_id', 'username', 'film_id', 'film'),
+             lambda e: (e.id, e.profile.user.id, e.profile.user.username, e.film.id, e.film.title)),
+    'watchlists': (_list_rows(Profile.films_to_watch.through), ('id', 'user_id', 'username', 'film_id', 'film'),
+                   lambda e: (e.id, e.profile.user.id, e.profile.user.username, e.film.id, e.film.title)),
+}
+
+
+def export_rows(dataset, after=None, until=None):
+    """Yields the column values of dataset's rows with after < pk <= until, in pk order"""
+    queryset_factory, _, row_values = EXPORTS[dataset]
+    rows = queryset_factory()
+    if after is not None:
+        rows = rows.filter(pk__gt=after)
+    if until is not None:
+        rows = rows.filter(pk__lte=until)
+    for obj in rows.order_by('pk').iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield row_values(obj)
+
+
+def _buffered(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= OUTPUT_BUFFER_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _encode_csv(columns, rows, header):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    if header:
+        writer.writerow(columns)
+    for values in rows:
+        writer.writerow(values)
+        yield line.getvalue().encode()
+        line.seek(0)
+        line.truncate()
+    # The header of an export with no rows
+    if line.tell():
+        yield line.getvalue().encode()
+
+
+def _encode_jsonl(columns, rows):
+    for values in rows:
+        yield (json.dumps(dict(zip(columns, values)), ensure_ascii=False) + "\n").encode()
+
+
+def gzipped(chunks):
+    """Gzips a stream of byte strings incrementally; concatenated gzip streams form a valid gzip file"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(dataset, export_format='csv', compress=False, after=None, until=None, header=True):
+    """Yields the export of dataset as byte strings, ready to be written or streamed out"""
+    columns = EXPORTS[dataset][1]
+    rows = export_rows(dataset, after, until)
+    encoded = _encode_csv(columns, rows, header) if export_format == 'csv' else _encode_jsonl(columns, rows)
+    stream = _buffered(encoded)
+    return gzipped(stream) if compress else stream
@@ -0,0 +1,163 @@
+"""
+Cached look-up of the authenticated user and their Profile.
+
+AuthenticationMiddleware loads request.user through the session's authentication backend.
+CachedModelBackend serves that look-up from user_cache, a bounded, process-local LRU of
+User instances with their Profile attached, so an identity cache hit runs no queries at
+all, and user.profile none either. Django's own get_user() still verifies the session's
+auth hash against the cached user's password hash, so the cache never extends a session.
+
+Entries are dropped once the transaction that saves or deletes the User or its Profile
+commits (dropping them earlier would let a concurrent request cache the old row again).
+That covers password changes (set_password() is followed by save()) and the last_login
+update made at every login. Writes that bypass signals (QuerySet.update()) are picked up
+when the entry expires, after USER_CACHE_TIMEOUT seconds. Each request gets its own copy of the
+cached instances, so per-request state such as the permission cache is never shared.
+
+Each process's LRU only sees its own invalidations. With several processes, set
+USER_CACHE_ALIAS to a cache shared between them (Redis, Memcached): entries then live in
+that cache, which all processes invalidate, and are kept locally for only
+USER_CACHE_LOCAL_TIMEOUT seconds.
+
+Sessions record the backend that logged them in. CachedBackendSessionMiddleware moves
+sessions logged in through ModelBackend, before CachedModelBackend was installed, over to it.
+"""
+
+import copy
+import time
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+
+from . import deferred
+from .models import User, Profile
+
+USER_CACHE_SIZE = getattr(settings, 'USER_CACHE_SIZE', 1000)
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 5 * 60)
+USER_CACHE_ALIAS = getattr(settings, 'USER_CACHE_ALIAS', None)
+USER_CACHE_LOCAL_TIMEOUT = 5
+
+CACHED_MODEL_BACKEND = 'top_films.identity.CachedModelBackend'
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+class UserCache:
+    """Thread-safe LRU of {user id: User}, optionally backed by a shared Django cache"""
+
+    def __init__(self, max_size, timeout, shared_alias=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.shared_alias = shared_alias
+        self.local_timeout = USER_CACHE_LOCAL_TIMEOUT if shared_alias else timeout
+        self._entries = OrderedDict()  # user id -> (expiry time, User)
+        self._generations = Counter()  # user id -> number of invalidations, to spot racing loads
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _key(self, user_id):
+        return f'top_films:user:{user_id}'
+
+    def get(self, user_id):
+        """Returns a copy of the cached User, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.stats['hits'] += 1
+                return copy.deepcopy(entry[1])
+            self._entries.pop(user_id, None)
+        user = caches[self.shared_alias].get(self._key(user_id)) if self.shared_alias else None
+        with self._lock:
+            self.stats['hits' if user is not None else 'misses'] += 1
+        if user is not None:
+            self._store_locally(user_id, user)
+            return copy.deepcopy(user)
+        return None
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations[user_id]
+
+    def set(self, user_id, user, generation):
+        """Caches user, unless it was invalidated after its load began (generation is then out of date)"""
+        with self._lock:
+            if self._generations[user_id] != generation:
+                return
+        if self.shared_alias:
+            caches[self.shared_alias].set(self._key(user_id), user, self.timeout)
+        self._store_locally(user_id, user)
+
+    def _store_locally(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.local_timeout, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] += 1
+        if self.shared_alias:
+            caches[self.shared_alias].delete(self._key(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Returns this process's {'hits': n, 'misses': n} counters and its number of entries"""
+        with self._lock:
+            return {'hits': self.stats['hits'], 'misses': self.stats['misses'], 'size': len(self._entries)}
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TIMEOUT, USER_CACHE_ALIAS)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user() is served from user_cache, with the user's Profile loaded alongside"""
+
+    def get_user(self, user_id):
+        user = user_cache.get(user_id)
+        if user is None:
+            generation = user_cache.generation(user_id)
+            try:
+                user = User._default_manager.select_related('profile').get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            user_cache.set(user_id, user, generation)
+            user = copy.deepcopy(user)
+        return user if self.user_can_authenticate(user) else None
+
+
+class CachedBackendSessionMiddleware(MiddlewareMixin):
+    """Moves ModelBackend sessions over to CachedModelBackend; goes before AuthenticationMiddleware"""
+
+    def process_request(self, request):
+        if request.session.get(BACKEND_SESSION_KEY) == MODEL_BACKEND:
+            request.session[BACKEND_SESSION_KEY] = CACHED_MODEL_BACKEND
+
+
+def invalidate_users(user_ids):
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, using=None, **kwargs):
+    deferred.defer(invalidate_users, using=using, user_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile_user(sender, instance, using=None, **kwargs):
+    deferred.defer(invalidate_users, using=using, user_ids=[instance.user_id])
@@ -0,0 +1,189 @@
+"""
+Streaming readers for the IMDb non-commercial datasets (https://datasets.imdbws.com/), as
+used by the import_imdb_datasets management command: title.basics, title.ratings,
+title.principals and name.basics, each a gzipped TSV file with a header line and \\N for
+missing values.
+
+A file is decompressed as it is read and cut into blocks of whole lines, which a pool of
+worker processes parses in file order, with only a few blocks in flight at a time, so
+memory use doesn't grow with the size of the file. Each parser keeps just the rows the
+import needs, and returns them as NumPy arrays or short lists of tuples. IMDb ids
+(tt0111161, nm0000151) are held as the integers they number, and the files are joined
+through IdMaps -- sorted arrays of ids searched with np.searchsorted -- rather than dicts
+of rows.
+
+The module doesn't use Django, so that worker processes can import it whatever the
+multiprocessing start method.
+"""
+
+import gzip
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DATASETS = ('title.basics', 'title.ratings', 'title.principals', 'name.basics')
+BLOCK_SIZE = 4 * 1024 * 1024
+NULL = '\\N'
+# Film.year has to be greater than this (see the year_valid constraint)
+MIN_YEAR = 1876
+
+# title.principals categories -> the credit they are imported as
+DIRECTOR, ACTOR = 1, 2
+CATEGORIES = {'director': DIRECTOR, 'actor': ACTOR, 'actress': ACTOR}
+
+
+def title_code(number):
+    return f'tt{number:07d}'
+
+
+def name_code(number):
+    return f'nm{number:07d}'
+
+
+class IdMap:
+    """A read-only map from integer ids to rows of values, held in NumPy arrays sorted by id"""
+
+    def __init__(self, ids, *columns):
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        self.ids = ids[order]
+        self.columns = [np.asarray(column)[order] for column in columns]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, ids):
+        """The positions of ids in the map, and a mask of the ids it contains"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(len(ids), dtype=np.intp), np.zeros(len(ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return positions, self.ids[positions] == ids
+
+    def contains(self, ids):
+        return self.find(ids)[1]
+
+    def get(self, ids, column=0):
+        """The column values of ids, and a mask of the ids found (the values of the others are meaningless)"""
+        positions, found = self.find(ids)
+        return self.columns[column][positions], found
+
+
+def read_blocks(path, block_size=BLOCK_SIZE):
+    """Yields the lines of a gzipped TSV file, after its header, in blocks of whole lines"""
+    with gzip.open(path, 'rb') as tsv_file:
+        tsv_file.readline()
+        remainder = b''
+        while data := tsv_file.read(block_size):
+            end = data.rfind(b'\n') + 1
+            if not end:
+                remainder += data
+                continue
+            yield remainder + data[:end]
+            remainder = data[end:]
+        if remainder:
+            yield remainder
+
+
+# What the parsers of the current process look rows up in, set by _init_worker()
+_context = {}
+
+
+def _init_worker(context):
+    _context.clear()
+    _context.update(context)
+
+
+def parse_blocks(path, parser, context=None, workers=1):
+    """
+    Yields (lines read, parser(block)) for each block of the file at path, in order. With
+    workers > 1 the blocks are parsed by a process pool, at most 2 * workers at a time. The
+    parsers read the context dict -- IdMaps and options -- from a module global, which the
+    pool sets once per worker rather than pickling it with every block.
+    """
+    context = context or {}
+    if workers <= 1:
+        _init_worker(context)
+        for block in read_blocks(path):
+            yield block.count(b'\n'), parser(block)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(context,)) as pool:
+        pending = deque()
+        for block in read_blocks(path):
+            pending.append((block.count(b'\n'), pool.submit(parser, block)))
+            if len(pending) >= 2 * workers:
+                num_lines, parsed = pending.popleft()
+                yield num_lines, parsed.result()
+        while pending:
+            num_lines, parsed = pending.popleft()
+            yield num_lines, parsed.result()
+
+
+def _lines(block):
+    return block.decode('utf-8').splitlines()
+
+
+def parse_ratings(block):
+    """(title ids, ratings in tenths, vote counts) arrays of a block of title.ratings"""
+    title_ids, ratings, votes = [], [], []
+    for line in _lines(block):
+        tconst, rating, num_votes = line.split('\t')
+        title_ids.append(int(tconst[2:]))
+        ratings.append(round(float(rating) * 10))
+        votes.append(int(num_votes))
+    return (np.array(title_ids, dtype=np.int64), np.array(ratings, dtype=np.int16),
+            np.array(votes, dtype=np.int32))
+
+
+def parse_basics(block):
+    """
+    (title id, title, year, [genre], rating in tenths, votes) of the titles of a block of
+    title.basics that are of one of the context's title_types, not adult, dated after
+    MIN_YEAR, and rated in the context's ratings IdMap by at least min_votes votes
+    """
+    title_types, ratings, min_votes = _context['title_types'], _context['ratings'], _context['min_votes']
+    candidates = []
+    for line in _lines(block):
+        fields = line.split('\t')
+        if fields[1] in title_types and fields[4] == '0' and fields[5].isdigit() and int(fields[5]) > MIN_YEAR:
+            candidates.append(fields)
+    if not candidates:
+        return []
+    title_ids = np.array([int(fields[0][2:]) for fields in candidates], dtype=np.int64)
+    positions, found = ratings.find(title_ids)
+    rated, votes = ratings.columns[0][positions], ratings.columns[1][positions]
+    return [
+        (int(title_ids[i]), fields[2], int(fields[5]), [] if fields[8] == NULL else fields[8].split(','),
+         int(rated[i]), int(votes[i]))
+        for i, fields in enumerate(candidates) if found[i] and votes[i] >= min_votes
+    ]
+
+
+def parse_principals(block):
+    """
+    (title ids, name ids, credit kinds) arrays of the director and cast credits of a block
+    of title.principals on the titles of the context's titles IdMap, keeping the cast
+    members billed within the first max_cast principals
+    """
+    max_cast = _context['max_cast']
+    title_ids, name_ids, kinds = [], [], []
+    for line in _lines(block):
+        tconst, ordering, nconst, category, _ = line.split('\t', 4)
+        kind = CATEGORIES.get(category)
+        if kind is None or (kind == ACTOR and int(ordering) > max_cast):
+            continue
+        title_ids.append(int(tconst[2:]))
+        name_ids.append(int(nconst[2:]))
+        kinds.append(kind)
+    title_ids = np.array(title_ids, dtype=np.int64)
+    kept = _context['titles'].contains(title_ids)
+    return title_ids[kept], np.array(name_ids, dtype=np.int64)[kept], np.array(kinds, dtype=np.int8)[kept]
+
+
+def parse_names(block):
+    """(name id, name) of the people of a block of name.basics in the context's names IdMap"""
+    rows = [line.split('\t', 2) for line in _lines(block)]
+    name_ids = np.array([int(row[0][2:]) for row in rows], dtype=np.int64)
+    wanted = _context['names'].contains(name_ids)
+    return [(int(name_ids[i]), row[1]) for i, row in enumerate(rows) if wanted[i] and row[1] != NULL]
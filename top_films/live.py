@@ -0,0 +1,162 @@
+"""
+In-process publish/subscribe fan-out of comment changes, feeding the per-film Server-Sent
+Events stream (views.film_comments_stream_view).
+
+Comment post_save/post_delete handlers publish an event once the write's transaction has
+committed. Every subscriber -- one per open stream -- has its own bounded queue on its own
+event loop. A subscriber whose queue fills up (a client too slow to keep up) is dropped
+rather than buffered for without limit: it is sent a final 'overflow' event and its stream
+ends, after which the browser reconnects with a fresh subscription.
+
+Only streams served by the same process are reached, so a deployment running several ASGI
+processes would need a shared broker (e.g. Redis pub/sub) in place of CommentBroker.
+"""
+
+import json
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from .models import Comment
+
+LIVE_QUEUE_SIZE = 100
+LIVE_HEARTBEAT_SECONDS = 15
+# Streams are closed (and reopened by the browser) periodically, which bounds the lifetime
+# of a subscription whose client went away without the server noticing
+LIVE_STREAM_MAX_AGE = 10 * 60
+LIVE_RETRY_MS = 3000
+
+
+class CommentEvent:
+    """A created or deleted comment, formatted lazily as an SSE message for staff and non-staff readers"""
+
+    def __init__(self, kind, comment):
+        self.kind = kind
+        self.comment = comment
+        self.id = comment.id  # a deleted comment's id is cleared once the delete completes
+        if kind == 'comment':
+            self.data = {
+                "id": comment.id, "comment": comment.comment, "author_id": comment.author_id,
+                "author": comment.author.username, "created_at": comment.created_at.isoformat(),
+            }
+        else:
+            self.data = {"id": comment.id}
+        self._messages = {}
+
+    def message(self, user):
+        """Returns the event as SSE bytes, with the comment row rendered as user would see it"""
+        is_staff = user.is_staff
+        if is_staff not in self._messages:
+            data = self.data
+            if self.kind == 'comment':
+                html = render_to_string('top_films/comment_rows.html', {'comments': [self.comment], 'user': user})
+                data = dict(data, html=html)
+            self._messages[is_staff] = f"id: {self.id}\nevent: {self.kind}\ndata: {json.dumps(data)}\n\n".encode()
+        return self._messages[is_staff]
+
+
+class Subscription:
+    """A subscriber's bounded queue of events, living on the event loop that created it"""
+    OVERFLOW = object()
+
+    def __init__(self, film_id):
+        self.film_id = film_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.dropped = False
+
+    def offer(self, event):
+        # Runs on self.loop, so the queue is never touched from another thread
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(self.OVERFLOW)
+
+
+class CommentBroker:
+    """Thread-safe registry of the subscriptions to each film's comments"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, film_id):
+        """Returns a new Subscription; must be called from the subscriber's event loop"""
+        subscription = Subscription(film_id)
+        with self._lock:
+            self._subscriptions[film_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.film_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.film_id]
+
+    def has_subscribers(self, film_id):
+        with self._lock:
+            return film_id in self._subscriptions
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, film_id, event):
+        """Hands event to every subscriber of film_id; may be called from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(film_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's event loop has been closed
+                self.unsubscribe(subscription)
+
+
+broker = CommentBroker()
+
+
+async def comment_stream(subscription, user):
+    """Async generator of the SSE messages of a subscription's comment changes, with heartbeats"""
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + LIVE_STREAM_MAX_AGE
+    try:
+        yield f"retry: {LIVE_RETRY_MS}\n\n".encode()
+        while loop.time() < closes_at:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            if event is Subscription.OVERFLOW:
+                yield b"event: overflow\ndata: {}\n\n"
+                return
+            yield event.message(user)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@receiver(post_save, sender=Comment)
+def publish_new_comment(sender, instance, created, **kwargs):
+    if created and broker.has_subscribers(instance.film_id):
+        event = CommentEvent('comment', instance)
+        transaction.on_commit(lambda: broker.publish(instance.film_id, event))
+
+
+@receiver(post_delete, sender=Comment)
+def publish_deleted_comment(sender, instance, **kwargs):
+    if broker.has_subscribers(instance.film_id):
+        event = CommentEvent('delete', instance)
+        transaction.on_commit(lambda: broker.publish(instance.film_id, event))
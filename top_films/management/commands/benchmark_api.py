@@ -0,0 +1,161 @@
+"""
+Management command comparing the throughput of the JSON API with that of the HTML pages
+carrying the same data.
+
+    python manage.py benchmark_api --films 10000 --people 200000 --comments 1000000 --db /tmp/bench.sqlite3
+
+A synthetic dataset is seeded into a scratch SQLite database, as for benchmark_views (an
+already-seeded --db file is reused). Each pair of an HTML page and its API equivalent is
+then requested anonymously, with the page cache disabled so that the pages are rendered
+every time, and their requests per second, p50/p95 latency, query count and response size
+are reported. The film list pair compares the one HTML page listing every film with a
+cursor walk of every page of the API's film list, and the "not modified" row times API
+requests revalidated with If-None-Match.
+"""
+
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from top_films import api
+from top_films.benchmarking import percentile, seed_synthetic_dataset, use_scratch_database
+from top_films.models import Film, Person, Genre
+
+FILM_DETAIL_FIELDS = ','.join(name for name in api.RESOURCES['films'].fields)
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of the JSON API with that of the equivalent HTML pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=1000)
+        parser.add_argument('--people', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--db', help="Scratch SQLite file to seed, or to reuse if it is already seeded")
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per page")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            use_scratch_database(options['db'] or Path(tmp_dir) / 'benchmark.sqlite3')
+            if Film.objects.exists():
+                self.stdout.write(f"Reusing the dataset in {connection.settings_dict['NAME']}")
+            else:
+                seed_synthetic_dataset(options['films'], options['people'], options['users'], options['comments'],
+                                       log=self.stdout.write)
+            with override_settings(ALLOWED_HOSTS=['testserver'], CACHES=NO_CACHE):
+                results = self.run_benchmarks(options['iterations'])
+            connection.close()
+
+        self.print_table(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({
+                'scale': {key: options[key] for key in ('films', 'people', 'users', 'comments')},
+                'iterations': options['iterations'],
+                'pages': results,
+            }, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def page_samplers(self):
+        """{page: sampler}, a sampler taking a Random and returning the (url, headers) requests of the page in HTML and API form"""
+        max_ranking = Film.objects.order_by('-ranking').values_list('ranking', flat=True).first()
+        actor_slugs = list(Person.objects.filter(num_acted__gt=0).values_list('slug', flat=True)[:500])
+        genre_slugs = list(Genre.objects.values_list('slug', flat=True))
+
+        film_list_urls, url = [], reverse('api:films-list') + f'?fields=ranking,title,year&limit={api.MAX_PAGE_SIZE}'
+        while url:
+            film_list_urls.append((url, {}))
+            next_cursor = self.client.get(url).json()['next_cursor']
+            url = next_cursor and film_list_urls[0][0] + f'&cursor={next_cursor}'
+        not_modified_url = reverse('api:films-detail', args=[1]) + f'?fields={FILM_DETAIL_FIELDS}'
+        etag = self.client.get(not_modified_url)['ETag']
+
+        def film_detail(rng):
+            ranking = rng.randint(1, max_ranking)
+            return ([(reverse('film-detail', args=[ranking]), {})],
+                    [(reverse('api:films-detail', args=[ranking]) + f'?fields={FILM_DETAIL_FIELDS}', {})])
+
+        def film_comments(rng):
+            ranking = rng.randint(1, max_ranking)
+            return ([(reverse('film-comments', args=[ranking]), {})],
+                    [(reverse('api:comments-list') + f'?film={ranking}&limit=25', {})])
+
+        def actor_detail(rng):
+            slug = rng.choice(actor_slugs)
+            return ([(reverse('actor-detail', args=[slug]), {})],
+                    [(reverse('api:people-detail', args=[slug]) + '?fields=id,name,slug,notes,films_acted_in', {})])
+
+        def genre_detail(rng):
+            slug = rng.choice(genre_slugs)
+            return ([(reverse('genre-detail', args=[slug]), {})],
+                    [(reverse('api:genres-detail', args=[slug]) + '?fields=id,name,slug,films', {})])
+
+        return {
+            'film-list': lambda rng: ([(reverse('films'), {})], film_list_urls),
+            'film-detail': film_detail,
+            'film-comments': film_comments,
+            'actor-detail': actor_detail,
+            'genre-detail': genre_detail,
+            'not-modified': lambda rng: (None, [(not_modified_url, {'HTTP_IF_NONE_MATCH': etag})]),
+        }
+
+    def run_benchmarks(self, iterations):
+        self.client = Client(raise_request_exception=False)
+        results = {}
+        for page, sampler in self.page_samplers().items():
+            results[page] = {}
+            for index, kind in enumerate(('html', 'api')):
+                # Both kinds replay the same random sample of films, actors and genres
+                rng = random.Random(86)
+                if sampler(rng)[index] is not None:
+                    results[page][kind] = self.benchmark_page(lambda: sampler(rng)[index], iterations)
+            self.stdout.write(f"  {page} done")
+        return results
+
+    def benchmark_page(self, make_requests, iterations):
+        def send():
+            responses = [self.client.get(url, **headers) for url, headers in make_requests()]
+            return sum(len(response.content) for response in responses), {r.status_code for r in responses}
+
+        send()  # warm-up: compiles templates and fills SQLite's page cache
+        latencies, query_counts, sizes, statuses = [], [], [], set()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                size, page_statuses = send()
+                latencies.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+            sizes.append(size)
+            statuses |= page_statuses
+        elapsed = time.perf_counter() - started
+        return {
+            'requests_per_second': round(iterations / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'queries': max(query_counts),
+            'kib': round(max(sizes) / 1024, 1),
+            'statuses': sorted(statuses),
+        }
+
+    def print_table(self, results):
+        self.stdout.write(f"{'page':<16} {'':<5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8} {'KiB':>9}  status")
+        for page, kinds in results.items():
+            for kind, result in kinds.items():
+                self.stdout.write(
+                    f"{page:<16} {kind:<5} {result['requests_per_second']:>9.1f} {result['p50_ms']:>9.2f} "
+                    f"{result['p95_ms']:>9.2f} {result['queries']:>8} {result['kib']:>9.1f}  "
+                    f"{','.join(map(str, result['statuses']))}")
+            if len(kinds) == 2:
+                self.stdout.write(f"{'':<16} API is {kinds['api']['requests_per_second'] / kinds['html']['requests_per_second']:.1f}x "
+                                  f"the HTML page's throughput")
@@ -0,0 +1,225 @@
+"""
+Management command comparing the sustained throughput of the catalog read path when served
+through the project's ASGI application and through its WSGI application.
+
+    python manage.py benchmark_asgi_wsgi --connections 200 --workers 8 --client-delay 250 --duration 10
+
+Both applications are driven in-process, so no server needs to be installed. Each of the
+--connections simulated clients requests random catalog pages back-to-back for --duration
+seconds, and spends --client-delay milliseconds sending each request and reading its
+response, as a slow client would. Under WSGI that time is spent inside one of the
+--workers threads (as with a threaded sync server), while under ASGI it is spent awaiting
+the event loop, so it holds no worker. Completed requests per second and latency
+percentiles are reported for both.
+
+The dataset is seeded as for benchmark_views. The catalog page cache is disabled unless
+--page-cache is given, so that the views themselves are measured.
+"""
+
+import io
+import json
+import time
+import random
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+
+from top_films.benchmarking import percentile, seed_synthetic_dataset, use_scratch_database
+from top_films.models import User, Film, Person, Genre, Language
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def catalog_urls(count, seed=86):
+    """Returns count random paths of the read-only catalog views"""
+    rng = random.Random(seed)
+    max_ranking = Film.objects.order_by('-ranking').values_list('ranking', flat=True).first()
+    slugs = {
+        'genre-detail': list(Genre.objects.values_list('slug', flat=True)[:500]),
+        'language-detail': list(Language.objects.values_list('slug', flat=True)[:500]),
+        'director-detail': list(Person.objects.filter(num_directed__gt=0).values_list('slug', flat=True)[:500]),
+        'actor-detail': list(Person.objects.filter(num_acted__gt=0).values_list('slug', flat=True)[:500]),
+    }
+    user_ids = list(User.objects.values_list('id', flat=True)[:500])
+    makers = [
+        lambda: reverse('index'),
+        lambda: reverse('films'),
+        lambda: reverse('film-detail', args=[rng.randint(1, max_ranking)]),
+        lambda: reverse('film-detail', args=[rng.randint(1, max_ranking)]),
+        lambda: reverse('user-info', args=[rng.choice(user_ids)]),
+        lambda: reverse('genres'),
+        lambda: reverse('languages'),
+        lambda: reverse('directors'),
+        lambda: f"{reverse('actors')}?page={rng.randint(1, 5)}",
+    ] + [lambda name=name: reverse(name, args=[rng.choice(slugs[name])]) for name in slugs if slugs[name]]
+    return [rng.choice(makers)() for _ in range(count)]
+
+
+def _split_path(url):
+    path, _, query = url.partition('?')
+    return path, query
+
+
+def _summary(latencies, statuses, elapsed):
+    return {
+        'requests': len(latencies),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'errors': sum(1 for status in statuses if status >= 500),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compares the catalog views' concurrent throughput under ASGI and WSGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=1000)
+        parser.add_argument('--people', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--db', help="Scratch SQLite file to seed, or to reuse if it is already seeded")
+        parser.add_argument('--connections', type=int, default=200, help="Concurrent simulated clients")
+        parser.add_argument('--workers', type=int, default=8, help="WSGI worker threads")
+        parser.add_argument('--client-delay', type=float, default=250, help="Milliseconds each client spends on I/O per request")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds each server is measured for")
+        parser.add_argument('--page-cache', action='store_true', help="Leave the catalog page cache enabled")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            use_scratch_database(options['db'] or Path(tmp_dir) / 'benchmark.sqlite3')
+            if Film.objects.exists():
+                self.stdout.write(f"Reusing the dataset in {connection.settings_dict['NAME']}")
+            else:
+                seed_synthetic_dataset(options['films'], options['people'], options['users'], options['comments'],
+                                       log=self.stdout.write)
+            urls = catalog_urls(10000)
+            overrides = {'DEBUG': False, 'ALLOWED_HOSTS': ['testserver']}
+            if not options['page_cache']:
+                overrides['CACHES'] = DUMMY_CACHES
+            delay = options['client_delay'] / 1000
+            with override_settings(**overrides):
+                results = {
+                    'wsgi': self.run_wsgi(urls, options['connections'], options['workers'], delay, options['duration']),
+                    'asgi': self.run_asgi(urls, options['connections'], delay, options['duration']),
+                }
+            connection.close()
+
+        self.stdout.write(f"{'server':<8} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for server, result in results.items():
+            self.stdout.write(
+                f"{server:<8} {result['requests']:>9} {result['requests_per_sec']:>9.1f} {result['p50_ms']:>9.2f} "
+                f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['errors']:>7}")
+        if options['output']:
+            run_options = {key: options[key] for key in ('connections', 'workers', 'client_delay', 'duration', 'page_cache')}
+            Path(options['output']).write_text(json.dumps({'options': run_options, 'results': results}, indent=2))
+
+    def run_wsgi(self, urls, connections, workers, delay, duration):
+        """Runs the clients against the WSGI application, served by a pool of worker threads"""
+        application = get_wsgi_application()
+
+        def serve(url):
+            # A sync worker is tied up for the whole exchange, including the slow client's I/O
+            time.sleep(delay / 2)
+            path, query = _split_path(url)
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'testserver', 'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+                'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+                'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status = []
+            body = application(environ, lambda status_line, headers: status.append(status_line))
+            try:
+                b''.join(body)
+            finally:
+                body.close()
+            time.sleep(delay / 2)
+            return int(status[0].split()[0])
+
+        latencies, statuses = [], []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def client(offset):
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                status = pool.submit(serve, urls[i % len(urls)]).result()
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses.append(status)
+                i += connections
+
+        self.stdout.write(f"Measuring WSGI with {connections} connections and {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            clients = [threading.Thread(target=client, args=(n,)) for n in range(connections)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        return _summary(latencies, statuses, elapsed)
+
+    def run_asgi(self, urls, connections, delay, duration):
+        """Runs the clients against the ASGI application, on one event loop"""
+        application = get_asgi_application()
+        latencies, statuses = [], []
+
+        async def request(url):
+            path, query = _split_path(url)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', b'testserver')],
+                'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+            }
+            sent_request = False
+            status = []
+
+            async def receive():
+                nonlocal sent_request
+                if not sent_request:
+                    sent_request = True
+                    await asyncio.sleep(delay / 2)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await asyncio.Event().wait()  # the client never disconnects early
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    await asyncio.sleep(delay / 2)
+
+            await application(scope, receive, send)
+            return status[0]
+
+        async def client(offset, deadline):
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                statuses.append(await request(urls[i % len(urls)]))
+                latencies.append((time.perf_counter() - start) * 1000)
+                i += connections
+
+        async def run():
+            deadline = time.perf_counter() + duration
+            await asyncio.gather(*(client(n, deadline) for n in range(connections)))
+
+        self.stdout.write(f"Measuring ASGI with {connections} connections...")
+        start = time.perf_counter()
+        asyncio.run(run())
+        return _summary(latencies, statuses, time.perf_counter() - start)
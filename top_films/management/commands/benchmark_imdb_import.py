@@ -0,0 +1,80 @@
+"""
+Management command timing the IMDb datasets import (see import_imdb_datasets) on synthetic
+dataset files, with each of a list of parser process counts.
+
+    python manage.py benchmark_imdb_import --titles 1000000 --people 500000 --workers 1,2,4,8
+
+The files are written once (or reused from --datasets), and each run imports them into its
+own scratch SQLite database. The rows read per second from each file, the whole import's
+time and the process's peak RSS so far are reported per run (peak RSS never goes down, so
+compare memory use across separate invocations).
+"""
+
+import json
+import resource
+import tempfile
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from top_films import imdb_datasets
+from top_films.benchmarking import use_scratch_database, write_imdb_datasets
+from top_films.management.commands import import_imdb_datasets
+
+
+class Command(BaseCommand):
+    help = "Times the IMDb datasets import on synthetic files with different numbers of parser processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=200000)
+        parser.add_argument('--people', type=int, default=100000)
+        parser.add_argument('--datasets', help="Directory to write the synthetic files to, or reuse them from")
+        parser.add_argument('--workers', default='1,4', help="Comma-separated parser process counts to compare")
+        parser.add_argument('--min-votes', type=int, default=100)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            datasets = Path(options['datasets'] or tmp_dir)
+            if all((datasets / f'{dataset}.tsv.gz').exists() for dataset in imdb_datasets.DATASETS):
+                self.stdout.write(f"Reusing the datasets in {datasets}")
+            else:
+                self.stdout.write(f"Writing {options['titles']} titles and {options['people']} people to {datasets}...")
+                datasets.mkdir(parents=True, exist_ok=True)
+                write_imdb_datasets(datasets, options['titles'], options['people'])
+
+            for workers in (int(value) for value in options['workers'].split(',')):
+                use_scratch_database(Path(tmp_dir) / f'imdb-{workers}.sqlite3')
+                importer = import_imdb_datasets.Command(stdout=self.stdout, stderr=self.stderr)
+                self.stdout.write(f"Importing with {workers} parser process(es)...")
+                call_command(importer, str(datasets), workers=workers, min_votes=options['min_votes'])
+                connection.close()
+                results[workers] = {
+                    'datasets': {
+                        dataset: {'rows': stats['rows'], 'rows_per_second': round(stats['rows'] / stats['seconds'])}
+                        for dataset, stats in importer.stats.items() if dataset != 'total'
+                    },
+                    'total_seconds': round(importer.stats['total']['seconds'], 2),
+                    'films': importer.num_films,
+                    'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                }
+
+        self.print_table(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({
+                'scale': {key: options[key] for key in ('titles', 'people', 'min_votes')},
+                'runs': results,
+            }, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def print_table(self, results):
+        self.stdout.write(f"{'workers':>7} " + ''.join(f"{dataset:>18}" for dataset in imdb_datasets.DATASETS)
+                          + f" {'total s':>9} {'RSS MiB':>9}")
+        for workers, result in results.items():
+            self.stdout.write(
+                f"{workers:>7} " + ''.join(f"{result['datasets'][dataset]['rows_per_second']:>14,} r/s"
+                                           for dataset in imdb_datasets.DATASETS)
+                + f" {result['total_seconds']:>9.1f} {result['peak_rss_mib']:>9.1f}")
@@ -0,0 +1,139 @@
+"""
+Management command timing a full rebuild of the "fans also liked" recommendations, and the
+incremental updates that follow single fav toggles.
+
+    python manage.py benchmark_recommendations --films 10000 --users 100000 --fav-rows 1000000
+
+A catalog and user base are seeded into a scratch SQLite database (see benchmark_views),
+then --fav-rows distinct (user, film) fav rows (and --watchlist-rows watchlist rows) are
+drawn with a long-tailed film popularity. The rebuild is timed per phase: loading the
+through tables, computing the similarity matrix and top-k, and storing the results. Then
+--toggles random fav toggles are timed through the same code path as the fave-film view,
+by random users and then by one user with --heavy-user-favs favs, with the number of
+queries each ran (the re-ranking deferred until the commit included).
+"""
+
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from top_films import recommendations
+from top_films.benchmarking import percentile, seed_synthetic_dataset, use_scratch_database
+from top_films.models import Film, Profile
+from top_films.views import _toggle_film
+
+
+def _draw_pairs(rng, count, num_profiles, num_films, skew=1.2):
+    """count distinct (profile_id, film_id) pairs, with film popularity falling off as a power law"""
+    pairs = np.empty((0, 2), dtype=np.int64)
+    while len(pairs) < count:
+        draws = int((count - len(pairs)) * 1.5) + 1000
+        profile_ids = rng.integers(1, num_profiles + 1, draws)
+        film_ids = np.minimum(rng.pareto(skew, draws).astype(np.int64), num_films - 1) + 1
+        pairs = np.unique(np.concatenate([pairs, np.column_stack([profile_ids, film_ids])]), axis=0)
+    return pairs[rng.permutation(len(pairs))[:count]]
+
+
+class Command(BaseCommand):
+    help = "Times a full rebuild of the fav co-occurrence recommendations, and incremental updates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--fav-rows', type=int, default=1000000)
+        parser.add_argument('--watchlist-rows', type=int, default=0)
+        parser.add_argument('--toggles', type=int, default=200, help="Timed incremental updates")
+        parser.add_argument('--heavy-user-favs', type=int, default=5000,
+                            help="Favs of the one user whose toggles are also timed")
+        parser.add_argument('--db', help="Scratch SQLite file to seed, or to reuse if it is already seeded")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            use_scratch_database(options['db'] or Path(tmp_dir) / 'benchmark.sqlite3')
+            if Film.objects.exists():
+                self.stdout.write(f"Reusing the dataset in {connection.settings_dict['NAME']}")
+            else:
+                self.seed(options)
+            heavy_profile = self.seed_heavy_user(options['heavy_user_favs'])
+
+            fav_rows = Profile.fav_films.through.objects.count()
+            self.stdout.write(f"Rebuilding the recommendations from {fav_rows} fav rows...")
+            started = time.perf_counter()
+            timings = recommendations.rebuild(log=self.stdout.write)
+            total = time.perf_counter() - started
+
+            self.stdout.write(f"Timing {options['toggles']} incremental updates...")
+            rng = np.random.default_rng(7)
+            profiles = list(Profile.objects.order_by('?')[:options['toggles']])
+            toggles = self.run_toggles(rng, profiles)
+            self.stdout.write(f"Timing {options['toggles']} incremental updates by a user with "
+                              f"{options['heavy_user_favs']} favs...")
+            heavy_toggles = self.run_toggles(rng, [heavy_profile] * options['toggles'])
+            connection.close()
+
+        results = {
+            'scale': {'films': options['films'], 'users': options['users'], 'fav_rows': fav_rows,
+                      'watchlist_rows': options['watchlist_rows']},
+            'rebuild_seconds': dict({phase: round(seconds, 2) for phase, seconds in timings.items()}, total=round(total, 2)),
+            'toggles': toggles,
+            'heavy_user_toggles': dict(heavy_toggles, favs=options['heavy_user_favs']),
+        }
+        rebuild = results['rebuild_seconds']
+        self.stdout.write(f"Full rebuild: {rebuild['total']:.2f}s (load {rebuild['load']:.2f}s, "
+                          f"compute {rebuild['compute']:.2f}s, store {rebuild['store']:.2f}s)")
+        for label, stats in (("fav toggle", toggles),
+                             (f"fav toggle by the user with {options['heavy_user_favs']} favs", heavy_toggles)):
+            self.stdout.write(f"Incremental update per {label}: p50 {stats['p50_ms']:.2f} ms, "
+                              f"p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                              f"{stats['p50_queries']:.0f} queries (max {stats['max_queries']})")
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+    def seed(self, options):
+        rng = np.random.default_rng(86)
+        seed_synthetic_dataset(options['films'], options['films'], options['users'], 0, favs_per_user=0,
+                               log=self.stdout.write)
+        for through, count in ((Profile.fav_films.through, options['fav_rows']),
+                               (Profile.films_to_watch.through, options['watchlist_rows'])):
+            if not count:
+                continue
+            self.stdout.write(f"Seeding {count} {through._meta.verbose_name} rows...")
+            pairs = _draw_pairs(rng, count, options['users'], options['films'])
+            table = through._meta.db_table
+            with transaction.atomic(), connection.cursor() as cursor:
+                for start in range(0, len(pairs), recommendations.PERSIST_CHUNK_SIZE):
+                    cursor.executemany(f"INSERT INTO {table} (profile_id, film_id) VALUES (%s, %s)",
+                                       pairs[start:start + recommendations.PERSIST_CHUNK_SIZE].tolist())
+
+    def seed_heavy_user(self, num_favs):
+        """Gives the last profile num_favs favs of the most popular films, unless it already has them"""
+        profile = Profile.objects.order_by('-id').first()
+        through = Profile.fav_films.through
+        film_ids = list(Film.objects.order_by('id').values_list('id', flat=True)[:num_favs])
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(f"INSERT OR IGNORE INTO {through._meta.db_table} (profile_id, film_id) VALUES (%s, %s)",
+                               [(profile.id, film_id) for film_id in film_ids])
+        return profile
+
+    def run_toggles(self, rng, profiles):
+        """Latency percentiles and query counts of a random fav toggle by each of profiles"""
+        max_film_id = Film.objects.order_by('-id').values_list('id', flat=True).first()
+        latencies, num_queries = [], []
+        for profile in profiles:
+            film_id = int(min(rng.pareto(1.2), max_film_id - 1)) + 1
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                _toggle_film(profile, 'fav_films', film_id)
+                latencies.append((time.perf_counter() - started) * 1000)
+            num_queries.append(len(queries))
+        results = {f'p{pct}_ms': round(percentile(latencies, pct), 2) for pct in (50, 95, 99)}
+        results.update(p50_queries=percentile(num_queries, 50), max_queries=max(num_queries))
+        return results
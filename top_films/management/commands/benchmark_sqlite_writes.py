@@ -0,0 +1,134 @@
+"""
+Management command measuring concurrent write throughput and "database is locked" errors,
+with the bare SQLite configuration and with the project's connection profile.
+
+    python manage.py benchmark_sqlite_writes --threads 16 --duration 10
+
+A small synthetic dataset is seeded once, and each profile is run against its own copy of
+it. Each of --threads threads logs in as its own user and, for --duration seconds, posts
+fave-film toggles and add-comment forms through the test client, as fast as it can.
+
+The 'bare' profile is Django's stock SQLite setup: rollback journal, deferred
+transactions, and a new connection per request. The 'tuned' profile is the configuration
+in settings: SQLITE_PRAGMAS, SQLITE_BEGIN_IMMEDIATE and persistent connections.
+"""
+
+import json
+import logging
+import random
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from top_films.benchmarking import seed_synthetic_dataset, use_scratch_database
+from top_films.models import User, Film
+
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+PROFILES = {
+    'bare': {
+        'settings': {'SQLITE_PRAGMAS': {'journal_mode': 'delete'}, 'SQLITE_BEGIN_IMMEDIATE': False},
+        'database': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+    },
+    'tuned': {
+        'settings': {},
+        'database': {key: settings.DATABASES['default'].get(key, 0) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Hammers fave-film and add-comment from many threads, with and without the SQLite connection profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10, help="Seconds each profile is measured for")
+        parser.add_argument('--films', type=int, default=200)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            seed_path = Path(tmp_dir) / 'seed.sqlite3'
+            with override_settings(**PROFILES['bare']['settings']):
+                use_scratch_database(seed_path)
+                seed_synthetic_dataset(options['films'], options['films'] * 5, options['threads'], 1000,
+                                       log=self.stdout.write)
+                connection.close()
+
+            for name, profile in PROFILES.items():
+                db_path = Path(tmp_dir) / f'{name}.sqlite3'
+                shutil.copy(seed_path, db_path)
+                connection.settings_dict.update(profile['database'], NAME=str(db_path))
+                with override_settings(ALLOWED_HOSTS=['testserver'], **profile['settings']):
+                    self.stdout.write(f"Measuring the {name} profile...")
+                    results[name] = self.run_profile(options['threads'], options['duration'])
+                connections.close_all()
+
+        self.stdout.write(f"{'profile':<8} {'writes':>8} {'writes/s':>9} {'locked':>7} {'lock rate':>10} {'other errors':>13}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<8} {result['writes']:>8} {result['writes_per_sec']:>9.1f} {result['locked']:>7} "
+                f"{result['lock_error_rate']:>9.2%} {result['other_errors']:>13}")
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+    def run_profile(self, threads, duration):
+        film_ids = list(Film.objects.values_list('id', flat=True))
+        max_ranking = len(film_ids)
+        users = list(User.objects.order_by('id')[:threads])
+        counts = {'writes': 0, 'locked': 0, 'other_errors': 0}
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(len(users) + 1)
+
+        def worker(user, seed):
+            rng = random.Random(seed)
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            start_barrier.wait()
+            deadline = time.perf_counter() + duration
+            try:
+                while time.perf_counter() < deadline:
+                    if rng.random() < 0.5:
+                        response = client.post(reverse('fave-film'), {'film_id': rng.choice(film_ids)}, **AJAX)
+                    else:
+                        response = client.post(reverse('add-comment', args=[rng.randint(1, max_ranking)]),
+                                               {'comment': f"Benchmark comment {rng.random()}"})
+                    exc_info = getattr(response, 'exc_info', None)
+                    with lock:
+                        if response.status_code < 400:
+                            counts['writes'] += 1
+                        elif exc_info and 'database is locked' in str(exc_info[1]):
+                            counts['locked'] += 1
+                        else:
+                            counts['other_errors'] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(user, n)) for n, user in enumerate(users)]
+        logging.disable(logging.ERROR)  # lock errors would otherwise each log a traceback
+        try:
+            for thread in workers:
+                thread.start()
+            start_barrier.wait()
+            start = time.perf_counter()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            logging.disable(logging.NOTSET)
+
+        attempts = sum(counts.values())
+        return dict(
+            counts,
+            writes_per_sec=round(counts['writes'] / elapsed, 1),
+            lock_error_rate=round(counts['locked'] / attempts, 4) if attempts else 0.0,
+        )
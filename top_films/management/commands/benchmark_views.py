@@ -0,0 +1,187 @@
+"""
+Management command that benchmarks every named front-end route against a synthetic dataset.
+
+    python manage.py benchmark_views --films 10000 --people 200000 --users 100000 \
+        --comments 5000000 --db /tmp/bench.sqlite3 --output results.json --thresholds limits.json
+
+The dataset is seeded into a scratch SQLite database (a temporary file unless --db is
+given; an already-seeded --db file is reused). Each route is then requested through the
+test client, both anonymously and as a logged-in user, and its p50/p95/p99 latency, SQL
+query count and peak Python memory are reported.
+
+A thresholds file is a JSON object of the form
+    {"default": {"p95_ms": 250, "queries": 20}, "routes": {"film-detail|user": {"queries": 8}}}
+where route keys are "<url name>|anonymous" or "<url name>|user". The command fails if
+any result exceeds its limits.
+"""
+
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+from top_films.benchmarking import BENCHMARK_PASSWORD, percentile, seed_synthetic_dataset, use_scratch_database
+from top_films.models import Film, Person, Genre, Language, Comment
+
+# Routes that can't be replayed safely or meaningfully in a loop
+SKIPPED_ROUTES = {'logout', 'delete-comment', 'password_reset_confirm', 'password_reset_complete', 'film-comments-stream'}
+LOGIN_ONLY_ROUTES = {'fave-film', 'watchlist-film', 'toggle-films', 'edit-profile', 'password_change', 'password_change_done'}
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+def _named_routes(patterns, namespace=None):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            # The admin has its own query budgets, and isn't part of the public site
+            if pattern.namespace != 'admin':
+                yield from _named_routes(pattern.url_patterns, pattern.namespace or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name and not namespace:
+            yield pattern.name, list(pattern.pattern.converters)
+
+
+class Command(BaseCommand):
+    help = "Seeds a synthetic dataset and reports latency, query counts and memory for every named route"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=1000)
+        parser.add_argument('--people', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--db', help="Scratch SQLite file to seed, or to reuse if it is already seeded")
+        parser.add_argument('--iterations', type=int, default=30, help="Timed requests per route and user mode")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--thresholds', help="JSON file of limits; the command fails if any is exceeded")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            use_scratch_database(options['db'] or Path(tmp_dir) / 'benchmark.sqlite3')
+            if Film.objects.exists():
+                self.stdout.write(f"Reusing the dataset in {connection.settings_dict['NAME']}")
+            else:
+                seed_synthetic_dataset(options['films'], options['people'], options['users'], options['comments'],
+                                       log=self.stdout.write)
+            cache.clear()
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                results = self.run_benchmarks(options['iterations'])
+            connection.close()
+
+        report = {
+            'scale': {key: options[key] for key in ('films', 'people', 'users', 'comments')},
+            'iterations': options['iterations'],
+            'timestamp': time.time(),
+            'routes': results,
+        }
+        self.print_table(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['thresholds']:
+            self.check_thresholds(results, json.loads(Path(options['thresholds']).read_text()))
+
+    def route_samples(self, rng):
+        """Returns a function giving (url, method, data, extra) for a route, with varying arguments"""
+        max_ranking = Film.objects.order_by('-ranking').values_list('ranking', flat=True).first()
+        slugs = {
+            'genre-detail': list(Genre.objects.values_list('slug', flat=True)[:500]),
+            'language-detail': list(Language.objects.values_list('slug', flat=True)[:500]),
+            'director-detail': list(Person.objects.filter(num_directed__gt=0).values_list('slug', flat=True)[:500]),
+            'actor-detail': list(Person.objects.filter(num_acted__gt=0).values_list('slug', flat=True)[:500]),
+        }
+        user_ids = list(Comment.objects.values_list('author_id', flat=True)[:500]) or [1]
+        film_ids = list(Film.objects.values_list('id', flat=True)[:500])
+
+        def sample(name, converters):
+            kwargs = {}
+            for converter in converters:
+                if converter == 'ranking':
+                    kwargs['ranking'] = rng.randint(1, max_ranking)
+                elif converter == 'slug':
+                    kwargs['slug'] = rng.choice(slugs[name])
+                elif converter == 'pk':
+                    kwargs['pk'] = rng.choice(user_ids)
+                else:
+                    return None
+            url = reverse(name, kwargs=kwargs)
+            if name in ('fave-film', 'watchlist-film'):
+                return url, 'post', {'film_id': rng.choice(film_ids)}, AJAX
+            if name == 'toggle-films':
+                toggles = [{'film_id': rng.choice(film_ids), 'list': rng.choice(['fav', 'watchlist'])} for _ in range(5)]
+                return url, 'post', json.dumps({'toggles': toggles}), dict(AJAX, content_type='application/json')
+            if name == 'actor-search':
+                return url, 'post', {'actor_name': f"Person {rng.randint(1, 99)}"}, {}
+            return url, 'get', None, {}
+        return sample
+
+    def run_benchmarks(self, iterations):
+        rng = random.Random(86)
+        sample = self.route_samples(rng)
+        routes = list(_named_routes(get_resolver().url_patterns))
+        results = {}
+        for mode in ('anonymous', 'user'):
+            client = Client(raise_request_exception=False)
+            if mode == 'user':
+                client.login(username='user0', password=BENCHMARK_PASSWORD)
+            for name, converters in routes:
+                if name in SKIPPED_ROUTES or (mode == 'anonymous' and name in LOGIN_ONLY_ROUTES):
+                    continue
+                if sample(name, converters) is None:
+                    continue
+                results[f"{name}|{mode}"] = self.benchmark_route(client, lambda: sample(name, converters), iterations)
+                self.stdout.write(f"  {name} ({mode}) done")
+        return results
+
+    def benchmark_route(self, client, make_request, iterations):
+        def send():
+            url, method, data, extra = make_request()
+            return getattr(client, method)(url, data, **extra)
+
+        send()  # warm-up: the first hit fills caches and compiles templates
+        latencies, query_counts, statuses = [], [], set()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = send()
+                latencies.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+            statuses.add(response.status_code)
+
+        # Memory is measured separately, as tracemalloc slows every allocation down
+        tracemalloc.start()
+        send()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'queries': max(query_counts),
+            'peak_kib': round(peak / 1024, 1),
+            'statuses': sorted(statuses),
+        }
+
+    def print_table(self, results):
+        self.stdout.write(f"{'route':<36} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}  status")
+        for route, result in results.items():
+            self.stdout.write(
+                f"{route:<36} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['queries']:>8} {result['peak_kib']:>9.1f}  {','.join(map(str, result['statuses']))}")
+
+    def check_thresholds(self, results, thresholds):
+        failures = []
+        for route, result in results.items():
+            limits = dict(thresholds.get('default', {}), **thresholds.get('routes', {}).get(route, {}))
+            for metric, limit in limits.items():
+                if metric in result and result[metric] > limit:
+                    failures.append(f"{route}: {metric} = {result[metric]} exceeds the limit of {limit}")
+        if failures:
+            raise CommandError("Benchmark regressions found:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("All routes are within their thresholds"))
@@ -0,0 +1,99 @@
+"""
+Management command making the local poster variants (see top_films/posters.py) of the films
+that don't have them yet.
+
+    python manage.py build_posters --workers 4 --downloads 8
+    python manage.py build_posters --from-dir top_films/fixtures/posters
+
+Posters are downloaded by a pool of --downloads threads, and resized by a pool of --workers
+processes as the downloads complete. --from-dir reads them from local <ttcode>.<ext> image
+files instead, e.g. to work offline. --rebuild remakes the variants of every film, e.g.
+after a change to the variant settings, from the originals downloaded before.
+
+Film.poster_digest is set with QuerySet.update(), so the films and the people, genres and
+languages listing them are then touched (see change_tracking.py), and the catalog page
+cache invalidated.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from top_films import posters, page_cache
+from top_films.change_tracking import touch, ID_CHUNK_SIZE
+from top_films.models import Film, Person, Genre, Language
+
+
+def _local_original(directory, ttcode):
+    """The image file of a film in a --from-dir directory"""
+    matches = sorted(Path(directory).glob(f'{ttcode}.*'))
+    if not matches:
+        raise FileNotFoundError(f"No {ttcode}.* image in {directory}")
+    return matches[0]
+
+
+class Command(BaseCommand):
+    help = "Downloads the films' posters and makes their resized WebP and JPEG variants"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Resizing processes")
+        parser.add_argument('--downloads', type=int, default=8, help="Concurrent downloads")
+        parser.add_argument('--timeout', type=float, default=30, help="Download timeout, in seconds")
+        parser.add_argument('--from-dir', help="Read the posters from <ttcode>.<ext> files in this directory")
+        parser.add_argument('--rebuild', action='store_true', help="Remake the variants of films that have them")
+
+    def handle(self, *args, **options):
+        poster_root = Path(settings.POSTER_ROOT)
+        films = Film.objects.all() if options['from_dir'] else Film.objects.exclude(poster_url__isnull=True).exclude(
+            poster_url='')
+        if not options['rebuild']:
+            films = films.filter(poster_digest='')
+        films = {film_id: (ttcode, poster_url, digest)
+                 for film_id, ttcode, poster_url, digest in films.values_list('id', 'ttcode', 'poster_url', 'poster_digest')}
+        if options['from_dir'] and not Path(options['from_dir']).is_dir():
+            raise CommandError(f"No such directory: {options['from_dir']}")
+
+        started = time.perf_counter()
+        digests, num_failed = {}, 0
+        with ThreadPoolExecutor(options['downloads']) as fetchers, ProcessPoolExecutor(options['workers']) as resizers:
+            if options['from_dir']:
+                fetches = {fetchers.submit(_local_original, options['from_dir'], ttcode): film_id
+                           for film_id, (ttcode, _, _) in films.items()}
+            else:
+                fetches = {fetchers.submit(posters.fetch_original, poster_url, poster_root, options['timeout']): film_id
+                           for film_id, (_, poster_url, _) in films.items()}
+            resizes = {}
+            for fetch in as_completed(fetches):
+                try:
+                    resizes[resizers.submit(posters.make_variants, fetch.result(), poster_root)] = fetches[fetch]
+                except (OSError, ValueError) as e:
+                    num_failed += 1
+                    self.stderr.write(f"Couldn't fetch the poster of {films[fetches[fetch]][0]}: {e}")
+            for resize in as_completed(resizes):
+                try:
+                    digests[resizes[resize]] = resize.result()
+                except OSError as e:
+                    num_failed += 1
+                    self.stderr.write(f"Couldn't resize the poster of {films[resizes[resize]][0]}: {e}")
+
+        changed = [film_id for film_id, digest in digests.items() if digest != films[film_id][2]]
+        with transaction.atomic():
+            for film_id in changed:
+                Film.objects.filter(pk=film_id).update(poster_digest=digests[film_id])
+            for start in range(0, len(changed), ID_CHUNK_SIZE):
+                chunk = changed[start:start + ID_CHUNK_SIZE]
+                touch(Film.objects.filter(pk__in=chunk))
+                touch(Person.objects.filter(Q(films_directed__in=chunk) | Q(films_acted_in__in=chunk)))
+                touch(Genre.objects.filter(films__in=chunk))
+                touch(Language.objects.filter(film__in=chunk))
+        if changed:
+            page_cache.bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Made the poster variants of {len(digests)} films ({len(changed)} changed, {num_failed} failed) "
+            f"in {time.perf_counter() - started:.1f}s"))
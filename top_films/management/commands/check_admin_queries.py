@@ -0,0 +1,96 @@
+"""
+Management command enforcing the admin's query budgets.
+
+    python manage.py check_admin_queries --films 2000 --people 20000
+
+The synthetic dataset is seeded into a scratch SQLite database (as for benchmark_views),
+and the changelist and a change form of every model registered in the admin are requested
+as a superuser. The SQL queries each page issues are counted against ADMIN_QUERY_BUDGETS,
+which don't depend on the size of the dataset or of a page: a page that queries per row,
+or per related object, fails the check. Run it at two scales to see that the counts
+stay put.
+"""
+
+import tempfile
+from pathlib import Path
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from top_films.benchmarking import seed_synthetic_dataset, use_scratch_database
+from top_films.models import User, Film
+
+AUDITED_APPS = {'top_films', 'auth'}
+# Queries per page, including the session and user look-ups of the request itself: by
+# '<app>.<Model>:<page>', falling back to the budget of the kind of page
+ADMIN_QUERY_BUDGETS = {
+    'changelist': 8,
+    'change': 10,
+    # The m2m widgets, and the user's groups, permissions and profile inline
+    'top_films.Film:change': 13,
+    'auth.User:change': 13,
+}
+AUDIT_USERNAME = 'admin-query-audit'
+
+
+class Command(BaseCommand):
+    help = "Fails if any admin changelist or change form issues more than its budget of SQL queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=500)
+        parser.add_argument('--people', type=int, default=2500)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--db', help="Scratch SQLite file to seed, or to reuse if it is already seeded")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            use_scratch_database(options['db'] or Path(tmp_dir) / 'admin_audit.sqlite3')
+            if Film.objects.exists():
+                self.stdout.write(f"Reusing the dataset in {connection.settings_dict['NAME']}")
+            else:
+                seed_synthetic_dataset(options['films'], options['people'], options['users'], options['comments'],
+                                       log=self.stdout.write)
+            superuser = User.objects.filter(username=AUDIT_USERNAME).first()
+            if superuser is None:
+                superuser = User.objects.create_superuser(AUDIT_USERNAME, password=None)
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                results = self.run_audit(superuser)
+            connection.close()
+
+        self.stdout.write(f"{'page':<40} {'status':>6} {'queries':>8} {'budget':>7}")
+        failures = []
+        for page, status, queries, budget in results:
+            flag = '' if status == 200 and queries <= budget else '  <-- FAIL'
+            self.stdout.write(f"{page:<40} {status:>6} {queries:>8} {budget:>7}{flag}")
+            if flag:
+                failures.append(page)
+        if failures:
+            raise CommandError(f"{len(failures)} admin page(s) failed their query budget: {', '.join(failures)}")
+
+    def run_audit(self, superuser):
+        client = Client()
+        client.force_login(superuser)
+        results = []
+        for model in admin.site._registry:
+            opts = model._meta
+            if opts.app_label not in AUDITED_APPS:
+                continue
+            pages = {'changelist': reverse(f'admin:{opts.app_label}_{opts.model_name}_changelist')}
+            # Audit the change form of the object with the most related rows, where there's a counter for it
+            counter_fields = getattr(model, 'COUNTER_FIELDS', ())
+            ordering = [f'-{counter_fields[0]}', 'pk'] if counter_fields else ['pk']
+            obj = model._default_manager.order_by(*ordering).first()
+            if obj is not None:
+                pages['change'] = reverse(f'admin:{opts.app_label}_{opts.model_name}_change', args=(obj.pk,))
+            for kind, url in pages.items():
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url)
+                page = f"{opts.label}:{kind}"
+                budget = ADMIN_QUERY_BUDGETS.get(page, ADMIN_QUERY_BUDGETS[kind])
+                results.append((page, response.status_code, len(queries), budget))
+        return results
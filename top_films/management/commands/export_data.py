@@ -0,0 +1,156 @@
+"""
+Management command streaming one of the bulk exports (see top_films/exports.py) to a file
+or to standard output.
+
+    python manage.py export_data films --format csv --gzip --output films.csv.gz
+    python manage.py export_data comments --format jsonl --after 500000 --until 1000000
+    python manage.py export_data comments --format jsonl --output comments.jsonl --resume
+
+--resume picks an interrupted export up after the last complete row of --output, and
+appends to it. A partial last row is cut off first; a gzipped output whose last member
+was cut short is rewritten up to that row, since gzip readers stop at a truncated member,
+and the new rows are appended as another gzip member, which gzip readers treat as the
+continuation of the same file. A missing --output is written from the start.
+"""
+
+import csv
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+from django.core.management.base import BaseCommand, CommandError
+
+from top_films import exports
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class _CountingLines:
+    """Iterates over the lines of a binary stream as text, counting their bytes and the quotes on them"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.offset = 0
+        self.num_quotes = 0
+        self.line = ''
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        # A truncated row may end inside a multi-byte character
+        self.line = line.decode('utf-8', errors='replace')
+        self.num_quotes += self.line.count('"')
+        return self.line
+
+
+def _resume_point(path, export_format, compressed):
+    """
+    (pk of the last complete row of an earlier export or None if it has no rows, length of
+    its data up to the end of that row, whether that is all of its data). Raises
+    CommandError if a complete row has no pk.
+    """
+    last_pk, end, is_whole = None, 0, True
+    with (gzip.open if compressed else open)(path, 'rb') as output:
+        lines = _CountingLines(output)
+        # csv.reader reads one line at a time, so the offset after a row is where it ends
+        rows = csv.reader(lines) if export_format == 'csv' else lines
+        try:
+            for row in rows:
+                # A row cut short doesn't end with a newline, or ends inside a quoted value,
+                # leaving an odd number of quotes
+                if not lines.line.endswith('\n') or lines.num_quotes % 2:
+                    is_whole = False
+                    break
+                lines.num_quotes = 0
+                try:
+                    pk = int(json.loads(row)['id']) if export_format == 'jsonl' else int(row[0])
+                except (ValueError, KeyError, IndexError, TypeError):
+                    if export_format == 'csv' and end == 0:
+                        # The header
+                        end = lines.offset
+                        continue
+                    raise CommandError(f"Can't resume {path}: the row ending at byte {lines.offset} has no pk")
+                last_pk, end = pk, lines.offset
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            # A truncated gzip member ends the readable rows
+            is_whole = False
+    return last_pk, end, is_whole
+
+
+def _cut(path, length, compressed):
+    """
+    Cuts an earlier export back to its first length bytes of data. A gzipped export is
+    rewritten instead: gzip readers stop at a truncated member, so rows appended after one
+    would be unreadable.
+    """
+    if not compressed:
+        os.truncate(path, length)
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+    try:
+        with gzip.open(path, 'rb') as source, os.fdopen(fd, 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as target:
+            while length:
+                block = source.read(min(length, COPY_BLOCK_SIZE))
+                target.write(block)
+                length -= len(block)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Command(BaseCommand):
+    help = "Streams a CSV or JSON Lines export of films, credits, comments or fav/watchlist entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output")
+        parser.add_argument('--after', type=int, help="Export the rows whose pk is greater than AFTER")
+        parser.add_argument('--until', type=int, help="Export the rows whose pk is at most UNTIL")
+        parser.add_argument('--output', help="File to write to (default: standard output)")
+        parser.add_argument('--resume', action='store_true', help="Append to --output, after its last exported row")
+
+    def handle(self, *args, **options):
+        after, header, mode = options['after'], True, 'wb'
+        if options['resume']:
+            if not options['output']:
+                raise CommandError("--resume needs an --output file to resume")
+            try:
+                last_pk, end, is_whole = _resume_point(options['output'], options['format'], options['gzip'])
+            except FileNotFoundError:
+                last_pk, end, is_whole = None, 0, True
+            if end:
+                if not is_whole:
+                    _cut(options['output'], end, options['gzip'])
+                mode, header = 'ab', False
+            if last_pk is not None:
+                after = last_pk
+                self.stderr.write(f"Resuming after pk {last_pk}")
+
+        stream = exports.export_stream(options['dataset'], options['format'], options['gzip'], after,
+                                       options['until'], header)
+        started = time.perf_counter()
+        num_bytes = 0
+        output = open(options['output'], mode) if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in stream:
+                output.write(chunk)
+                num_bytes += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+        self.stderr.write(f"Exported {num_bytes / 1024 / 1024:.1f} MB of {options['dataset']} "
+                          f"in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,288 @@
+"""
+Management command importing films, people, genres and credits from the IMDb
+non-commercial datasets (see top_films/imdb_datasets.py).
+
+    python manage.py import_imdb_datasets /data/imdb --min-votes 25000 --workers 8
+
+The directory holds title.basics.tsv.gz, title.ratings.tsv.gz, title.principals.tsv.gz and
+name.basics.tsv.gz as downloaded from https://datasets.imdbws.com/. They are read in four
+streaming passes:
+
+1. title.ratings, into an IdMap of every title's rating and vote count;
+2. title.basics, inserting the titles of --title-types with at least --min-votes votes
+   whose ttcode isn't in the database yet, with their genres;
+3. title.principals, collecting the directing and acting credits of the new films;
+4. name.basics, inserting the people credited, after which the credits are inserted.
+
+IMDb doesn't publish Metascores or primary languages, so the new films get the Metascore of
+80 that import_films.py gives N/A ones, and the language "Unknown". They are ranked after
+the films already in the database, by IMDb's weighted rating: their rating, shrunk towards
+the mean by --min-votes votes. Titles and names are unique here but not on IMDb, so
+clashing ones get the year, then the IMDb id, appended; a person named like someone who
+was in the database before the import is taken to be them.
+
+Everything is written in one transaction, with executemany() rather than bulk_create(),
+which spends far longer building model instances. As no signals are sent, the counters,
+search index and similar films are then rebuilt, the changed rows touched and the catalog
+page cache invalidated, as after import_films.py --bulk.
+"""
+
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+
+from top_films import counters, search, similar_films, page_cache, imdb_datasets
+from top_films.change_tracking import touch, ID_CHUNK_SIZE
+from top_films.imdb_datasets import IdMap, DIRECTOR, ACTOR, title_code, name_code
+from top_films.models import Film, Person, Genre, Language
+
+INSERT_BATCH_SIZE = 5000
+# Values per IN (...) list, within SQLite's limit on query parameters
+PARAM_CHUNK_SIZE = 900
+UNKNOWN_LANGUAGE = 'Unknown'
+DEFAULT_META_SCORE = 80
+
+
+def _ids_of(model, field, values):
+    """A value->id dict of the rows of model whose field is among values"""
+    values = list(values)
+    value_ids = {}
+    for start in range(0, len(values), PARAM_CHUNK_SIZE):
+        value_ids.update(model.objects.filter(**{f'{field}__in': values[start:start + PARAM_CHUNK_SIZE]}).values_list(
+            field, 'id'))
+    return value_ids
+
+
+def _columns(parts, *dtypes):
+    """Concatenates a list of per-block tuples of arrays into one array per column"""
+    return [np.concatenate([part[i] for part in parts]) if parts else np.array([], dtype=dtype)
+            for i, dtype in enumerate(dtypes)]
+
+
+class Command(BaseCommand):
+    help = "Imports films, people, genres and credits from the IMDb non-commercial datasets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory holding the four .tsv.gz datasets")
+        parser.add_argument('--title-types', default='movie',
+                            help="Comma-separated titleType values to import (default: movie)")
+        parser.add_argument('--min-votes', type=int, default=25000, help="Skip titles with fewer IMDb votes")
+        parser.add_argument('--max-cast', type=int, default=10,
+                            help="Import the actors billed within this many principals of each film")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Parser processes (1 parses in this process)")
+
+    def handle(self, *args, **options):
+        directory = Path(options['directory'])
+        paths = {dataset: directory / f'{dataset}.tsv.gz' for dataset in imdb_datasets.DATASETS}
+        missing = [str(path) for path in paths.values() if not path.exists()]
+        if missing:
+            raise CommandError(f"Missing datasets: {', '.join(missing)}")
+        self.workers = options['workers']
+        self.stats = {}
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            ratings = self.read_ratings(paths['title.ratings'])
+            films = self.import_titles(paths['title.basics'], ratings, options)
+            del ratings
+            credits = self.read_credits(paths['title.principals'], films, options['max_cast'])
+            people = self.import_people(paths['name.basics'], credits)
+            self.import_credits(credits, films, people)
+            self.rank_films(films, options['min_votes'])
+            self.num_films = len(films)
+            self.rebuild_derived()
+        page_cache.bump_catalog_version()
+        self.stats['total'] = {'seconds': time.perf_counter() - started}
+        self.print_report()
+
+    def parse(self, dataset, path, parser, context=None):
+        """Yields the parsed blocks of a dataset, timing the pass"""
+        started, num_rows = time.perf_counter(), 0
+        for num_lines, parsed in imdb_datasets.parse_blocks(path, parser, context, self.workers):
+            num_rows += num_lines
+            yield parsed
+        self.stats[dataset] = {'rows': num_rows, 'seconds': time.perf_counter() - started}
+
+    def read_ratings(self, path):
+        title_ids, ratings, votes = _columns(list(self.parse('title.ratings', path, imdb_datasets.parse_ratings)),
+                                             np.int64, np.int16, np.int32)
+        return IdMap(title_ids, ratings, votes)
+
+    def import_titles(self, path, ratings, options):
+        """Inserts the new films of title.basics; returns an IdMap of their title ids to (film id, rating, votes)"""
+        known = IdMap([int(ttcode[2:]) for ttcode in Film.objects.values_list('ttcode', flat=True)
+                       if ttcode.startswith('tt') and ttcode[2:].isdigit()])
+        self.next_ranking = self.first_ranking = (Film.objects.aggregate(Max('ranking'))['ranking__max'] or 0) + 1
+        self.language_id = Language.objects.get_or_create(name=UNKNOWN_LANGUAGE)[0].id
+        self.genre_ids = dict(Genre.objects.values_list('name', 'id'))
+        self.used_genre_ids = set()
+
+        context = {'title_types': set(options['title_types'].split(',')), 'ratings': ratings,
+                   'min_votes': options['min_votes']}
+        imported, batch = [], []
+        for rows in self.parse('title.basics', path, imdb_datasets.parse_basics, context):
+            if rows:
+                is_known = known.contains([row[0] for row in rows])
+                batch.extend(row for row, skip in zip(rows, is_known) if not skip)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                imported.append(self.insert_films(batch))
+                batch = []
+        if batch:
+            imported.append(self.insert_films(batch))
+        title_ids, film_ids, ratings, votes = _columns(imported, np.int64, np.int64, np.int16, np.int32)
+        return IdMap(title_ids, film_ids, ratings, votes)
+
+    def insert_films(self, rows):
+        """Inserts a batch of parse_basics() rows, with provisional rankings; returns their arrays of ids, ratings and votes"""
+        titles = self.claim_names(Film, 'title', [
+            (title, f'{title} ({year})', f'{title} ({year}, {title_code(title_id)})')
+            for title_id, title, year, *_ in rows])
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Film._meta.db_table} (title, ttcode, ranking, imdb_rating, meta_score, year, language_id, "
+                f"watched, comment_count, fav_count, watchlist_count, poster_digest, updated_at, last_activity_at) "
+                f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 0, 0, 0, '', %s, %s)",
+                [(title, title_code(title_id), self.next_ranking + i, rating / 10, DEFAULT_META_SCORE, year,
+                  self.language_id, False, now, now)
+                 for i, (title, (title_id, _, year, _, rating, _)) in enumerate(zip(titles, rows))])
+        self.next_ranking += len(rows)
+        title_film_ids = _ids_of(Film, 'title', titles)
+        film_ids = [title_film_ids[title] for title in titles]
+
+        for name in {genre for row in rows for genre in row[3]} - self.genre_ids.keys():
+            self.genre_ids[name] = Genre.objects.create(name=name).id
+        genre_links = {(film_id, self.genre_ids[genre]) for film_id, row in zip(film_ids, rows) for genre in row[3]}
+        self.used_genre_ids.update(genre_id for _, genre_id in genre_links)
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT INTO {Film.genres.through._meta.db_table} (film_id, genre_id) VALUES (%s, %s)",
+                               sorted(genre_links))
+        return (np.array([row[0] for row in rows], dtype=np.int64), np.array(film_ids, dtype=np.int64),
+                np.array([row[4] for row in rows], dtype=np.int16), np.array([row[5] for row in rows], dtype=np.int32))
+
+    @staticmethod
+    def claim_names(model, field, alternatives):
+        """
+        For each row's tuple of alternative names, the first that no row of model has and
+        no earlier row claimed; the last alternative, which holds an IMDb id, is taken as free
+        """
+        taken = set(_ids_of(model, field, {name for names in alternatives for name in names}))
+        claimed = []
+        for names in alternatives:
+            name = next((name for name in names[:-1] if name not in taken), names[-1])
+            taken.add(name)
+            claimed.append(name)
+        return claimed
+
+    def read_credits(self, path, films, max_cast):
+        """(title ids, name ids, kinds) arrays of the directing and acting credits of the imported films"""
+        context = {'titles': IdMap(films.ids), 'max_cast': max_cast}
+        return _columns(list(self.parse('title.principals', path, imdb_datasets.parse_principals, context)),
+                        np.int64, np.int64, np.int8)
+
+    def import_people(self, path, credits):
+        """Inserts the credited people of name.basics that are new; returns an IdMap of their name ids to person ids"""
+        self.last_person_id = Person.objects.aggregate(Max('id'))['id__max'] or 0
+        self.reused_person_ids = []
+        self.num_new_people = 0
+        context = {'names': IdMap(np.unique(credits[1]))}
+        imported, batch = [], []
+        for rows in self.parse('name.basics', path, imdb_datasets.parse_names, context):
+            batch.extend(rows)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                imported.append(self.insert_people(batch))
+                batch = []
+        if batch:
+            imported.append(self.insert_people(batch))
+        name_ids, person_ids = _columns(imported, np.int64, np.int64)
+        return IdMap(name_ids, person_ids)
+
+    def insert_people(self, rows):
+        """Matches or inserts a batch of parse_names() rows; returns their arrays of name ids and person ids"""
+        qualified = {name_id: f'{name} ({name_code(name_id)})' for name_id, name in rows}
+        names = {name for _, name in rows} | set(qualified.values())
+        slugs = {name: slugify(name) for name in names}
+        existing = _ids_of(Person, 'name', names)
+        taken_slugs = set(_ids_of(Person, 'slug', set(slugs.values()))) | {''}
+        person_ids, new_people = {}, {}
+        for name_id, name in rows:
+            if qualified[name_id] in existing:
+                person_ids[name_id] = existing[qualified[name_id]]
+            elif existing.get(name, self.last_person_id + 1) <= self.last_person_id:
+                person_ids[name_id] = existing[name]
+            else:
+                if name in existing or name in new_people or slugs[name] in taken_slugs:
+                    name = qualified[name_id]
+                new_people[name] = name_id
+                taken_slugs.add(slugs[name])
+        self.reused_person_ids.extend(person_ids.values())
+        self.num_new_people += len(new_people)
+
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Person._meta.db_table} (name, slug, num_directed, num_acted, updated_at) "
+                f"VALUES (%s, %s, 0, 0, %s)",
+                [(name, slugs[name], now) for name in new_people])
+        for name, person_id in _ids_of(Person, 'name', new_people).items():
+            person_ids[new_people[name]] = person_id
+        return np.fromiter(person_ids.keys(), dtype=np.int64), np.fromiter(person_ids.values(), dtype=np.int64)
+
+    def import_credits(self, credits, films, people):
+        title_ids, name_ids, kinds = credits
+        film_ids, film_found = films.get(title_ids)
+        person_ids, person_found = people.get(name_ids)
+        self.num_credits = {}
+        with connection.cursor() as cursor:
+            for kind, through in ((DIRECTOR, Film.directors.through), (ACTOR, Film.actors.through)):
+                selected = film_found & person_found & (kinds == kind)
+                links = np.unique(np.column_stack((film_ids[selected], person_ids[selected])), axis=0).tolist()
+                for start in range(0, len(links), INSERT_BATCH_SIZE):
+                    cursor.executemany(f"INSERT INTO {through._meta.db_table} (film_id, person_id) VALUES (%s, %s)",
+                                       links[start:start + INSERT_BATCH_SIZE])
+                self.num_credits[kind] = len(links)
+
+    def rank_films(self, films, min_votes):
+        """Re-ranks the imported films by weighted rating, after the films already in the database"""
+        if not len(films):
+            return
+        film_ids, ratings, votes = films.columns[0], films.columns[1] / 10, films.columns[2].astype(np.float64)
+        prior = max(min_votes, 1)
+        scores = votes / (votes + prior) * ratings + prior / (votes + prior) * ratings.mean()
+        order = np.lexsort((films.ids, -scores))
+        rankings = [(self.first_ranking + rank, int(film_id)) for rank, film_id in enumerate(film_ids[order])]
+        with connection.cursor() as cursor:
+            for start in range(0, len(rankings), INSERT_BATCH_SIZE):
+                cursor.executemany(f"UPDATE {Film._meta.db_table} SET ranking = %s WHERE id = %s",
+                                   rankings[start:start + INSERT_BATCH_SIZE])
+
+    def rebuild_derived(self):
+        # executemany() doesn't send the signals that keep the search index, counters, similar films
+        # and change timestamps in sync
+        search.rebuild_index(['film', 'person'])
+        for model, field, source, fk in counters.COUNTERS:
+            if model is not Film:
+                counters.recount(model, field, source, fk)
+        similar_films.rebuild()
+        touch(Language.objects.filter(pk=self.language_id))
+        touch(Genre.objects.filter(pk__in=self.used_genre_ids))
+        for start in range(0, len(self.reused_person_ids), ID_CHUNK_SIZE):
+            touch(Person.objects.filter(pk__in=self.reused_person_ids[start:start + ID_CHUNK_SIZE]))
+
+    def print_report(self):
+        for dataset in imdb_datasets.DATASETS:
+            stats = self.stats[dataset]
+            self.stdout.write(f"{dataset:<17} {stats['rows']:>11,} rows in {stats['seconds']:7.1f}s "
+                              f"{stats['rows'] / max(stats['seconds'], 1e-9):>11,.0f} rows/s")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.num_films} films (ranked from {self.first_ranking}), {self.num_new_people} people, "
+            f"{self.num_credits[DIRECTOR]} directing and {self.num_credits[ACTOR]} acting credits "
+            f"in {self.stats['total']['seconds']:.1f}s"))
@@ -0,0 +1,14 @@
+"""Management command that recomputes the "fans also liked" recommendations from scratch"""
+
+from django.core.management.base import BaseCommand
+
+from top_films import recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the film co-occurrence matrix and every film's stored neighbours from the favs and watchlists"
+
+    def handle(self, *args, **options):
+        timings = recommendations.rebuild(log=self.stdout.write)
+        self.stdout.write(", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+        self.stdout.write(self.style.SUCCESS("Recommendations are up to date"))
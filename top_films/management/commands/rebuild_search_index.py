@@ -0,0 +1,21 @@
+"""Management command that repopulates the full-text search tables from scratch"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from top_films.search import SEARCH_INDEXES, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the FTS5 search index of films, people and comments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help=f"Only rebuild these indexes ({', '.join(SEARCH_INDEXES)})")
+
+    def handle(self, *args, **options):
+        unknown = set(options['kinds']) - set(SEARCH_INDEXES)
+        if unknown:
+            raise CommandError(f"Unknown search indexes: {', '.join(sorted(unknown))}")
+        with transaction.atomic():
+            rebuild_index(options['kinds'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the {', '.join(options['kinds'] or SEARCH_INDEXES)} search index"))
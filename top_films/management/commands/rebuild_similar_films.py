@@ -0,0 +1,17 @@
+"""Management command that recomputes every film's similar films from scratch"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from top_films import similar_films
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the content-based similar-films index from the films' genres, directors and actors"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        num_rows = similar_films.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {num_rows} similar-film neighbours in {time.perf_counter() - started:.2f}s"))
@@ -0,0 +1,17 @@
+"""Management command that repairs the denormalized counter columns"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from top_films.counters import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    help = "Recomputes every denormalized counter (credits, genre/language sizes, film engagement) from scratch"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, source, fk in COUNTERS:
+                num_rows = recount(model, field, source, fk)
+                self.stdout.write(f"Recounted {model.__name__}.{field} for {num_rows} rows")
+        self.stdout.write(self.style.SUCCESS("All counters are up to date"))
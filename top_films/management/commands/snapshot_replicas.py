@@ -0,0 +1,80 @@
+"""
+Management command producing consistent snapshots of the primary database and installing
+them as the read replicas (settings.READ_REPLICAS).
+
+    python manage.py snapshot_replicas                 # refresh every replica once
+    python manage.py snapshot_replicas --interval 60   # ... and again every minute
+
+Each snapshot is taken with SQLite's online backup API in a single step, i.e. as one read
+transaction, which under WAL journaling neither blocks nor is disturbed by concurrent
+writers. It is converted to a rollback journal (replicas are opened read-only) and then
+atomically renamed over each replica file, so readers see either the old or the new
+snapshot, never a partial one. Persistent replica connections notice the new file at their
+next health check.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = "Snapshots the primary database into the read-replica files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('replicas', nargs='*', help="Replica aliases to refresh (default: all of READ_REPLICAS)")
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep refreshing the replicas every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        aliases = options['replicas'] or settings.READ_REPLICAS
+        if not aliases:
+            raise CommandError("No read replicas are configured; set TOP_FILMS_REPLICAS (see settings.READ_REPLICAS).")
+        unknown = set(aliases) - set(settings.READ_REPLICAS)
+        if unknown:
+            raise CommandError(f"Unknown replica(s): {', '.join(sorted(unknown))}")
+
+        while True:
+            self.rotate(aliases)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def rotate(self, aliases):
+        replica_paths = [Path(connections[alias].database_file()) for alias in aliases]
+        replica_dir = replica_paths[0].parent
+        replica_dir.mkdir(parents=True, exist_ok=True)
+
+        started = time.perf_counter()
+        taken_at_ns = time.time_ns()
+        fd, snapshot_path = tempfile.mkstemp(suffix='.sqlite3', dir=replica_dir)
+        os.close(fd)
+        try:
+            primary = connections[DEFAULT_DB_ALIAS]
+            primary.ensure_connection()
+            snapshot = sqlite3.connect(snapshot_path)
+            try:
+                primary.connection.backup(snapshot)
+                snapshot.execute("PRAGMA journal_mode = delete")
+            finally:
+                snapshot.close()
+
+            for path in replica_paths:
+                staged_path = f"{path}.staged"
+                shutil.copyfile(snapshot_path, staged_path)
+                # Replicas are identified by the time their snapshot was taken (see routers.py)
+                os.utime(staged_path, ns=(taken_at_ns, taken_at_ns))
+                os.replace(staged_path, path)
+        finally:
+            os.remove(snapshot_path)
+
+        size_mb = replica_paths[0].stat().st_size / 1024 / 1024
+        self.stdout.write(f"Installed a {size_mb:.1f} MB snapshot in {', '.join(aliases)} "
+                          f"({time.perf_counter() - started:.2f}s)")
@@ -0,0 +1,205 @@
+"""
+Per-request performance instrumentation.
+
+RequestMetricsMiddleware measures, for every request, the total time, the SQL query count
+and time, the template render time and the response size. It reports them to the client
+in a Server-Timing header, and aggregates them per resolved URL name into in-process
+histograms, which the staff-only /metrics view exposes in Prometheus text format.
+
+SQL queries are timed by an execute_wrapper installed on every new database connection,
+and templates by the TimedDjangoTemplates backend (see settings.TEMPLATES). Both report
+into the metrics of the request being handled, which are tracked in a context variable,
+so queries run by sync_to_async threads are attributed to the right request too. The
+middleware is async-capable, so under ASGI async views run without a thread hop.
+"""
+
+import time
+import bisect
+import threading
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+_current_request = contextvars.ContextVar('top_films_request_metrics', default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 377, 610, 1000)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestMetrics:
+    """The measurements of a single request, accumulated while it is being handled"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+
+class Histogram:
+    """A labelled, cumulative-bucket histogram in the style of the Prometheus client library"""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}  # label value -> [bucket counts..., +Inf bucket count, sum, count]
+
+    def observe(self, label, value):
+        series = self._series.get(label)
+        if series is None:
+            series = self._series[label] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def exposition(self, label_name):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_name}="{label}"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label_name}="{label}"}} {series[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    """Thread-safe set of the per-route histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {
+            'request': Histogram('top_films_request_duration_seconds', "Total time spent handling the request", LATENCY_BUCKETS),
+            'view': Histogram('top_films_view_duration_seconds', "Request time spent outside SQL queries and template rendering", LATENCY_BUCKETS),
+            'db': Histogram('top_films_db_duration_seconds', "Time spent executing SQL queries", LATENCY_BUCKETS),
+            'queries': Histogram('top_films_db_queries', "Number of SQL queries issued", QUERY_COUNT_BUCKETS),
+            'template': Histogram('top_films_template_render_seconds', "Time spent rendering templates", LATENCY_BUCKETS),
+            'size': Histogram('top_films_response_size_bytes', "Size of the response body", SIZE_BUCKETS),
+        }
+
+    def record(self, route, values):
+        with self._lock:
+            for key, value in values.items():
+                self.histograms[key].observe(route, value)
+
+    def exposition(self):
+        with self._lock:
+            lines = []
+            for histogram in self.histograms.values():
+                lines.extend(histogram.exposition('route'))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _time_query(execute, sql, params, many, context):
+    metrics = _current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.db_queries += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class TimedTemplate:
+    """Wraps a backend template, adding its render time to the current request's metrics"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current_request.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        # Only the outermost render is timed, so nested renders aren't counted twice
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render times reported to RequestMetricsMiddleware"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class RequestMetricsMiddleware:
+    """Records each request's metrics, and adds them to the response as a Server-Timing header"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current_request.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self.record(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current_request.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self.record(request, response, metrics)
+
+    def record(self, request, response, metrics):
+        total = time.perf_counter() - metrics.start
+        view_time = max(total - metrics.db_time - metrics.template_time, 0.0)
+
+        route = request.resolver_match.view_name if request.resolver_match else '<unresolved>'
+        values = {
+            'request': total, 'view': view_time, 'db': metrics.db_time,
+            'queries': metrics.db_queries, 'template': metrics.template_time,
+        }
+        if not response.streaming:
+            values['size'] = len(response.content)
+        registry.record(route, values)
+
+        response['Server-Timing'] = ", ".join([
+            f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.db_queries} queries"',
+            f'tpl;dur={metrics.template_time * 1000:.2f}',
+            f'view;dur={view_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0012_comment_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['film', 'created_at'], name='comment_film_created_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Creates the SQLite FTS5 tables used by top_films.search, and fills them from existing rows
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0013_comment_film_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE top_films_film_fts USING fts5(title, plot, tokenize='unicode61 remove_diacritics 2')",
+                "CREATE VIRTUAL TABLE top_films_person_fts USING fts5(name, tokenize='unicode61 remove_diacritics 2')",
+                "CREATE VIRTUAL TABLE top_films_comment_fts USING fts5(comment, tokenize='unicode61 remove_diacritics 2')",
+                "INSERT INTO top_films_film_fts (rowid, title, plot) SELECT id, title, COALESCE(plot, '') FROM top_films_film",
+                "INSERT INTO top_films_person_fts (rowid, name) SELECT id, name FROM top_films_person",
+                "INSERT INTO top_films_comment_fts (rowid, comment) SELECT id, comment FROM top_films_comment",
+            ],
+            reverse_sql=[
+                "DROP TABLE top_films_film_fts",
+                "DROP TABLE top_films_person_fts",
+                "DROP TABLE top_films_comment_fts",
+            ],
+        ),
+    ]
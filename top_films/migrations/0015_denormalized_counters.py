@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='film',
+            name='fav_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='film',
+            name='watchlist_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='film_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='language',
+            name='film_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='num_acted',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='num_directed',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql=[
+                "UPDATE top_films_person SET num_directed = (SELECT COUNT(*) FROM top_films_film_directors WHERE person_id = top_films_person.id)",
+                "UPDATE top_films_person SET num_acted = (SELECT COUNT(*) FROM top_films_film_actors WHERE person_id = top_films_person.id)",
+                "UPDATE top_films_genre SET film_count = (SELECT COUNT(*) FROM top_films_film_genres WHERE genre_id = top_films_genre.id)",
+                "UPDATE top_films_language SET film_count = (SELECT COUNT(*) FROM top_films_film WHERE language_id = top_films_language.id)",
+                "UPDATE top_films_film SET comment_count = (SELECT COUNT(*) FROM top_films_comment WHERE film_id = top_films_film.id)",
+                "UPDATE top_films_film SET fav_count = (SELECT COUNT(*) FROM top_films_profile_fav_films WHERE film_id = top_films_film.id)",
+                "UPDATE top_films_film SET watchlist_count = (SELECT COUNT(*) FROM top_films_profile_films_to_watch WHERE film_id = top_films_film.id)",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Each profile's weighted favs (1.0) and watchlist entries (0.5), see recommendations.INTERACTION_WEIGHTS
+INTERACTIONS_SQL = (
+    "SELECT profile_id, film_id, SUM(weight) AS weight FROM ("
+    "SELECT profile_id, film_id, 1.0 AS weight FROM top_films_profile_fav_films UNION ALL "
+    "SELECT profile_id, film_id, 0.5 AS weight FROM top_films_profile_films_to_watch"
+    ") GROUP BY profile_id, film_id"
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0015_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmNeighbour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('fans', 'Fans also liked')], max_length=10)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbours', to='top_films.film')),
+                ('neighbour', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='top_films.film')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FilmCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField()),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='top_films.film')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='top_films.film')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='filmneighbour',
+            constraint=models.UniqueConstraint(fields=('film', 'kind', 'rank'), name='neighbour_rank_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='filmcooccurrence',
+            constraint=models.UniqueConstraint(fields=('film', 'other'), name='cooccurrence_pair_unique'),
+        ),
+        # The neighbours are left to the rebuild_recommendations command
+        migrations.RunSQL(
+            sql=(
+                "INSERT INTO top_films_filmcooccurrence (film_id, other_id, weight) "
+                f"SELECT a.film_id, b.film_id, SUM(a.weight * b.weight) FROM ({INTERACTIONS_SQL}) a "
+                f"JOIN ({INTERACTIONS_SQL}) b ON a.profile_id = b.profile_id GROUP BY a.film_id, b.film_id"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0016_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filmneighbour',
+            name='kind',
+            field=models.CharField(choices=[('fans', 'Fans also liked'), ('similar', 'Similar films')], max_length=10),
+        ),
+    ]
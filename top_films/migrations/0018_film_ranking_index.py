@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0017_similar_films'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='film',
+            name='ranking',
+            field=models.IntegerField(db_index=True, verbose_name='IMDB Ranking'),
+        ),
+    ]
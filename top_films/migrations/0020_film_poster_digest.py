@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('top_films', '0019_change_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='poster_digest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
@@ -7,30 +7,55 @@ is thus extended using a Profile model via a One2One relationship.
 """
 
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MinLengthValidator
-from django.utils.html import mark_safe, format_html
-from django.db.models.signals import post_save
+from django.utils.html import mark_safe, format_html_join
+from django.db.models.signals import post_save, pre_save
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from django.dispatch import receiver
 from django.urls import reverse
 
 
+def _exclude_counters(instance, save_kwargs):
+    """
+    Stops save() on an existing row from overwriting its denormalized counters (which
+    top_films.counters maintains with UPDATE queries) with the instance's possibly stale values
+    """
+    if instance._state.adding or save_kwargs.get('force_insert') or save_kwargs.get('update_fields') is not None:
+        return
+    save_kwargs['update_fields'] = [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.COUNTER_FIELDS
+    ]
+
+
 class Film(models.Model):
     """The core model class representing a film"""
     title = models.CharField(max_length=300, validators=[MinLengthValidator(1)], unique=True)
     ttcode = models.CharField(max_length=12, validators=[MinLengthValidator(1)], verbose_name="IMDB Code")
-    ranking = models.IntegerField(verbose_name="IMDB Ranking")
+    # Indexed for the film-detail lookups and the API's film lists, which are sorted by ranking
+    ranking = models.IntegerField(verbose_name="IMDB Ranking", db_index=True)
     imdb_rating = models.FloatField(verbose_name="IMDB Rating")
     meta_score = models.IntegerField(verbose_name="Metascore")
     year = models.IntegerField()
     plot = models.TextField(null=True, blank=True)
     poster_url = models.CharField(max_length=300, null=True, blank=True)
+    # Names the local resized variants of the poster (see top_films.posters), if they have been made
+    poster_digest = models.CharField(max_length=40, blank=True, default='', editable=False)
     language = models.ForeignKey('Language', on_delete=models.RESTRICT)
     directors = models.ManyToManyField('Person', related_name="films_directed")
     actors = models.ManyToManyField('Person', related_name="films_acted_in")
     genres = models.ManyToManyField('Genre', related_name="films")
     watched = models.BooleanField(verbose_name="Personally Watched", default=False)
+    # Denormalized counters, kept exact by the handlers in top_films.counters
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    fav_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    watchlist_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    COUNTER_FIELDS = ('comment_count', 'fav_count', 'watchlist_count')
+    # Change tracking for conditional GETs, kept up to date by the handlers in top_films.change_tracking
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         constraints = [
@@ -42,6 +67,10 @@ class Film(models.Model):
     def __str__(self):
         return f"{self.title} ({self.year})"
 
+    def save(self, *args, **kwargs):
+        _exclude_counters(self, kwargs)
+        super().save(*args, **kwargs)
+
     def display_directors(self):
         return ", ".join(director.name for director in self.directors.all())
     display_directors.short_description = "Directed By"
@@ -68,15 +97,19 @@ class Film(models.Model):
 
 
 def show_film_links(film_set, empty_val=""):
-    """Returns an HTML snippet containing links to the admin-detail page of each film in film_set"""
-    if not film_set:
+    """
+    Returns an HTML snippet containing links to the admin-detail page of each film in film_set.
+    Pass prefetched films (only their id and title are used) to avoid a query per call.
+    """
+    films = list(film_set)
+    if not films:
         return empty_val
 
-    film_links = []
-    for film in film_set:
-        edit_url = reverse('admin:top_films_film_change', args=(film.id,))
-        film_links.append(f'<a href="{edit_url}">{film.title}</a>')
-    return format_html(', '.join(film_links))
+    # One reverse() for the whole set, rather than one per film
+    url_template = reverse('admin:top_films_film_change', args=('__film_id__',))
+    return format_html_join(', ', '<a href="{}">{}</a>', (
+        (url_template.replace('__film_id__', str(film.id)), film.title) for film in films
+    ))
 
 
 class Person(models.Model):
@@ -84,6 +117,10 @@ class Person(models.Model):
     name = models.CharField(max_length=200, unique=True)
     notes = models.TextField(null=True, blank=True)
     slug = models.SlugField(unique=True)
+    num_directed = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    num_acted = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    COUNTER_FIELDS = ('num_directed', 'num_acted')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name_plural = "People"
@@ -93,6 +130,7 @@ class Person(models.Model):
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
+        _exclude_counters(self, kwargs)
         super().save(*args, **kwargs)
 
     def display_acting_credits(self):
@@ -108,12 +146,16 @@ class Genre(models.Model):
     """Simple model representing a film genre"""
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(unique=True)
+    film_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    COUNTER_FIELDS = ('film_count',)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
+        _exclude_counters(self, kwargs)
         super().save(*args, **kwargs)
 
     def display_films(self):
@@ -126,6 +168,9 @@ class Language(models.Model):
     """Simple model representing a film's primary language"""
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(unique=True)
+    film_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    COUNTER_FIELDS = ('film_count',)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def display_films(self):
         return show_film_links(self.film_set.all())
@@ -137,6 +182,7 @@ class Language(models.Model):
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
+        _exclude_counters(self, kwargs)
         super().save(*args, **kwargs)
 
 
@@ -146,6 +192,11 @@ class Comment(models.Model):
     film = models.ForeignKey('Film', on_delete=models.CASCADE)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Backs the keyset pagination of a film's comment thread (see views.get_comments_page)
+        indexes = [models.Index(fields=['film', 'created_at'], name='comment_film_created_idx')]
 
     def __str__(self):
         if len(self.comment) < 120:
@@ -168,8 +219,49 @@ class Profile(models.Model):
     display_fav_films.short_description = "Favorite Films"
     display_fav_films.allow_tags = True
 
+class FilmCooccurrence(models.Model):
+    """
+    One cell of the symmetric film x film co-occurrence matrix of the users' fav and
+    watchlist entries, maintained by top_films.recommendations. The diagonal (film == other)
+    holds each film's own squared norm.
+    """
+    film = models.ForeignKey('Film', on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey('Film', on_delete=models.CASCADE, related_name='+')
+    weight = models.FloatField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['film', 'other'], name='cooccurrence_pair_unique')]
+
+
+class FilmNeighbour(models.Model):
+    """One of a film's top-k most similar films, by one of the similarity measures in KIND_CHOICES"""
+    FANS_ALSO_LIKED = 'fans'
+    SIMILAR_FILMS = 'similar'
+    KIND_CHOICES = [
+        (FANS_ALSO_LIKED, "Fans also liked"),
+        (SIMILAR_FILMS, "Similar films"),
+    ]
+    film = models.ForeignKey('Film', on_delete=models.CASCADE, related_name='neighbours')
+    neighbour = models.ForeignKey('Film', on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['film', 'kind', 'rank'], name='neighbour_rank_unique')]
+
+
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, created, **kwargs):
     if not hasattr(instance, 'profile'):
         Profile.objects.create(user=instance)
     instance.profile.save()
+
+
+@receiver(pre_save, sender=Film)
+def forget_stale_poster_variants(sender, instance, **kwargs):
+    """Stops a film whose poster_url changes from showing the variants of its old poster until build_posters runs"""
+    if instance.pk and instance.poster_digest:
+        old_url = Film.objects.filter(pk=instance.pk).values_list('poster_url', flat=True).first()
+        if old_url != instance.poster_url:
+            instance.poster_digest = ''
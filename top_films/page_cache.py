@@ -0,0 +1,146 @@
+"""
+Versioned page cache for the public catalog views.
+
+Cached pages are keyed by a catalog version, which the signal handlers below bump on any
+change to a Film, Person, Genre or Language (or to a film's credits/genres). Bumping the
+version invalidates every cached page at once in O(1): later requests simply look up keys
+of the new version, and the orphaned entries expire from the cache on their own. The
+handlers bump it once the write commits: bumped before, a request reading the old rows in
+between would cache them under the new version, until the next change.
+
+Only anonymous GET/HEAD requests are served from the cache, since logged-in users see
+personalised navigation. A hit is answered from the cache alone, without touching the ORM.
+The decorator wraps both sync and async views; for an async view, the cache and the
+session/user lookups are awaited, so the event loop is never blocked.
+"""
+
+import uuid
+import threading
+from collections import Counter
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from .models import Film, Person, Genre, Language
+from .routers import read_source
+from . import deferred
+
+CATALOG_VERSION_KEY = 'top_films:catalog-version'
+PAGE_CACHE_TIMEOUT = getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 24 * 60 * 60)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(view_name, outcome):
+    with _stats_lock:
+        _stats[(view_name, outcome)] += 1
+
+
+def get_stats():
+    """Returns this process's {view_name: {'hits': n, 'misses': n}} page-cache counters"""
+    with _stats_lock:
+        stats = {}
+        for (view_name, outcome), count in _stats.items():
+            stats.setdefault(view_name, {'hits': 0, 'misses': 0})[outcome] = count
+        return stats
+
+
+def get_catalog_version():
+    # A random initial version can't collide with the keys of an earlier, evicted version
+    return cache.get_or_set(CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+async def aget_catalog_version():
+    return await cache.aget_or_set(CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def bump_catalog_version():
+    """Invalidates all cached catalog pages. Call this after writes that bypass model signals."""
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def _is_cacheable(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def _page_key(request, version):
+    # Pages rendered from a replica snapshot are only reused while that snapshot is current,
+    # so a page rendered from a snapshot predating a catalog change is never kept for long
+    return f'top_films:page:{version}:{read_source()}:{request.get_full_path()}'
+
+
+def _cached_response(view_name, cached):
+    """Counts the lookup's outcome, returning the cached response on a hit"""
+    if cached is None:
+        _count(view_name, 'misses')
+        return None
+    _count(view_name, 'hits')
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def _store_when_rendered(response, key):
+    def store(rendered):
+        cache.set(key, (rendered.content, rendered['Content-Type']), PAGE_CACHE_TIMEOUT)
+    if response.status_code == 200 and not response.streaming:
+        if getattr(response, 'is_rendered', True):
+            store(response)
+        else:
+            # Template responses are rendered later, off the event loop for async views
+            response.add_post_render_callback(store)
+    return response
+
+
+def cache_catalog_page(view_func):
+    """View decorator caching anonymous responses under the current catalog version"""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            # Resolving request.user may query the session and user tables
+            if not await sync_to_async(_is_cacheable)(request):
+                return await view_func(request, *args, **kwargs)
+            view_name = request.resolver_match.url_name if request.resolver_match else view_func.__name__
+            key = _page_key(request, await aget_catalog_version())
+            response = _cached_response(view_name, await cache.aget(key))
+            if response is None:
+                response = await sync_to_async(_store_when_rendered)(await view_func(request, *args, **kwargs), key)
+            return response
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not _is_cacheable(request):
+            return view_func(request, *args, **kwargs)
+        view_name = request.resolver_match.url_name if request.resolver_match else view_func.__name__
+        key = _page_key(request, get_catalog_version())
+        response = _cached_response(view_name, cache.get(key))
+        if response is None:
+            response = _store_when_rendered(view_func(request, *args, **kwargs), key)
+        return response
+    return wrapper
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Film)
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+def invalidate_on_catalog_change(sender, using=None, **kwargs):
+    deferred.defer(bump_catalog_version, using=using)
+
+
+@receiver(m2m_changed, sender=Film.directors.through)
+@receiver(m2m_changed, sender=Film.actors.through)
+@receiver(m2m_changed, sender=Film.genres.through)
+def invalidate_on_credits_change(sender, action, using=None, **kwargs):
+    if action.startswith('post_'):
+        deferred.defer(bump_catalog_version, using=using)
@@ -0,0 +1,93 @@
+"""
+Local, resized copies of the film posters, so that list pages don't pull each full-size
+poster from the image host and shrink it in the browser.
+
+Each poster is downloaded once (the original is kept under POSTER_ROOT/originals) and
+resized with Pillow into POSTER_WIDTHS variants in every POSTER_FORMATS format. A variant
+is named after a digest of the original's bytes and VARIANT_SETTINGS, e.g.
+3f2a...c1-172.webp, so a name always denotes the same bytes and can be served with a
+far-future, immutable Cache-Control header; changing a poster or the settings yields new
+names. Film.poster_digest records the digest, and the {% poster %} template tag (see
+templatetags/posters.py) renders a <picture> with a srcset of the variants, falling back
+to poster_url for films without one.
+
+The build_posters management command runs the pipeline. make_variants() runs in its worker
+processes, so this module doesn't import the models.
+"""
+
+import os
+import hashlib
+import tempfile
+import urllib.request
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+POSTER_WIDTHS = (86, 172, 300)
+# Format -> (file extension, MIME type, Pillow save() options)
+POSTER_FORMATS = {
+    'WEBP': ('webp', 'image/webp', {'quality': 80, 'method': 6}),
+    'JPEG': ('jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Part of every digest: change it, or the widths and formats, and every variant is remade under new names
+VARIANT_SETTINGS = repr((1, POSTER_WIDTHS, POSTER_FORMATS))
+DIGEST_LENGTH = 20
+# Width / height of the posters, for sizing a variant shown at a given height only
+POSTER_ASPECT = 2 / 3
+USER_AGENT = 'top_films_forum poster fetcher'
+
+
+def variant_name(digest, width, image_format):
+    return f"{digest}-{width}.{POSTER_FORMATS[image_format][0]}"
+
+
+def variant_names(digest):
+    return [variant_name(digest, width, image_format) for image_format in POSTER_FORMATS for width in POSTER_WIDTHS]
+
+
+def original_path(poster_root, url):
+    return Path(poster_root) / 'originals' / hashlib.sha1(url.encode()).hexdigest()
+
+
+def fetch_original(url, poster_root, timeout=30):
+    """Returns the path of the downloaded original of the poster at url, downloading it unless already done"""
+    path = original_path(poster_root, url)
+    if not path.exists():
+        request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            _write_atomically(path, response.read())
+    return path
+
+
+def _write_atomically(path, data):
+    # Written to a temporary file then renamed, so that a name never holds a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def make_variants(original, poster_root):
+    """
+    Writes the variants of the poster image file at original into poster_root, unless they
+    are already there; returns their digest. Raises OSError if the file isn't an image.
+    """
+    data = Path(original).read_bytes()
+    digest = hashlib.sha1(data + VARIANT_SETTINGS.encode()).hexdigest()[:DIGEST_LENGTH]
+    if all((Path(poster_root) / name).exists() for name in variant_names(digest)):
+        return digest
+    with Image.open(original) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for width in POSTER_WIDTHS:
+            resized = image.resize((width, max(round(image.height * width / image.width), 1)), Image.Resampling.LANCZOS)
+            for image_format, (_, _, options) in POSTER_FORMATS.items():
+                output = BytesIO()
+                resized.save(output, image_format, **options)
+                _write_atomically(Path(poster_root) / variant_name(digest, width, image_format), output.getvalue())
+    return digest
@@ -0,0 +1,382 @@
+"""
+Item-to-item "fans also liked" recommendations, from the co-occurrence of films in the
+users' favs and watchlists.
+
+Each user is a sparse vector over the films, weighing a fav FAV_WEIGHT and a watchlist
+entry WATCHLIST_WEIGHT. The film x film co-occurrence matrix C = X'X of the user x film
+matrix X is kept in FilmCooccurrence, and the similarity of two films is their cosine,
+C[i, j] / sqrt(C[i, i] * C[j, j]), damped by C[i, j] / (C[i, j] + SHRINKAGE) so that a
+film or two faved by the same handful of users don't come out as near-identical. Each
+film's TOP_K most similar films are stored as its FilmNeighbour rows, so serving them
+is a single indexed query.
+
+rebuild() computes everything from the through tables with SciPy. After that the
+m2m_changed and Profile delete handlers below keep it up to date: a user's change to a few
+films only touches the rows and columns of C of those films, against the other films the
+user has listed, so the handlers apply that delta in one SQL statement and defer the
+re-ranking until the transaction commits (see deferred.py). Only the scores involving a
+changed film change, as only their cells and norms do: the changed films' lists are
+re-ranked from their rows, and their new scores patched into the lists of the films they
+co-occur with. A list whose changed film falls to its last score or below is re-ranked from
+its row instead, as the film taking its place may not be on the list, so the lists stay as
+rebuild() would make them. The rebuild_recommendations command must be run after writes
+that bypass signals, as counters.recount() is.
+"""
+
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Film, FilmCooccurrence, FilmNeighbour, Profile
+from . import deferred
+from .change_tracking import ID_CHUNK_SIZE, touch_film_activity
+
+FAV_WEIGHT = 1.0
+WATCHLIST_WEIGHT = 0.5
+SHRINKAGE = 3.0
+TOP_K = 20
+PERSIST_CHUNK_SIZE = 10000
+
+# through table -> weight of one of its rows
+INTERACTION_WEIGHTS = {
+    Profile.fav_films.through: FAV_WEIGHT,
+    Profile.films_to_watch.through: WATCHLIST_WEIGHT,
+}
+
+
+def similarity(cooccurrence, norm_squared, other_norm_squared):
+    """Shrunk cosine similarity of two films (elementwise, over NumPy arrays)"""
+    return (cooccurrence / np.sqrt(norm_squared * other_norm_squared)) * (cooccurrence / (cooccurrence + SHRINKAGE))
+
+
+def _neighbour_rows(film_id, other_ids, scores):
+    """FilmNeighbour rows for the TOP_K highest of scores"""
+    top = np.argsort(-scores, kind='stable')[:TOP_K]
+    return [FilmNeighbour(film_id=film_id, neighbour_id=int(other_ids[i]), kind=FilmNeighbour.FANS_ALSO_LIKED,
+                          rank=rank, score=float(scores[i])) for rank, i in enumerate(top)]
+
+
+def _interaction_matrix():
+    """The user x film matrix X, indexed by profile and film id, as a CSR matrix"""
+    profile_ids, film_ids, weights = [], [], []
+    for through, weight in INTERACTION_WEIGHTS.items():
+        pairs = np.array(list(through.objects.values_list('profile_id', 'film_id').iterator(chunk_size=PERSIST_CHUNK_SIZE)),
+                         dtype=np.int64).reshape(-1, 2)
+        profile_ids.append(pairs[:, 0])
+        film_ids.append(pairs[:, 1])
+        weights.append(np.full(len(pairs), weight))
+    num_films = (Film.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    num_profiles = (Profile.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    # Duplicate (profile, film) entries, i.e. a film on both lists, are summed
+    return sparse.coo_matrix((np.concatenate(weights), (np.concatenate(profile_ids), np.concatenate(film_ids))),
+                             shape=(num_profiles, num_films)).tocsr()
+
+
+def _bulk_insert(model, rows):
+    for start in range(0, len(rows), PERSIST_CHUNK_SIZE):
+        model.objects.bulk_create(rows[start:start + PERSIST_CHUNK_SIZE])
+
+
+def rebuild(log=None):
+    """
+    Recomputes the co-occurrence matrix and every film's neighbours from the through tables.
+    Returns the seconds spent loading, computing and storing them.
+    """
+    timings = {}
+    started = time.perf_counter()
+    interactions = _interaction_matrix()
+    timings['load'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cooccurrence = (interactions.T @ interactions).tocsr()
+    cooccurrence.sort_indices()
+    norms_squared = cooccurrence.diagonal()
+    neighbour_rows = []
+    for film_id in np.flatnonzero(norms_squared):
+        start, end = cooccurrence.indptr[film_id], cooccurrence.indptr[film_id + 1]
+        other_ids, weights = cooccurrence.indices[start:end], cooccurrence.data[start:end]
+        is_other = other_ids != film_id
+        other_ids, weights = other_ids[is_other], weights[is_other]
+        if len(other_ids):
+            scores = similarity(weights, norms_squared[film_id], norms_squared[other_ids])
+            neighbour_rows.extend(_neighbour_rows(film_id, other_ids, scores))
+    timings['compute'] = time.perf_counter() - started
+    if log:
+        log(f"{interactions.nnz} interactions, {cooccurrence.nnz} co-occurrences, {len(neighbour_rows)} neighbours")
+
+    started = time.perf_counter()
+    coo = cooccurrence.tocoo()
+    with transaction.atomic():
+        FilmCooccurrence.objects.all().delete()
+        with connection.cursor() as cursor:
+            table = FilmCooccurrence._meta.db_table
+            for start in range(0, coo.nnz, PERSIST_CHUNK_SIZE):
+                end = start + PERSIST_CHUNK_SIZE
+                cursor.executemany(f"INSERT INTO {table} (film_id, other_id, weight) VALUES (%s, %s, %s)",
+                                   zip(coo.row[start:end].tolist(), coo.col[start:end].tolist(), coo.data[start:end].tolist()))
+        FilmNeighbour.objects.filter(kind=FilmNeighbour.FANS_ALSO_LIKED).delete()
+        _bulk_insert(FilmNeighbour, neighbour_rows)
+        touch_film_activity()
+    timings['store'] = time.perf_counter() - started
+    return timings
+
+
+def _store_neighbours(film_ids, neighbour_rows):
+    """Replaces the neighbours of film_ids with neighbour_rows"""
+    with transaction.atomic():
+        for start in range(0, len(film_ids), ID_CHUNK_SIZE):
+            FilmNeighbour.objects.filter(film_id__in=film_ids[start:start + ID_CHUNK_SIZE],
+                                         kind=FilmNeighbour.FANS_ALSO_LIKED).delete()
+        _bulk_insert(FilmNeighbour, neighbour_rows)
+        touch_film_activity(film_ids)
+
+
+def _scored_rows(film_ids):
+    """{film_id: (other ids, their scores)} of the co-occurring films of each of film_ids, by other id"""
+    cells = defaultdict(list)
+    table = FilmCooccurrence._meta.db_table
+    with connection.cursor() as cursor:
+        for start in range(0, len(film_ids), ID_CHUNK_SIZE):
+            cursor.execute(
+                f"SELECT c.film_id, c.other_id, c.weight, n.weight FROM json_each(%s) AS f "
+                f"JOIN {table} AS c ON c.film_id = f.value "
+                f"JOIN {table} AS n ON n.film_id = c.other_id AND n.other_id = c.other_id "
+                f"ORDER BY c.film_id, c.other_id",
+                [json.dumps(film_ids[start:start + ID_CHUNK_SIZE])])
+            for film_id, other_id, weight, other_norm_squared in cursor.fetchall():
+                cells[film_id].append((other_id, weight, other_norm_squared))
+
+    rows = {}
+    for film_id, film_cells in cells.items():
+        other_ids, weights, other_norms_squared = (np.array(column) for column in zip(*film_cells))
+        is_self = other_ids == film_id
+        if not is_self.any() or is_self.all():
+            continue
+        rows[film_id] = (other_ids[~is_self], similarity(weights[~is_self], weights[is_self][0],
+                                                          other_norms_squared[~is_self]))
+    return rows
+
+
+def _rerank(film_ids):
+    """FilmNeighbour rows for the TOP_K most similar of all the co-occurring films of each of film_ids"""
+    neighbour_rows = []
+    for film_id, (other_ids, scores) in _scored_rows(film_ids).items():
+        neighbour_rows.extend(_neighbour_rows(film_id, other_ids, scores))
+    return neighbour_rows
+
+
+def _patch(changed, changed_rows):
+    """
+    Patches the new scores of the changed films, read off their rows (changed_rows, as
+    returned by _scored_rows(), which has none for the films left without any), into the neighbour lists of the other films that list them
+    or co-occur with them, whose scores with their other neighbours haven't changed. Returns
+    the ids of the lists that differ, the (film_id, rank, neighbour_id, score) rows that
+    differ in them and the (film_id, length) of those that got shorter, and the ids of the
+    lists that must be re-ranked from their whole rows instead.
+    """
+    new_scores = defaultdict(dict)
+    for changed_id, (other_ids, scores) in changed_rows.items():
+        for other_id, score in zip(other_ids.tolist(), scores.tolist()):
+            new_scores[other_id][changed_id] = score
+    changed_ids = sorted(changed)
+    listing = set()
+    for start in range(0, len(changed_ids), ID_CHUNK_SIZE):
+        listing.update(FilmNeighbour.objects.filter(
+            neighbour_id__in=changed_ids[start:start + ID_CHUNK_SIZE], kind=FilmNeighbour.FANS_ALSO_LIKED).values_list(
+            'film_id', flat=True))
+    listing -= changed
+
+    # Of the lists that don't hold a changed film, only those one now scores into are loaded.
+    # The k-th score of a full list is that of its last rank; shorter lists take any score.
+    candidate_ids = sorted(new_scores.keys() - changed - listing)
+    kth_scores = {}
+    for start in range(0, len(candidate_ids), ID_CHUNK_SIZE):
+        kth_scores.update(FilmNeighbour.objects.filter(
+            film_id__in=candidate_ids[start:start + ID_CHUNK_SIZE], kind=FilmNeighbour.FANS_ALSO_LIKED,
+            rank=TOP_K - 1).values_list('film_id', 'score'))
+    # (A film tying with the k-th score takes its place if its id is lower, as in rebuild())
+    film_ids = sorted(listing | {film_id for film_id in candidate_ids
+                                 if max(new_scores[film_id].values()) >= kth_scores.get(film_id, 0)})
+    current = defaultdict(dict)
+    for start in range(0, len(film_ids), ID_CHUNK_SIZE):
+        for film_id, rank, neighbour_id, score in FilmNeighbour.objects.filter(
+                film_id__in=film_ids[start:start + ID_CHUNK_SIZE], kind=FilmNeighbour.FANS_ALSO_LIKED).values_list(
+                'film_id', 'rank', 'neighbour_id', 'score'):
+            current[film_id][rank] = (neighbour_id, score)
+
+    patched_ids, changed_rows, shortened, reranked_ids = [], [], [], []
+    for film_id in film_ids:
+        ranked, scores = dict(current[film_id].values()), new_scores[film_id]
+        kth_score = min(ranked.values()) if len(ranked) >= TOP_K else 0
+        # A full list's changed film that falls to its k-th score or below may give way to a
+        # film that isn't on the list, which only the whole row tells
+        if kth_score and any(scores.get(changed_id, 0) <= kth_score for changed_id in changed if changed_id in ranked):
+            reranked_ids.append(film_id)
+            continue
+        ranked = {neighbour_id: score for neighbour_id, score in ranked.items() if neighbour_id not in changed}
+        ranked.update(scores)
+        top = sorted(ranked.items(), key=lambda item: (-item[1], item[0]))[:TOP_K]
+        # Mostly a changed film's score alone moves, so only the rows that differ are written
+        rows = [(film_id, rank, neighbour_id, score) for rank, (neighbour_id, score) in enumerate(top)
+                if current[film_id].get(rank) != (neighbour_id, score)]
+        if len(top) < len(current[film_id]):
+            shortened.append((film_id, len(top)))
+        elif not rows:
+            continue
+        changed_rows.extend(rows)
+        patched_ids.append(film_id)
+    return patched_ids, changed_rows, shortened, reranked_ids
+
+
+def _store_patches(patched_ids, changed_rows, shortened):
+    """Writes the rows that _patch() changed, and cuts the lists it shortened"""
+    table = FilmNeighbour._meta.db_table
+    kind = FilmNeighbour.FANS_ALSO_LIKED
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(changed_rows), PERSIST_CHUNK_SIZE):
+            cursor.executemany(
+                f"INSERT INTO {table} (film_id, kind, rank, neighbour_id, score) VALUES (%s, %s, %s, %s, %s) "
+                f"ON CONFLICT (film_id, kind, rank) DO UPDATE SET neighbour_id = excluded.neighbour_id, "
+                f"score = excluded.score",
+                [(film_id, kind, rank, neighbour_id, score)
+                 for film_id, rank, neighbour_id, score in changed_rows[start:start + PERSIST_CHUNK_SIZE]])
+        cursor.executemany(f"DELETE FROM {table} WHERE film_id = %s AND kind = %s AND rank >= %s",
+                           [(film_id, kind, length) for film_id, length in shortened])
+        touch_film_activity(patched_ids)
+
+
+def rerank_changes(changed):
+    """
+    Re-ranks the neighbours of the films whose co-occurrences changed from their whole rows,
+    and patches their new scores into the lists of the films they co-occur with, re-ranking
+    those where the patch can't tell the list's new last films
+    """
+    changed_rows = _scored_rows(changed)
+    patched_ids, patched_rows, shortened, reranked_ids = _patch(set(changed), changed_rows)
+    neighbour_rows = [row for film_id, (other_ids, scores) in changed_rows.items()
+                      for row in _neighbour_rows(film_id, other_ids, scores)]
+    with transaction.atomic():
+        _store_neighbours(changed + reranked_ids, neighbour_rows + _rerank(reranked_ids))
+        _store_patches(patched_ids, patched_rows, shortened)
+
+
+# The cells of C that change when one profile's weights of the films in the JSON array of
+# [film_id, delta] pairs change by delta: with the profile's new weights w and old weights
+# w - delta, cell (a, b) changes by w_a * w_b - (w_a - delta_a) * (w_b - delta_b), which is
+# non-zero only if a or b changed. Returns the updated cells' new weights, to find the zeroed ones.
+_APPLY_DELTAS_SQL = """
+WITH changed(film_id, delta) AS (
+    SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(%s)
+), listed(film_id, new, old) AS (
+    SELECT film_id, SUM(weight), SUM(weight) - SUM(delta) FROM (
+        SELECT film_id, %s AS weight, 0 AS delta FROM {fav_table} WHERE profile_id = %s
+        UNION ALL SELECT film_id, %s, 0 FROM {watchlist_table} WHERE profile_id = %s
+        UNION ALL SELECT film_id, 0, delta FROM changed
+    ) GROUP BY film_id
+), cells(film_id, other_id, delta) AS (
+    SELECT a.film_id, b.film_id, a.new * b.new - a.old * b.old FROM changed JOIN listed AS a USING (film_id), listed AS b
+    UNION ALL
+    SELECT b.film_id, a.film_id, a.new * b.new - a.old * b.old FROM changed JOIN listed AS a USING (film_id), listed AS b
+    WHERE b.film_id NOT IN (SELECT film_id FROM changed)
+)
+INSERT INTO {table} (film_id, other_id, weight)
+SELECT film_id, other_id, delta FROM cells WHERE delta != 0
+ON CONFLICT (film_id, other_id) DO UPDATE SET weight = weight + excluded.weight
+RETURNING film_id, weight
+"""
+
+
+def apply_interaction_changes(profile_id, deltas, using=None):
+    """
+    Updates the co-occurrences for the change by deltas ({film_id: weight delta}) of the
+    weights of a profile's films, which the through tables already reflect, and defers the
+    re-ranking of the neighbours of the films concerned until the transaction commits
+    """
+    deltas = {film_id: delta for film_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    table = FilmCooccurrence._meta.db_table
+    sql = _APPLY_DELTAS_SQL.format(table=table, fav_table=Profile.fav_films.through._meta.db_table,
+                                   watchlist_table=Profile.films_to_watch.through._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [json.dumps(list(deltas.items())), FAV_WEIGHT, profile_id, WATCHLIST_WEIGHT, profile_id])
+        if any(weight <= 1e-9 for _, weight in cursor.fetchall()):
+            changed = json.dumps(list(deltas))
+            cursor.execute(f"DELETE FROM {table} WHERE weight <= 1e-9 AND ("
+                           f"film_id IN (SELECT value FROM json_each(%s)) OR other_id IN (SELECT value FROM json_each(%s)))",
+                           [changed, changed])
+    deferred.defer(rerank_changes, using=using, changed=deltas)
+
+
+def _listed_ids(through, reverse, owner_id, ids=None):
+    """The ids on the other side of owner_id's rows of through, among ids if given"""
+    owner, other = ('film_id', 'profile_id') if reverse else ('profile_id', 'film_id')
+    rows = through.objects.filter(**{owner: owner_id})
+    if ids is not None:
+        rows = rows.filter(**{f'{other}__in': ids})
+    return set(rows.values_list(other, flat=True))
+
+
+@receiver(m2m_changed)
+def update_recommendations(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if sender not in INTERACTION_WEIGHTS:
+        return
+    if action in ('pre_remove', 'pre_clear'):
+        # pk_set holds every id passed to remove(), listed or not, and clear() has none
+        instance._recommendations_removed = _listed_ids(sender, reverse, instance.pk,
+                                                         pk_set if action == 'pre_remove' else None)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_add':
+            ids, delta = pk_set, INTERACTION_WEIGHTS[sender]
+        else:
+            ids, delta = instance.__dict__.pop('_recommendations_removed', set()), -INTERACTION_WEIGHTS[sender]
+        if not reverse:
+            apply_interaction_changes(instance.pk, dict.fromkeys(ids, delta), using)
+        else:
+            for profile_id in ids:
+                apply_interaction_changes(profile_id, {instance.pk: delta}, using)
+
+
+@receiver(pre_delete, sender=Profile)
+def remember_profile_weights(sender, instance, **kwargs):
+    # Deleting a user cascades to their through rows without any m2m_changed signal
+    weights = defaultdict(float)
+    for through, weight in INTERACTION_WEIGHTS.items():
+        for film_id in _listed_ids(through, False, instance.pk):
+            weights[film_id] += weight
+    instance._recommendations_weights = weights
+
+
+@receiver(post_delete, sender=Profile)
+def forget_profile_weights(sender, instance, using, **kwargs):
+    weights = instance.__dict__.pop('_recommendations_weights', {})
+    apply_interaction_changes(instance.pk, {film_id: -weight for film_id, weight in weights.items()}, using)
+
+
+def fans_also_liked(film_id, limit=10):
+    """The films most similar to film_id by co-occurrence, most similar first"""
+    return FilmNeighbour.objects.filter(film_id=film_id, kind=FilmNeighbour.FANS_ALSO_LIKED).select_related(
+        'neighbour').order_by('rank')[:limit]
+
+
+def recommended_for(user, limit=10):
+    """
+    The films most similar, in sum, to those on user's fav and watchlist lists, from the
+    lists' films' stored neighbours, excluding the films already listed
+    """
+    profile_lists = Q(favorited_by__user_id=user.id) | Q(on_watchlist_of__user_id=user.id)
+    listed_ids = Film.objects.filter(profile_lists).values('id')
+    ranked_ids = list(FilmNeighbour.objects.filter(
+        film_id__in=listed_ids, kind=FilmNeighbour.FANS_ALSO_LIKED).exclude(neighbour_id__in=listed_ids).values(
+        'neighbour_id').annotate(total=Sum('score')).order_by('-total', 'neighbour_id').values_list(
+        'neighbour_id', flat=True)[:limit])
+    films = Film.objects.in_bulk(ranked_ids)
+    return [films[film_id] for film_id in ranked_ids if film_id in films]
@@ -0,0 +1,147 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the primary ('default') database. Reads made by views marked with
+@replica_reads (or class-based views with reads_from_replica = True) go to one of the
+read replicas listed in settings.READ_REPLICAS instead -- SQLite snapshots of the primary,
+refreshed by the snapshot_replicas command. Only this app's models are read from a
+replica; sessions and auth, which must never be stale, stay on the primary.
+
+Replicas lag the primary by up to one snapshot interval, so a client that has just written
+is pinned to the primary for REPLICA_STICKY_SECONDS afterwards (read-your-writes). The pin
+is a cookie set by ReplicaRoutingMiddleware on any response to a request that wrote.
+"""
+
+import os
+import time
+import random
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'top_films_primary_pin'
+ROUTED_APP_LABEL = 'top_films'
+
+_current_routing = contextvars.ContextVar('top_films_replica_routing', default=None)
+
+
+def replica_reads(view_func):
+    """Marks a read-only view whose queries may be served by a read replica"""
+    view_func.reads_from_replica = True
+    return view_func
+
+
+class RequestRouting:
+    """The replica chosen for a request's reads, if any, and whether the request has written"""
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.replica = None
+        self.wrote = False
+
+
+def _available_replicas():
+    """(alias, snapshot time) of each replica that has a snapshot installed"""
+    replicas = []
+    for alias in getattr(settings, 'READ_REPLICAS', []):
+        try:
+            # snapshot_replicas sets a snapshot's mtime to the time it was taken
+            replicas.append((alias, os.stat(connections[alias].database_file()).st_mtime_ns))
+        except OSError:
+            pass
+    return replicas
+
+
+def read_source():
+    """
+    Identifies the data the current request reads: 'primary', or 'snapshot-<time>' for a
+    replica. Replicas installed from the same snapshot share the same identity.
+    """
+    routing = _current_routing.get()
+    if routing is None or routing.replica is None:
+        return 'primary'
+    return f'snapshot-{routing.replica[1]}'
+
+
+class PrimaryReplicaRouter:
+    """Routes the reads of replica_reads views to a read replica, and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        routing = _current_routing.get()
+        if routing is not None and routing.replica is not None and model._meta.app_label == ROUTED_APP_LABEL:
+            return routing.replica[0]
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas are copies of the primary, so objects from any of them may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the primary's schema with each snapshot
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """Picks a replica for the reads of replica_reads views, and pins clients that write to the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _routing_for(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        return RequestRouting(pinned=pinned_until > time.time())
+
+    def _pin_if_written(self, routing, response):
+        if routing.wrote:
+            sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 300)
+            response.set_cookie(PIN_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        routing = self._routing_for(request)
+        token = _current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_routing.reset(token)
+        return self._pin_if_written(routing, response)
+
+    async def __acall__(self, request):
+        routing = self._routing_for(request)
+        token = _current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_routing.reset(token)
+        return self._pin_if_written(routing, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _current_routing.get()
+        view_class = getattr(view_func, 'view_class', None)
+        marked = getattr(view_func, 'reads_from_replica', False) or getattr(view_class, 'reads_from_replica', False)
+        if routing is None or routing.pinned or not marked:
+            return None
+        replicas = _available_replicas()
+        if replicas:
+            # All of a request's reads come from the one snapshot
+            routing.replica = random.choice(replicas)
+        return None
@@ -0,0 +1,131 @@
+"""
+Full-text search over films, people and comments, built on SQLite FTS5.
+
+Each searchable model has an FTS5 virtual table whose rowid is the model's primary key
+(see migration 0014). The tables are kept in sync by the signal handlers below; rows
+written with bulk_create() bypass signals, so bulk writers should call rebuild_index()
+afterwards (the rebuild_search_index management command does the same).
+"""
+
+import re
+
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Film, Person, Comment
+
+# kind -> (model, FTS table, indexed model fields, bm25 column weights)
+SEARCH_INDEXES = {
+    'film': (Film, 'top_films_film_fts', ('title', 'plot'), (10.0, 1.0)),
+    'person': (Person, 'top_films_person_fts', ('name',), (1.0,)),
+    'comment': (Comment, 'top_films_comment_fts', ('comment',), (1.0,)),
+}
+
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+def build_match_query(text):
+    """Turns free text into an FTS5 query matching every word as a prefix, e.g. 'tom ha' -> '"tom"* "ha"*'"""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+def _index_row(kind, obj):
+    _, table, fields, _ = SEARCH_INDEXES[kind]
+    placeholders = ", ".join(["%s"] * (len(fields) + 1))
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT OR REPLACE INTO {table} (rowid, {', '.join(fields)}) VALUES ({placeholders})",
+                       [obj.pk, *(getattr(obj, field) or "" for field in fields)])
+
+
+def _unindex_row(kind, pk):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_INDEXES[kind][1]} WHERE rowid = %s", [pk])
+
+
+def rebuild_index(kinds=None):
+    """Repopulates the FTS tables of the given kinds (all by default) from their models' tables"""
+    with connection.cursor() as cursor:
+        for kind in kinds or SEARCH_INDEXES:
+            model, table, fields, _ = SEARCH_INDEXES[kind]
+            columns = ", ".join(fields)
+            source_columns = ", ".join(f"COALESCE({field}, '')" for field in fields)
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"INSERT INTO {table} (rowid, {columns}) SELECT id, {source_columns} FROM {model._meta.db_table}")
+
+
+def matching_ids_sql(kind):
+    """SQL (with one %s parameter for the match query) selecting the ids of matching rows, for use with RawSQL"""
+    table = SEARCH_INDEXES[kind][1]
+    return f"SELECT rowid FROM {table} WHERE {table} MATCH %s"
+
+
+class SearchResults:
+    """
+    A lazily-evaluated, BM25-ranked result list spanning one or more kinds, which supports
+    count() and slicing so it can be handed straight to a Paginator. Each slice runs a
+    single ranked UNION query over the FTS tables, then loads the matched objects in bulk.
+    """
+
+    def __init__(self, text, kinds=None):
+        self.match_query = build_match_query(text)
+        self.kinds = [kind for kind in (kinds or SEARCH_INDEXES) if kind in SEARCH_INDEXES]
+
+    def _union_sql(self, select):
+        parts, params = [], []
+        for kind in self.kinds:
+            _, table, _, weights = SEARCH_INDEXES[kind]
+            bm25 = f"bm25({table}, {', '.join(map(str, weights))})"
+            snippet = f"snippet({table}, -1, '{_MARK_START}', '{_MARK_END}', '...', 16)"
+            columns = select.format(kind=kind, bm25=bm25, snippet=snippet)
+            parts.append(f"SELECT {columns} FROM {table} WHERE {table} MATCH %s")
+            params.append(self.match_query)
+        return " UNION ALL ".join(parts), params
+
+    def count(self):
+        if not self.match_query or not self.kinds:
+            return 0
+        sql, params = self._union_sql("1")
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM ({sql})", params)
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, page_slice):
+        if not self.match_query or not self.kinds:
+            return []
+        sql, params = self._union_sql("'{kind}' AS kind, rowid AS object_id, {bm25} AS score, {snippet} AS snippet")
+        limit = page_slice.stop - page_slice.start
+        with connection.cursor() as cursor:
+            cursor.execute(f"{sql} ORDER BY score LIMIT %s OFFSET %s", params + [limit, page_slice.start])
+            rows = cursor.fetchall()
+
+        objects = {}
+        for kind in {row[0] for row in rows}:
+            manager = SEARCH_INDEXES[kind][0].objects
+            if kind == 'comment':
+                manager = manager.select_related('film', 'author')
+            objects[kind] = manager.in_bulk([row[1] for row in rows if row[0] == kind])
+        return [
+            {'kind': kind, 'object': objects[kind][object_id], 'score': -score, 'snippet': _highlight(snippet)}
+            for kind, object_id, score, snippet in rows if object_id in objects[kind]
+        ]
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Comment)
+def index_saved_object(sender, instance, **kwargs):
+    _index_row(sender._meta.model_name, instance)
+
+
+@receiver(post_delete, sender=Film)
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Comment)
+def unindex_deleted_object(sender, instance, **kwargs):
+    _unindex_row(sender._meta.model_name, instance.pk)
@@ -0,0 +1,252 @@
+"""
+Content-based "similar films": films sharing genres, directors and actors.
+
+Each film is a sparse TF-IDF vector over its genres, directors and actors -- one feature
+per genre and one per person in each role, weighted by FEATURE_WEIGHTS and by the
+feature's inverse document frequency, so that sharing a rare actor counts for more than
+sharing the Drama genre -- normalized to unit length. The similarity of two films is the
+cosine of their vectors. rebuild() computes every film's TOP_K neighbours with batched
+sparse matrix products and stores them as FilmNeighbour rows of kind SIMILAR_FILMS.
+
+When a film's genres, directors or actors change, the handler below recomputes that
+film's neighbours exactly once its transaction commits (see deferred.py), from the feature
+rows of the films it shares a feature with alone, and moves the film up or down (or into
+or out of) those films' neighbour lists. Their lists are patched rather than recomputed,
+and the IDF weights shift with every change, so the rebuild_similar_films command (run
+after bulk imports, and e.g. nightly) restores exact results.
+"""
+
+import json
+import operator
+from functools import reduce
+
+import numpy as np
+from scipy import sparse
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, Min, OuterRef
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .models import Film, FilmNeighbour, Genre, Person
+from . import deferred
+from .change_tracking import touch_film_activity
+
+TOP_K = 20
+SIMILARITY_BATCH_SIZE = 500
+PERSIST_CHUNK_SIZE = 10000
+# Film ids per IN (...) list, within SQLite's limit on query parameters
+ID_CHUNK_SIZE = 500
+
+# through table -> (feature id column, feature weight)
+FEATURE_WEIGHTS = {
+    Film.genres.through: ('genre_id', 1.0),
+    Film.directors.through: ('person_id', 2.0),
+    Film.actors.through: ('person_id', 1.0),
+}
+
+
+def _feature_offsets():
+    """{through table: offset of its features' columns in the feature matrix}, and the number of columns"""
+    num_ids = {
+        'genre_id': (Genre.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1,
+        'person_id': (Person.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1,
+    }
+    offsets, offset = {}, 0
+    for through, (feature_column, _) in FEATURE_WEIGHTS.items():
+        offsets[through] = offset
+        offset += num_ids[feature_column]
+    return offsets, offset
+
+
+def _tf_idf(features, document_frequency, num_with_features):
+    """features (film x feature weights) weighted by inverse document frequency, with unit-length rows"""
+    idf = np.log((1 + max(num_with_features, 1)) / (1 + document_frequency)) + 1
+    features = features @ sparse.diags(idf)
+    norms = np.sqrt(features.multiply(features).sum(axis=1)).A1
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ features).tocsr()
+
+
+def feature_matrix():
+    """The film x feature TF-IDF matrix, indexed by film id, with unit-length rows, as a CSR matrix"""
+    num_films = (Film.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    offsets, num_features = _feature_offsets()
+    film_ids, feature_ids, weights = [], [], []
+    for through, (feature_column, weight) in FEATURE_WEIGHTS.items():
+        pairs = np.array(list(through.objects.values_list('film_id', feature_column)), dtype=np.int64).reshape(-1, 2)
+        film_ids.append(pairs[:, 0])
+        feature_ids.append(pairs[:, 1] + offsets[through])
+        weights.append(np.full(len(pairs), weight))
+    features = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(film_ids), np.concatenate(feature_ids))),
+                                 shape=(num_films, num_features))
+    return _tf_idf(features, features.getnnz(axis=0), np.count_nonzero(features.getnnz(axis=1)))
+
+
+def _related_features(film_ids):
+    """
+    (sorted array of film ids, CSR matrix of their TF-IDF rows) of film_ids and the films
+    sharing a genre, director or actor with them. The rows are computed from those films'
+    features and the document frequencies of those features, not the whole feature matrix.
+    """
+    offsets, num_features = _feature_offsets()
+    film_ids = list(film_ids)
+    # Id lists are passed as one JSON array parameter, which SQLite's json_each() unpacks
+    with connection.cursor() as cursor:
+        related_ids = set(film_ids)
+        for through, (feature_column, _) in FEATURE_WEIGHTS.items():
+            table = through._meta.db_table
+            cursor.execute(f"SELECT DISTINCT film_id FROM {table} WHERE {feature_column} IN ("
+                           f"SELECT {feature_column} FROM {table} WHERE film_id IN (SELECT value FROM json_each(%s)))",
+                           [json.dumps(film_ids)])
+            related_ids.update(film_id for film_id, in cursor.fetchall())
+        local_ids = np.array(sorted(related_ids), dtype=np.int64)
+
+        rows, feature_ids, weights = [], [], []
+        document_frequency = np.zeros(num_features)
+        for through, (feature_column, weight) in FEATURE_WEIGHTS.items():
+            table = through._meta.db_table
+            cursor.execute(f"SELECT t.film_id, t.{feature_column} FROM json_each(%s) AS f JOIN {table} AS t "
+                           f"ON t.film_id = f.value", [json.dumps(local_ids.tolist())])
+            pairs = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+            rows.append(np.searchsorted(local_ids, pairs[:, 0]))
+            feature_ids.append(pairs[:, 1] + offsets[through])
+            weights.append(np.full(len(pairs), weight))
+            cursor.execute(f"SELECT t.{feature_column}, COUNT(*) FROM json_each(%s) AS f JOIN {table} AS t "
+                           f"ON t.{feature_column} = f.value GROUP BY t.{feature_column}",
+                           [json.dumps(np.unique(pairs[:, 1]).tolist())])
+            counts = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+            document_frequency[counts[:, 0] + offsets[through]] = counts[:, 1]
+    num_with_features = Film.objects.filter(reduce(operator.or_, (
+        Exists(through.objects.filter(film_id=OuterRef('pk'))) for through in FEATURE_WEIGHTS))).count()
+    features = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(feature_ids))),
+                                 shape=(len(local_ids), num_features))
+    return local_ids, _tf_idf(features, document_frequency, num_with_features)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+def _top_neighbours(film_id, similarities):
+    """(film, neighbour, rank, score) rows for the TOP_K most similar films of a row of the similarity matrix"""
+    other_ids, scores = similarities.indices, similarities.data
+    is_other = (other_ids != film_id) & (scores > 0)
+    other_ids, scores = other_ids[is_other], scores[is_other]
+    if len(scores) > TOP_K:
+        top = np.argpartition(-scores, TOP_K)[:TOP_K]
+        other_ids, scores = other_ids[top], scores[top]
+    order = np.lexsort((other_ids, -scores))
+    return [(int(film_id), int(other_ids[i]), rank, float(scores[i])) for rank, i in enumerate(order)]
+
+
+def _store(neighbour_rows, film_ids=None):
+    """Replaces the similar films of film_ids (all films by default) with neighbour_rows"""
+    # Written with executemany() rather than bulk_create(), which spends far longer building model instances
+    table = FilmNeighbour._meta.db_table
+    with transaction.atomic():
+        if film_ids is None:
+            FilmNeighbour.objects.filter(kind=FilmNeighbour.SIMILAR_FILMS).delete()
+        else:
+            for chunk in _chunks(film_ids):
+                FilmNeighbour.objects.filter(kind=FilmNeighbour.SIMILAR_FILMS, film_id__in=chunk).delete()
+        with connection.cursor() as cursor:
+            for start in range(0, len(neighbour_rows), PERSIST_CHUNK_SIZE):
+                cursor.executemany(
+                    f"INSERT INTO {table} (film_id, neighbour_id, kind, rank, score) VALUES (%s, %s, %s, %s, %s)",
+                    [(film_id, neighbour_id, FilmNeighbour.SIMILAR_FILMS, rank, score)
+                     for film_id, neighbour_id, rank, score in neighbour_rows[start:start + PERSIST_CHUNK_SIZE]])
+        touch_film_activity(film_ids)
+
+
+def rebuild():
+    """Recomputes every film's similar films; returns the number of neighbour rows stored"""
+    features = feature_matrix()
+    transposed = features.T.tocsc()
+    film_ids = np.flatnonzero(features.getnnz(axis=1))
+    neighbour_rows = []
+    for start in range(0, len(film_ids), SIMILARITY_BATCH_SIZE):
+        batch = film_ids[start:start + SIMILARITY_BATCH_SIZE]
+        similarities = (features[batch] @ transposed).tocsr()
+        for row, film_id in enumerate(batch):
+            neighbour_rows.extend(_top_neighbours(film_id, similarities.getrow(row)))
+    _store(neighbour_rows)
+    return len(neighbour_rows)
+
+
+def refresh(film_ids):
+    """Recomputes the similar films of film_ids, and patches them into the lists of the films they resemble"""
+    if len(film_ids) > ID_CHUNK_SIZE:
+        for chunk in _chunks(film_ids):
+            refresh(chunk)
+        return
+    film_ids = sorted(Film.objects.filter(pk__in=film_ids).values_list('id', flat=True))
+    if not film_ids:
+        return
+    local_ids, features = _related_features(film_ids)
+    local_similarities = (features[np.searchsorted(local_ids, film_ids)] @ features.T).tocsr()
+    # Indexed by film id again, as in the whole feature matrix
+    similarities = sparse.csr_matrix(
+        (local_similarities.data, local_ids[local_similarities.indices], local_similarities.indptr),
+        shape=(len(film_ids), int(local_ids[-1]) + 1))
+
+    # The films whose lists the changed films may enter or leave: those they now resemble,
+    # and those that list them already
+    listing = set(FilmNeighbour.objects.filter(kind=FilmNeighbour.SIMILAR_FILMS, neighbour_id__in=film_ids).values_list(
+        'film_id', flat=True)) - set(film_ids)
+    resembling = (set(similarities.indices.tolist()) - set(film_ids)) | listing
+    new_scores = {other_id: dict.fromkeys(film_ids, 0.0) for other_id in resembling}
+    coo = similarities.tocoo()
+    for row, other_id, score in zip(coo.row.tolist(), coo.col.tolist(), coo.data.tolist()):
+        if other_id in new_scores:
+            new_scores[other_id][film_ids[row]] = score
+
+    # Only the lists that list a changed film, or that one now scores into, are loaded and patched
+    kth_scores = {}
+    for chunk in _chunks(resembling - listing):
+        for film_id, num_neighbours, lowest_score in FilmNeighbour.objects.filter(
+                kind=FilmNeighbour.SIMILAR_FILMS, film_id__in=chunk).values('film_id').annotate(
+                num_neighbours=Count('id'), lowest_score=Min('score')).values_list('film_id', 'num_neighbours', 'lowest_score'):
+            kth_scores[film_id] = lowest_score if num_neighbours >= TOP_K else 0
+    patched_ids = sorted(listing | {other_id for other_id in resembling - listing
+                                    if max(new_scores[other_id].values()) > kth_scores.get(other_id, 0)})
+    current = {}
+    for chunk in _chunks(patched_ids):
+        for film_id, neighbour_id, score in FilmNeighbour.objects.filter(
+                kind=FilmNeighbour.SIMILAR_FILMS, film_id__in=chunk).values_list('film_id', 'neighbour_id', 'score'):
+            current.setdefault(film_id, {})[neighbour_id] = score
+
+    neighbour_rows = []
+    for row, film_id in enumerate(film_ids):
+        neighbour_rows.extend(_top_neighbours(film_id, similarities.getrow(row)))
+    for other_id in patched_ids:
+        scores = new_scores[other_id]
+        ranked = {neighbour_id: score for neighbour_id, score in current.get(other_id, {}).items()
+                  if neighbour_id not in scores}
+        ranked.update({film_id: score for film_id, score in scores.items() if score > 0})
+        top = sorted(ranked.items(), key=lambda item: (-item[1], item[0]))[:TOP_K]
+        neighbour_rows.extend((other_id, neighbour_id, rank, score) for rank, (neighbour_id, score) in enumerate(top))
+    _store(neighbour_rows, film_ids + patched_ids)
+
+
+@receiver(m2m_changed)
+def refresh_similar_films(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if sender not in FEATURE_WEIGHTS or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        film_ids = {instance.pk}
+    elif action == 'post_clear':
+        # A person or genre's films were all cleared; the next rebuild catches up with them
+        return
+    else:
+        film_ids = set(pk_set)
+    # A film form saves all three relations, so the refresh runs once, after the commit
+    deferred.defer(refresh, using=using, film_ids=film_ids)
+
+
+def similar_films(film_id, limit=10):
+    """The films most similar to film_id by their genres, directors and actors, most similar first"""
+    return FilmNeighbour.objects.filter(film_id=film_id, kind=FilmNeighbour.SIMILAR_FILMS).select_related(
+        'neighbour').order_by('rank')[:limit]
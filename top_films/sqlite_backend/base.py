@@ -0,0 +1,77 @@
+"""
+SQLite database backend with a production connection profile (see settings.DATABASES).
+
+Every new connection is configured by the connection_created handler below from the
+SQLITE_PRAGMAS setting: WAL journaling lets readers proceed while a write is in progress,
+and busy_timeout makes a connection wait for a lock instead of failing at once.
+
+Writers are serialized by starting every transaction with BEGIN IMMEDIATE (when
+SQLITE_BEGIN_IMMEDIATE is on). A plain BEGIN only takes the write lock at the transaction's
+first write, and SQLite cannot wait for a lock it needs to upgrade to -- such transactions
+fail with "database is locked" whatever the busy timeout. Taking the lock up-front means
+concurrent writers queue on the busy timeout instead.
+
+A connection's health check also fails once its database file has been replaced, as
+snapshot_replicas does to read replicas, so persistent connections move to the new file.
+"""
+
+import os
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+from django.dispatch import receiver
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 10000,
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def database_file(self):
+        """Path of the database file, also for 'file:' URI names; None for in-memory databases"""
+        if self.is_in_memory_db():
+            return None
+        name = str(self.settings_dict['NAME'])
+        return urlsplit(name).path if name.startswith('file:') else name
+
+    def _file_identity(self):
+        try:
+            stat = os.stat(self.database_file())
+        except (OSError, TypeError):
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def get_new_connection(self, conn_params):
+        self._connected_file = self._file_identity()
+        return super().get_new_connection(conn_params)
+
+    def _start_transaction_under_autocommit(self):
+        if getattr(settings, 'SQLITE_BEGIN_IMMEDIATE', True):
+            self.cursor().execute("BEGIN IMMEDIATE")
+        else:
+            super()._start_transaction_under_autocommit()
+
+    def is_usable(self):
+        # Used by CONN_HEALTH_CHECKS before a persistent connection is reused
+        if self._file_identity() != self._connected_file:
+            return False
+        try:
+            self.connection.execute("SELECT 1")
+        except base.Database.Error:
+            return False
+        return True
+
+
+@receiver(connection_created, sender=DatabaseWrapper)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    for name, value in pragmas.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,40 @@
+"""Template tag rendering film posters from their local variants (see top_films/posters.py)"""
+
+from django import template
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+
+from ..posters import POSTER_WIDTHS, POSTER_FORMATS, POSTER_ASPECT, variant_name
+
+register = template.Library()
+
+
+@register.simple_tag
+def poster(film, width=None, height=None, loading='lazy'):
+    """
+    A <picture> of film's poster shown at width x height CSS pixels (either may be left to
+    the poster's aspect ratio), whose srcsets let the browser pick the variant matching the
+    screen's pixel density, WebP first. Posters are lazy-loaded unless loading='eager'.
+    Films whose variants haven't been made yet get an <img> of their poster_url.
+    """
+    size_attrs = format_html_join('', ' {}="{}"', [(name, value) for name, value in (('width', width), ('height', height))
+                                                   if value])
+    if not film.poster_digest:
+        return format_html('<img src="{}"{}>', film.poster_url or '', size_attrs)
+
+    shown_width = width or round(height * POSTER_ASPECT)
+    # One reverse() per poster, rather than one per variant
+    url_template = reverse('poster', args=['__name__'])
+
+    def srcset(image_format):
+        return ', '.join(f"{url_template.replace('__name__', variant_name(film.poster_digest, w, image_format))} {w}w"
+                         for w in POSTER_WIDTHS)
+
+    *source_formats, img_format = POSTER_FORMATS
+    fallback_width = next((w for w in POSTER_WIDTHS if w >= shown_width), POSTER_WIDTHS[-1])
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}px"{} loading="{}"></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}px">', [
+            (POSTER_FORMATS[image_format][1], srcset(image_format), shown_width) for image_format in source_formats]),
+        url_template.replace('__name__', variant_name(film.poster_digest, fallback_width, img_format)),
+        srcset(img_format), shown_width, size_attrs, loading)
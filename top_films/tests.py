@@ -0,0 +1,436 @@
+"""
+Tests of the catalog's query budgets, the user cache, and the IMDb dataset and poster pipelines.
+
+    python manage.py test top_films
+"""
+
+import gzip
+import io
+import random
+import shutil
+import tempfile
+from itertools import product
+from pathlib import Path
+
+from PIL import Image
+
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from top_films import identity, imdb_datasets, page_cache, posters, recommendations
+from top_films.benchmarking import seed_synthetic_dataset, write_imdb_datasets
+from top_films.identity import user_cache
+from top_films.management.commands import check_admin_queries, import_imdb_datasets
+from top_films.models import Comment, Film, FilmCooccurrence, FilmNeighbour, Genre, Language, Person, Profile
+
+# <ttcode>.<ext> images for build_posters --from-dir
+FIXTURE_POSTERS = Path(__file__).resolve().parent / 'fixtures' / 'posters'
+# Queries per film page, including the session and user look-ups of a logged-in request
+FILM_DETAIL_QUERY_BUDGETS = {'anonymous': 8, 'logged_in': 9}
+
+
+def _film(ranking, language, title=None, **fields):
+    return Film.objects.create(ranking=ranking, ttcode=imdb_datasets.title_code(ranking),
+                               title=title or f"Film {ranking}", year=2000, imdb_rating=8.0, meta_score=80,
+                               language=language, **fields)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class FilmDetailQueriesTests(TestCase):
+    """film_detail_view runs as many queries whatever the number of comments and the size of the user's lists"""
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name="English")
+        cls.films = [_film(ranking, language) for ranking in range(1, 41)]
+        cls.film = cls.films[0]
+        cls.film.genres.add(Genre.objects.create(name="Drama"), Genre.objects.create(name="Crime"))
+        cls.film.directors.add(Person.objects.create(name="A Director"))
+        cls.film.actors.add(*(Person.objects.create(name=f"Actor {n}") for n in range(5)))
+        cls.viewer = User.objects.create_user('viewer', password='viewer-password')
+        cls.commenter = User.objects.create_user('commenter')
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+
+    def set_scale(self, num_comments, list_size):
+        Comment.objects.filter(film=self.film).delete()
+        Comment.objects.bulk_create(Comment(film=self.film, author=self.commenter, comment=f"Comment {n}")
+                                    for n in range(num_comments))
+        self.viewer.profile.fav_films.set(self.films[:list_size])
+        self.viewer.profile.films_to_watch.set(self.films[-list_size:])
+
+    def assert_budget(self, budget):
+        url = reverse('film-detail', args=[self.film.ranking])
+        for num_comments, list_size in product((1, 60), (1, 30)):
+            with self.subTest(comments=num_comments, list_size=list_size):
+                self.set_scale(num_comments, list_size)
+                cache.clear()
+                user_cache.clear()
+                with self.assertNumQueries(budget):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, "Comment 0")
+
+    def test_anonymous(self):
+        self.assert_budget(FILM_DETAIL_QUERY_BUDGETS['anonymous'])
+
+    def test_logged_in(self):
+        self.client.force_login(self.viewer)
+        self.assert_budget(FILM_DETAIL_QUERY_BUDGETS['logged_in'])
+
+    def test_logged_in_flags(self):
+        self.client.force_login(self.viewer)
+        self.set_scale(1, 1)
+        response = self.client.get(reverse('film-detail', args=[self.film.ranking]))
+        self.assertTrue(response.context['is_fav'])
+        self.assertFalse(response.context['is_on_watchlist'])
+
+
+class PageCacheTests(TestCase):
+    """The catalog version is bumped once a catalog write commits, so no page is cached under it from older rows"""
+
+    def test_bumped_on_commit(self):
+        version = page_cache.get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            film = _film(1, Language.objects.create(name="English"))
+            film.genres.add(Genre.objects.create(name="Drama"))
+            self.assertEqual(page_cache.get_catalog_version(), version)
+        self.assertNotEqual(page_cache.get_catalog_version(), version)
+
+    def test_not_bumped_on_rollback(self):
+        version = page_cache.get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                _film(1, Language.objects.create(name="English"))
+                raise RuntimeError
+        self.assertEqual(page_cache.get_catalog_version(), version)
+
+
+class RecommendationsTests(TestCase):
+    """The recommendations kept up to date on every change are the ones rebuild() makes"""
+
+    def snapshot(self):
+        cells = sorted(FilmCooccurrence.objects.values_list('film_id', 'other_id', 'weight'))
+        neighbours = [(film_id, rank, neighbour_id, round(score, 9)) for film_id, rank, neighbour_id, score in
+                      FilmNeighbour.objects.filter(kind=FilmNeighbour.FANS_ALSO_LIKED).order_by(
+                          'film_id', 'rank').values_list('film_id', 'rank', 'neighbour_id', 'score')]
+        return cells, neighbours
+
+    def test_incremental_updates_match_rebuild(self):
+        # Seeded without signals, so that no re-ranking is pending outside the blocks below
+        seed_synthetic_dataset(80, 100, 40, 0, favs_per_user=8, log=lambda message: None)
+        rng = random.Random(86)
+        films = list(Film.objects.order_by('pk'))
+        profiles = list(Profile.objects.select_related('user').order_by('pk'))
+        for _ in range(150):
+            profile = rng.choice(profiles[1:])
+            films_list = rng.choice([profile.fav_films, profile.films_to_watch])
+            operation = rng.random()
+            with self.captureOnCommitCallbacks(execute=True):
+                if operation < 0.6:
+                    film = rng.choice(films)
+                    if films_list.filter(pk=film.pk).exists():
+                        films_list.remove(film)
+                    else:
+                        films_list.add(film)
+                elif operation < 0.75:
+                    films_list.add(*rng.sample(films, 5))
+                elif operation < 0.85:
+                    films_list.remove(*rng.sample(films, 5))
+                elif operation < 0.95:
+                    rng.choice(films).favorited_by.add(*rng.sample(profiles[1:], 3))
+                else:
+                    films_list.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            profiles[0].user.delete()
+
+        cells, neighbours = self.snapshot()
+        recommendations.rebuild()
+        rebuilt_cells, rebuilt_neighbours = self.snapshot()
+        self.assertEqual(cells, rebuilt_cells)
+        self.assertEqual(neighbours, rebuilt_neighbours)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AdminQueriesTests(TestCase):
+    """The admin's changelists and change forms keep to check_admin_queries.ADMIN_QUERY_BUDGETS"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_synthetic_dataset(60, 200, 20, 300, favs_per_user=5, log=lambda message: None)
+        cls.superuser = User.objects.create_superuser('admin-test', password=None)
+
+    def test_budgets(self):
+        for page, status, num_queries, budget in check_admin_queries.Command().run_audit(self.superuser):
+            with self.subTest(page=page):
+                self.assertEqual(status, 200)
+                self.assertLessEqual(num_queries, budget)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class IdentityTests(TestCase):
+    """request.user and its Profile come from user_cache, which drops users once their changes commit"""
+
+    def setUp(self):
+        user_cache.clear()
+
+    def test_registered_user_is_served_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('register'), {
+                'username': 'newcomer', 'first_name': 'New', 'last_name': 'Comer', 'email': 'new@example.com',
+                'password': 'newcomer-password', 'password_confirm': 'newcomer-password', 'bio': ''})
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.client.get(reverse('register'))
+        # The session look-up alone: no query for the user or their profile
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('register'))
+            self.assertEqual(response.wsgi_request.user.username, 'newcomer')
+            self.assertIsNotNone(response.wsgi_request.user.profile.pk)
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+
+    def test_model_backend_sessions_move_to_the_cache(self):
+        user = User.objects.create_user('old-session', password='old-session-password')
+        self.client.force_login(user, backend=identity.MODEL_BACKEND)
+        response = self.client.get(reverse('register'))
+        self.assertEqual(response.wsgi_request.user, user)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], identity.CACHED_MODEL_BACKEND)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('register'))
+
+    def test_invalidated_on_commit(self):
+        # Inside a block of their own, so that the save below starts a batch of invalidations
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user('editor', password='editor-password')
+            self.client.force_login(user)
+        self.client.get(reverse('register'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            Profile.objects.filter(user=user).get().save()
+        self.assertIsNotNone(user_cache.get(user.pk))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(user_cache.get(user.pk))
+
+
+def _write_tsv(path, header, rows):
+    with gzip.open(path, 'wt', encoding='utf-8') as tsv_file:
+        tsv_file.write('\t'.join(header) + '\n')
+        for row in rows:
+            tsv_file.write('\t'.join(row) + '\n')
+
+
+class ImdbDatasetsTests(TestCase):
+    """The IMDb dataset parsers keep the rows the import needs, and the import stores them"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def parse(self, dataset, parser, context=None):
+        results = [parsed for _, parsed in imdb_datasets.parse_blocks(self.directory / f'{dataset}.tsv.gz', parser,
+                                                                        context)]
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_id_map(self):
+        id_map = imdb_datasets.IdMap([30, 10, 20], ['c', 'a', 'b'])
+        values, found = id_map.get([20, 25, 10, 99])
+        self.assertEqual(found.tolist(), [True, False, True, False])
+        self.assertEqual(values[found].tolist(), ['b', 'a'])
+        self.assertFalse(imdb_datasets.IdMap([]).contains([1]).any())
+
+    def test_read_blocks(self):
+        lines = [f'tt{n:07d}\t7.5\t{n}' for n in range(1, 2001)]
+        _write_tsv(self.directory / 'title.ratings.tsv.gz', ['tconst', 'averageRating', 'numVotes'],
+                   [[line] for line in lines])
+        blocks = list(imdb_datasets.read_blocks(self.directory / 'title.ratings.tsv.gz', block_size=1000))
+        self.assertGreater(len(blocks), 1)
+        self.assertTrue(all(block.endswith(b'\n') for block in blocks))
+        self.assertEqual(b''.join(blocks).decode().splitlines(), lines)
+
+    def test_parse_ratings_and_basics(self):
+        _write_tsv(self.directory / 'title.ratings.tsv.gz', ['tconst', 'averageRating', 'numVotes'], [
+            ['tt0000001', '8.3', '5000'], ['tt0000002', '6.1', '50'], ['tt0000003', '9.0', '9000'],
+            ['tt0000004', '7.0', '9000'], ['tt0000005', '7.2', '9000'],
+        ])
+        title_ids, ratings, votes = self.parse('title.ratings', imdb_datasets.parse_ratings)
+        self.assertEqual(title_ids.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(ratings.tolist(), [83, 61, 90, 70, 72])
+        self.assertEqual(votes.tolist(), [5000, 50, 9000, 9000, 9000])
+
+        _write_tsv(self.directory / 'title.basics.tsv.gz', [
+            'tconst', 'titleType', 'primaryTitle', 'originalTitle', 'isAdult', 'startYear', 'endYear',
+            'runtimeMinutes', 'genres'], [
+            ['tt0000001', 'movie', 'Kept', 'Kept', '0', '1994', '\\N', '142', 'Crime,Drama'],
+            ['tt0000002', 'movie', 'Too few votes', 'x', '0', '1994', '\\N', '90', 'Drama'],
+            ['tt0000003', 'tvSeries', 'Wrong type', 'x', '0', '1994', '\\N', '50', 'Drama'],
+            ['tt0000004', 'movie', 'Adult', 'x', '1', '1994', '\\N', '90', 'Drama'],
+            ['tt0000005', 'movie', 'No year', 'x', '0', '\\N', '\\N', '90', '\\N'],
+            ['tt0000006', 'movie', 'Unrated', 'x', '0', '1994', '\\N', '90', 'Drama'],
+            ['tt0000007', 'movie', 'No genres', 'x', '0', '2001', '\\N', '90', '\\N'],
+        ])
+        context = {'title_types': {'movie'}, 'min_votes': 100,
+                   'ratings': imdb_datasets.IdMap([1, 2, 3, 4, 5, 7], [83, 61, 90, 70, 72, 75],
+                                                  [5000, 50, 9000, 9000, 9000, 300])}
+        self.assertEqual(self.parse('title.basics', imdb_datasets.parse_basics, context), [
+            (1, 'Kept', 1994, ['Crime', 'Drama'], 83, 5000), (7, 'No genres', 2001, [], 75, 300)])
+
+    def test_parse_principals_and_names(self):
+        _write_tsv(self.directory / 'title.principals.tsv.gz', [
+            'tconst', 'ordering', 'nconst', 'category', 'job', 'characters'], [
+            ['tt0000001', '1', 'nm0000010', 'actor', '\\N', '["A"]'],
+            ['tt0000001', '2', 'nm0000011', 'actress', '\\N', '["B"]'],
+            ['tt0000001', '3', 'nm0000012', 'actor', '\\N', '["C"]'],
+            ['tt0000001', '4', 'nm0000013', 'director', '\\N', '\\N'],
+            ['tt0000001', '5', 'nm0000014', 'composer', '\\N', '\\N'],
+            ['tt0000002', '1', 'nm0000015', 'director', '\\N', '\\N'],
+        ])
+        context = {'titles': imdb_datasets.IdMap([1]), 'max_cast': 2}
+        title_ids, name_ids, kinds = self.parse('title.principals', imdb_datasets.parse_principals, context)
+        self.assertEqual(title_ids.tolist(), [1, 1, 1])
+        self.assertEqual(name_ids.tolist(), [10, 11, 13])
+        self.assertEqual(kinds.tolist(), [imdb_datasets.ACTOR, imdb_datasets.ACTOR, imdb_datasets.DIRECTOR])
+
+        _write_tsv(self.directory / 'name.basics.tsv.gz', ['nconst', 'primaryName', 'birthYear'], [
+            ['nm0000010', 'Alice', '1970'], ['nm0000011', '\\N', '1970'], ['nm0000012', 'Carol', '1970'],
+        ])
+        context = {'names': imdb_datasets.IdMap([10, 11])}
+        self.assertEqual(self.parse('name.basics', imdb_datasets.parse_names, context), [(10, 'Alice')])
+
+    def test_import(self):
+        write_imdb_datasets(self.directory, 400, 300)
+        importer = import_imdb_datasets.Command()
+        call_command(importer, str(self.directory), min_votes=10, workers=1, stdout=io.StringIO())
+        self.assertGreater(importer.num_films, 0)
+        self.assertEqual(Film.objects.count(), importer.num_films)
+        self.assertEqual(Film.objects.filter(year__lte=imdb_datasets.MIN_YEAR).count(), 0)
+        self.assertEqual(importer.num_credits, {imdb_datasets.DIRECTOR: Film.directors.through.objects.count(),
+                                                imdb_datasets.ACTOR: Film.actors.through.objects.count()})
+        # The counters are rebuilt after the import
+        person = Person.objects.filter(num_acted__gt=0).first()
+        self.assertEqual(person.num_acted, person.films_acted_in.count())
+
+        # A second import finds every title already there
+        importer = import_imdb_datasets.Command()
+        call_command(importer, str(self.directory), min_votes=10, workers=1, stdout=io.StringIO())
+        self.assertEqual(importer.num_films, 0)
+
+    def test_import_clashing_titles_and_names(self):
+        # Titles and names are unique in the catalog but not on IMDb
+        _film(1, Language.objects.create(name="English"), title="Heat")
+        pacino = Person.objects.create(name="Al Pacino")
+        _write_tsv(self.directory / 'title.ratings.tsv.gz', ['tconst', 'averageRating', 'numVotes'], [
+            ['tt0000011', '8.3', '5000'], ['tt0000012', '7.0', '300'], ['tt0000013', '6.9', '200'],
+            ['tt0000014', '7.5', '1000'],
+        ])
+        _write_tsv(self.directory / 'title.basics.tsv.gz', [
+            'tconst', 'titleType', 'primaryTitle', 'originalTitle', 'isAdult', 'startYear', 'endYear',
+            'runtimeMinutes', 'genres'], [
+            ['tt0000011', 'movie', 'Heat', 'Heat', '0', '1995', '\\N', '170', 'Crime,Drama'],
+            ['tt0000012', 'movie', 'Heat', 'Heat', '0', '1986', '\\N', '101', 'Action'],
+            ['tt0000013', 'movie', 'Heat', 'Heat', '0', '1995', '\\N', '96', 'Thriller'],
+            ['tt0000014', 'movie', 'Alone', 'Alone', '0', '2000', '\\N', '90', 'Drama'],
+        ])
+        _write_tsv(self.directory / 'title.principals.tsv.gz', [
+            'tconst', 'ordering', 'nconst', 'category', 'job', 'characters'], [
+            ['tt0000011', '1', 'nm0000001', 'director', '\\N', '\\N'],
+            ['tt0000011', '2', 'nm0000002', 'actor', '\\N', '["McCauley"]'],
+            ['tt0000012', '1', 'nm0000003', 'actor', '\\N', '["Mex"]'],
+            ['tt0000013', '1', 'nm0000004', 'actor', '\\N', '["Joe"]'],
+            ['tt0000014', '1', 'nm0000005', 'actress', '\\N', '["Jane"]'],
+        ])
+        _write_tsv(self.directory / 'name.basics.tsv.gz', ['nconst', 'primaryName', 'birthYear'], [
+            ['nm0000001', 'Michael Mann', '1943'], ['nm0000002', 'Al Pacino', '1940'],
+            ['nm0000003', 'Burt Reynolds', '1936'], ['nm0000004', 'Burt Reynolds', '1970'],
+            ['nm0000005', 'Jane Doe', '1980'],
+        ])
+        call_command(import_imdb_datasets.Command(), str(self.directory), min_votes=10, workers=1, stdout=io.StringIO())
+
+        titles = dict(Film.objects.filter(ttcode__in=[imdb_datasets.title_code(n) for n in range(11, 15)]).values_list(
+            'ttcode', 'title'))
+        self.assertEqual(titles, {'tt0000011': 'Heat (1995)', 'tt0000012': 'Heat (1986)',
+                                  'tt0000013': 'Heat (1995, tt0000013)', 'tt0000014': 'Alone'})
+        self.assertEqual(Film.objects.get(title="Heat").ttcode, imdb_datasets.title_code(1))
+        # A name already in the catalog is taken to be the same person; a name clashing within the import isn't
+        self.assertEqual(list(Film.objects.get(ttcode='tt0000011').actors.all()), [pacino])
+        self.assertEqual(Person.objects.filter(name="Al Pacino").count(), 1)
+        self.assertEqual(Film.objects.get(ttcode='tt0000012').actors.get().name, "Burt Reynolds")
+        self.assertEqual(Film.objects.get(ttcode='tt0000013').actors.get().name, "Burt Reynolds (nm0000004)")
+        self.assertEqual(Film.objects.get(ttcode='tt0000011').directors.get().name, "Michael Mann")
+
+
+class PosterTests(TestCase):
+    """Poster variants are resized, named after their content, and served cacheable for good"""
+
+    def setUp(self):
+        self.poster_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.poster_root)
+        self.original = self.poster_root / 'original.png'
+        Image.new('RGB', (600, 900), (200, 30, 30)).save(self.original)
+
+    def test_make_variants(self):
+        digest = posters.make_variants(self.original, self.poster_root)
+        self.assertEqual(len(digest), posters.DIGEST_LENGTH)
+        for width in posters.POSTER_WIDTHS:
+            for image_format in posters.POSTER_FORMATS:
+                with Image.open(self.poster_root / posters.variant_name(digest, width, image_format)) as variant:
+                    self.assertEqual(variant.format, image_format)
+                    self.assertEqual(variant.size, (width, width * 3 // 2))
+        # The same bytes give the same names, and other bytes others
+        self.assertEqual(posters.make_variants(self.original, self.poster_root), digest)
+        Image.new('RGB', (600, 900), (30, 30, 200)).save(self.original)
+        self.assertNotEqual(posters.make_variants(self.original, self.poster_root), digest)
+
+    def test_make_variants_of_non_image(self):
+        self.original.write_bytes(b'not an image')
+        with self.assertRaises(OSError):
+            posters.make_variants(self.original, self.poster_root)
+
+    def test_poster_tag(self):
+        language = Language.objects.create(name="English")
+        film = _film(1, language, poster_url='https://example.com/poster.jpg')
+        template = Template("{% load posters %}{% poster film 172 %}")
+        self.assertHTMLEqual(template.render(Context({'film': film})),
+                             '<img src="https://example.com/poster.jpg" width="172">')
+
+        film.poster_digest = posters.make_variants(self.original, self.poster_root)
+        html = template.render(Context({'film': film}))
+        self.assertIn('<source type="image/webp"', html)
+        for name in posters.variant_names(film.poster_digest):
+            self.assertIn(reverse('poster', args=[name]), html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_poster_view(self):
+        digest = posters.make_variants(self.original, self.poster_root)
+        name = posters.variant_name(digest, posters.POSTER_WIDTHS[0], 'WEBP')
+        with override_settings(POSTER_ROOT=self.poster_root, ALLOWED_HOSTS=['testserver']):
+            response = self.client.get(reverse('poster', args=[name]))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertEqual(self.client.get(reverse('poster', args=['missing-86.webp'])).status_code, 404)
+
+    def test_build_posters_from_dir(self):
+        language = Language.objects.create(name="English")
+        for ranking in (1, 2, 3):
+            _film(ranking, language)
+        stderr = io.StringIO()
+        with override_settings(POSTER_ROOT=self.poster_root):
+            call_command('build_posters', from_dir=str(FIXTURE_POSTERS), workers=1, stdout=io.StringIO(), stderr=stderr)
+        digests = dict(Film.objects.values_list('ttcode', 'poster_digest'))
+        # tt0000003 has no fixture image, so it is reported and left without variants
+        self.assertEqual(digests.pop(imdb_datasets.title_code(3)), '')
+        self.assertIn(imdb_datasets.title_code(3), stderr.getvalue())
+        for ttcode, digest in digests.items():
+            with self.subTest(ttcode=ttcode):
+                fixture = next(FIXTURE_POSTERS.glob(f'{ttcode}.*'))
+                self.assertEqual(digest, posters.make_variants(fixture, self.poster_root))
+                for name in posters.variant_names(digest):
+                    self.assertTrue((self.poster_root / name).exists())
@@ -2,21 +2,40 @@
 
 from django.urls import path
 from . import views
+from .models import Film, Person, Genre, Language
+from .page_cache import cache_catalog_page
+from .change_tracking import conditional_page, list_validator, detail_validator
 
 urlpatterns = [
-    path('', views.FilmListView.as_view(), name="films"),
+    path('', conditional_page(list_validator(Film.objects.all()))(
+        cache_catalog_page(views.FilmListView.as_view())), name="films"),
     path('film-<int:ranking>', views.film_detail_view, name="film-detail"),
+    path('film-<int:ranking>/neighbours', views.film_neighbours_view, name="film-neighbours"),
     path('watchlist-film', views.watchlist_film, name="watchlist-film"),
     path('fave-film', views.fave_film, name="fave-film"),
+    path('toggle-films', views.toggle_films, name="toggle-films"),
     path('add-comment/film-<int:ranking>', views.add_comment_view, name="add-comment"),
     path('delete-comment', views.delete_comment_view, name="delete-comment"),
-    path('genres', views.GenreListView.as_view(), name="genres"),
-    path('genres/<slug:slug>', views.GenreDetailView.as_view(), name="genre-detail"),
-    path('directors', views.DirectorListView.as_view(), name="directors"),
-    path('directors/<slug:slug>', views.DirectorDetailView.as_view(), name="director-detail"),
-    path('actors', views.ActorListView.as_view(), name="actors"),
-    path('actors/<slug:slug>', views.ActorDetailView.as_view(), name="actor-detail"),
+    path('comments/film-<int:ranking>', views.film_comments_view, name="film-comments"),
+    path('comments/film-<int:ranking>/stream', views.film_comments_stream_view, name="film-comments-stream"),
+    path('genres', conditional_page(list_validator(Genre.objects.all()))(views.GenreListView.as_view()), name="genres"),
+    path('genres/<slug:slug>', conditional_page(detail_validator(Genre.objects.all()))(
+        cache_catalog_page(views.GenreDetailView.as_view())), name="genre-detail"),
+    path('directors', conditional_page(list_validator(Person.objects.filter(num_directed__gt=0)))(
+        views.DirectorListView.as_view()), name="directors"),
+    path('directors/<slug:slug>', conditional_page(detail_validator(Person.objects.all()))(
+        cache_catalog_page(views.DirectorDetailView.as_view())), name="director-detail"),
+    path('actors', conditional_page(list_validator(Person.objects.filter(num_acted__gt=0)))(
+        views.ActorListView.as_view()), name="actors"),
+    path('actors/<slug:slug>', conditional_page(detail_validator(Person.objects.all()))(
+        cache_catalog_page(views.ActorDetailView.as_view())), name="actor-detail"),
     path('actor-search', views.actor_search, name="actor-search"),
-    path('languages', views.LanguageListView.as_view(), name="languages"),
-    path('languages/<slug:slug>', views.LanguageDetailView.as_view(), name="language-detail"),
+    path('search', views.search_view, name="search"),
+    path('page-cache-stats', views.page_cache_stats_view, name="page-cache-stats"),
+    path('export/<slug:dataset>', views.export_view, name="export"),
+    path('posters/<str:filename>', views.poster_view, name="poster"),
+    path('languages', conditional_page(list_validator(Language.objects.all()))(
+        views.LanguageListView.as_view()), name="languages"),
+    path('languages/<slug:slug>', conditional_page(detail_validator(Language.objects.all()))(
+        cache_catalog_page(views.LanguageDetailView.as_view())), name="language-detail"),
 ]
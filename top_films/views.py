@@ -1,26 +1,65 @@
 """View functions for the various website URLs"""
 
+import json
+import base64
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.template.response import TemplateResponse
+from django.template.loader import render_to_string
+from django.core.paginator import Paginator, InvalidPage
 from django.contrib import messages
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.views import generic
+from django.views.decorators.http import require_safe
+from django.views.static import serve
+from django.views.generic.list import MultipleObjectMixin
 
 from .forms import RegistrationForm, UserUpdateForm, ProfileUpdateForm, AddCommentForm
-from .models import User, Film, Person, Genre, Language, Comment
-
-
-def index_view(request):
+from .models import User, Film, FilmNeighbour, Person, Genre, Language, Comment, Profile
+from . import search, live, recommendations, similar_films, exports
+from .identity import user_cache, CACHED_MODEL_BACKEND
+from .page_cache import cache_catalog_page, get_stats as get_page_cache_stats
+from .change_tracking import conditional_page, list_validator, detail_validator
+from .metrics import registry as metrics_registry
+from .routers import replica_reads
+
+
+# The read-only catalog views below are async. Their data is fully loaded through the async
+# ORM, and they return TemplateResponses, which Django renders off the event loop -- the
+# template engine being synchronous -- without running any further queries. Their reads
+# may be served by a read replica (see routers.py).
+
+async def _get_user(request):
+    """Returns request.user, resolving it (which may query the session and user tables) in a worker thread"""
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+@conditional_page(list_validator(Film.objects.filter(ranking__lte=10)))
+@cache_catalog_page
+@replica_reads
+async def index_view(request):
     """Renders the site's main landing page"""
-    top_ten_films = Film.objects.filter(ranking__lte=10)
-    return render(request, 'index.html', {'top_ten_films': top_ten_films})
+    top_ten_films = [film async for film in Film.objects.filter(ranking__lte=10)]
+    return TemplateResponse(request, 'index.html', {'top_ten_films': top_ten_films})
 
 
 def profile_view(request):
-    """Renders the logged-in user's profile page"""
-    return render(request, 'top_films/profile.html')
+    """Renders the logged-in user's profile page, with films recommended from their favs and watchlist"""
+    recommended_films = recommendations.recommended_for(request.user) if request.user.is_authenticated else []
+    return render(request, 'top_films/profile.html', {'recommended_films': recommended_films})
 
 
 def registration_view(request):
@@ -35,7 +74,7 @@ def registration_view(request):
                 usr = User.objects.create_user(username=data['username'],first_name=data['first_name'],
                                                last_name=data['last_name'],email=data['email'],password=data['password'])
                 usr.profile.bio = data['bio']
-                login(request, usr)
+                login(request, usr, backend=CACHED_MODEL_BACKEND)
                 return redirect('profile')
             else:
                 form.add_error('username', 'This username is not available.')
@@ -65,59 +104,185 @@ def update_profile_view(request):
     })
 
 
-def user_info_view(request, pk):
+@replica_reads
+async def user_info_view(request, pk):
     """Renders the public profile-page for each registered user"""
-    user = get_object_or_404(User, id=pk)
-    return render(request, 'top_films/user_info_view.html', {'profiled_user': user})
+    users = User.objects.select_related('profile').prefetch_related('profile__fav_films', 'profile__films_to_watch')
+    try:
+        user = await users.aget(id=pk)
+    except User.DoesNotExist:
+        raise Http404("No such user")
+    return TemplateResponse(request, 'top_films/user_info_view.html', {'profiled_user': user})
+
+
+class AsyncListView(generic.ListView):
+    """ListView whose page of objects (and total count, if paginated) is loaded through the async ORM"""
+    reads_from_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        context = {'paginator': None, 'page_obj': None, 'is_paginated': False}
+        page_size = self.get_paginate_by(self.object_list)
+        if page_size:
+            paginator = self.get_paginator(self.object_list, page_size, orphans=self.get_paginate_orphans())
+            paginator.count = await self.object_list.acount()  # pre-fills the cached property
+            page_number = request.GET.get(self.page_kwarg) or 1
+            try:
+                page = paginator.page(paginator.num_pages if page_number == 'last' else page_number)
+            except InvalidPage as e:
+                raise Http404(str(e))
+            page.object_list = objects = [obj async for obj in page.object_list]
+            context.update(paginator=paginator, page_obj=page, is_paginated=page.has_other_pages())
+        else:
+            objects = [obj async for obj in self.object_list]
+        context['object_list'] = objects
+        context_object_name = self.get_context_object_name(self.object_list)
+        if context_object_name is not None:
+            context[context_object_name] = objects
+        return self.render_to_response(super(MultipleObjectMixin, self).get_context_data(**context))
 
 
-class FilmListView(generic.ListView):
+class AsyncDetailView(generic.DetailView):
+    """DetailView fetching its object through the async ORM; prefetch what the template shows in queryset"""
+    reads_from_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        try:
+            self.object = await queryset.aget(**{self.get_slug_field(): self.kwargs[self.slug_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404(f"No {queryset.model._meta.verbose_name} found matching the query")
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+
+class FilmListView(AsyncListView):
     """Simple view listing all 100 films in ranking-order"""
     model = Film
     ordering = ['ranking']
 
 
-def film_detail_view(request, ranking):
+@conditional_page(detail_validator(Film.objects.all(), 'ranking', ('updated_at', 'last_activity_at')))
+@replica_reads
+async def film_detail_view(request, ranking):
     """
     The main view that displays all of a film's details and allows logged-in users
     to fave/unfave a film or add/remove it from their watchlist. It also provides
     a link to let users add a new comment about the film. Moderators get to delete
     comments also.
+
+    Everything the template shows is loaded up-front in a fixed number of queries:
+    the film and its language, one prefetch per M2M relation, the first page of
+    comments joined with their authors, EXISTS sub-queries for the user's
+    fav/watchlist flags, and the film's stored "fans also liked" and similar-films
+    neighbours. Later comment pages are fetched from film_comments_view. Anonymous
+    revalidations are answered from the film's change timestamps alone.
     """
-    film = get_object_or_404(Film, ranking=ranking)
-    return render(request, 'top_films/film_detail.html', {'film': film})
+    user = await _get_user(request)
+    films = Film.objects.select_related('language').prefetch_related('directors', 'actors', 'genres')
+    if user.is_authenticated:
+        films = films.annotate(
+            is_fav=Exists(Profile.fav_films.through.objects.filter(
+                film_id=OuterRef('pk'), profile__user_id=user.id)),
+            is_on_watchlist=Exists(Profile.films_to_watch.through.objects.filter(
+                film_id=OuterRef('pk'), profile__user_id=user.id)),
+        )
+    try:
+        film = await films.aget(ranking=ranking)
+    except Film.DoesNotExist:
+        raise Http404("No such film")
+    comments, next_cursor = await aget_comments_page(film.id)
+    fans_also_liked = [neighbour.neighbour async for neighbour in recommendations.fans_also_liked(film.id)]
+    similar = [neighbour.neighbour async for neighbour in similar_films.similar_films(film.id)]
+    return TemplateResponse(request, 'top_films/film_detail.html', {
+        'film': film,
+        'fans_also_liked': fans_also_liked,
+        'similar_films': similar,
+        'comments': comments,
+        'next_comments_cursor': next_cursor,
+        'is_fav': getattr(film, 'is_fav', False),
+        'is_on_watchlist': getattr(film, 'is_on_watchlist', False),
+        'live_comments': isinstance(request, ASGIRequest),
+    })
 
 
 def is_ajax(request):
     return request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest'
 
 
+FILM_LISTS = {'fav': 'fav_films', 'watchlist': 'films_to_watch'}
+
+
+def _toggle_film(profile, list_field, film_id):
+    """
+    Toggles film_id's membership of one of the profile's film lists, returning the new state.
+    Only the (profile, film) row of the list's through table is touched -- an indexed
+    existence check followed by a single add or remove -- so the cost doesn't grow with
+    the size of the list, and no Film is loaded.
+    """
+    film_list = getattr(profile, list_field)
+    with transaction.atomic():
+        if film_list.through.objects.filter(profile_id=profile.id, film_id=film_id).exists():
+            film_list.remove(film_id)
+            return False
+        film_list.add(film_id)
+        return True
+
+
 def fave_film(request):
     """AJAX endpoint to toggle a film's fave-status for the request's user"""
     if is_ajax(request) and request.method == 'POST':
-        p = request.user.profile
-        f = Film.objects.get(id=int(request.POST['film_id']))
-        if f in p.fav_films.all():
-            p.fav_films.remove(f)
-        else:
-            p.fav_films.add(f)
-        return JsonResponse({"op_succeeded": True}, status=200)
+        is_fav = _toggle_film(request.user.profile, 'fav_films', int(request.POST['film_id']))
+        return JsonResponse({"op_succeeded": True, "is_fav": is_fav}, status=200)
     return JsonResponse({"op_succeeded": False}, status=400)
 
 
 def watchlist_film(request):
     """AJAX endpoint to add/remove a film from a user's watchlist"""
     if is_ajax(request) and request.method == 'POST':
-        p = request.user.profile
-        f = Film.objects.get(id=int(request.POST['film_id']))
-        if f in p.films_to_watch.all():
-            p.films_to_watch.remove(f)
-        else:
-            p.films_to_watch.add(f)
-        return JsonResponse({"op_succeeded": True}, status=200)
+        is_on_watchlist = _toggle_film(request.user.profile, 'films_to_watch', int(request.POST['film_id']))
+        return JsonResponse({"op_succeeded": True, "is_on_watchlist": is_on_watchlist}, status=200)
     return JsonResponse({"op_succeeded": False}, status=400)
 
 
+def toggle_films(request):
+    """
+    AJAX endpoint applying many fave/watchlist toggles in one request and one transaction.
+    The JSON request body has the form {"toggles": [{"film_id": 7, "list": "fav"}, ...]},
+    where list is "fav" or "watchlist"; toggling a film twice restores its original state.
+    The response maps each film_id to its final is_fav and is_on_watchlist flags.
+    """
+    if not (is_ajax(request) and request.method == 'POST' and request.user.is_authenticated):
+        return JsonResponse({"op_succeeded": False}, status=400)
+    try:
+        toggles = [(FILM_LISTS[t['list']], int(t['film_id'])) for t in json.loads(request.body)['toggles']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"op_succeeded": False}, status=400)
+
+    film_ids = {film_id for _, film_id in toggles}
+    if Film.objects.filter(id__in=film_ids).count() != len(film_ids):
+        return JsonResponse({"op_succeeded": False}, status=400)
+
+    profile = request.user.profile
+    with transaction.atomic():
+        final_states = {}
+        for list_field in FILM_LISTS.values():
+            through = getattr(profile, list_field).through
+            on_list = set(through.objects.filter(profile_id=profile.id, film_id__in=film_ids).values_list('film_id', flat=True))
+            before = set(on_list)
+            for field, film_id in toggles:
+                if field == list_field:
+                    on_list ^= {film_id}
+            getattr(profile, list_field).remove(*(before - on_list))
+            getattr(profile, list_field).add(*(on_list - before))
+            final_states[list_field] = on_list
+    return JsonResponse({"op_succeeded": True, "films": {
+        film_id: {
+            "is_fav": film_id in final_states['fav_films'],
+            "is_on_watchlist": film_id in final_states['films_to_watch'],
+        } for film_id in film_ids
+    }}, status=200)
+
+
 def add_comment_view(request, ranking):
     """View that displays and processes the add-comment form"""
     film = get_object_or_404(Film, ranking=ranking)
@@ -131,6 +296,115 @@ def add_comment_view(request, ranking):
     return render(request, 'top_films/add_comment.html', {'film':film, 'form': form})
 
 
+COMMENTS_PAGE_SIZE = 25
+
+
+def _encode_comment_cursor(comment):
+    key = f"{comment.created_at.isoformat()}|{comment.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _decode_comment_cursor(cursor):
+    """Returns the (created_at, id) key encoded in cursor, raising ValueError if it is malformed"""
+    created_at, comment_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(comment_id)
+
+
+def _comments_page_query(film_id, cursor, page_size):
+    comments = Comment.objects.filter(film_id=film_id).select_related('author').order_by('created_at', 'id')
+    if cursor:
+        created_at, comment_id = _decode_comment_cursor(cursor)
+        comments = comments.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=comment_id))
+    return comments[:page_size + 1]
+
+
+def _split_comments_page(page, page_size):
+    next_cursor = _encode_comment_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+
+def get_comments_page(film_id, cursor=None, page_size=COMMENTS_PAGE_SIZE):
+    """
+    Returns a page of a film's comments (oldest first) along with the cursor of the next
+    page, or None if this is the last page. Pages are keyed on (created_at, id) rather than
+    an OFFSET, so every page is a range scan on the (film, created_at) index, however deep.
+    """
+    return _split_comments_page(list(_comments_page_query(film_id, cursor, page_size)), page_size)
+
+
+async def aget_comments_page(film_id, cursor=None, page_size=COMMENTS_PAGE_SIZE):
+    """Async version of get_comments_page()"""
+    return _split_comments_page([c async for c in _comments_page_query(film_id, cursor, page_size)], page_size)
+
+
+@replica_reads
+def film_comments_view(request, ranking):
+    """
+    JSON endpoint returning the comments page after ?cursor=..., both as data and as a
+    pre-rendered HTML fragment the film-detail page can append to its comment list
+    """
+    film = get_object_or_404(Film.objects.only('id'), ranking=ranking)
+    try:
+        comments, next_cursor = get_comments_page(film.id, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({"op_succeeded": False}, status=400)
+    return JsonResponse({
+        "op_succeeded": True,
+        "comments": [{
+            "id": c.id, "comment": c.comment, "author_id": c.author_id,
+            "author": c.author.username, "created_at": c.created_at.isoformat(),
+        } for c in comments],
+        "html": render_to_string('top_films/comment_rows.html', {'comments': comments}, request=request),
+        "next_cursor": next_cursor,
+    }, status=200)
+
+
+@replica_reads
+def film_neighbours_view(request, ranking):
+    """
+    JSON endpoint listing a film's similar films (by genres, directors and actors) and the
+    films its fans also liked, most similar first; ?limit=n returns up to n of each
+    """
+    film = get_object_or_404(Film.objects.only('id', 'ranking', 'title', 'year'), ranking=ranking)
+    try:
+        limit = min(int(request.GET.get('limit', 10)), similar_films.TOP_K)
+    except ValueError:
+        return JsonResponse({"op_succeeded": False}, status=400)
+    neighbours = {kind: [] for kind, _ in FilmNeighbour.KIND_CHOICES}
+    for neighbour in FilmNeighbour.objects.filter(film_id=film.id, rank__lt=limit).select_related(
+            'neighbour').order_by('kind', 'rank'):
+        other = neighbour.neighbour
+        neighbours[neighbour.kind].append({
+            "ranking": other.ranking, "title": other.title, "year": other.year, "score": round(neighbour.score, 4),
+            "url": reverse('film-detail', args=[other.ranking]),
+        })
+    return JsonResponse({
+        "op_succeeded": True,
+        "film": {"ranking": film.ranking, "title": film.title, "year": film.year},
+        "similar_films": neighbours[FilmNeighbour.SIMILAR_FILMS],
+        "fans_also_liked": neighbours[FilmNeighbour.FANS_ALSO_LIKED],
+    }, status=200)
+
+
+async def film_comments_stream_view(request, ranking):
+    """
+    Server-Sent Events stream of the comments created on, or deleted from, a film from now on.
+    A stream holds its connection open indefinitely, so it is only served under ASGI.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("Live comments are only available when served over ASGI.", status=501)
+    try:
+        film = await Film.objects.only('id').aget(ranking=ranking)
+    except Film.DoesNotExist:
+        raise Http404("No such film")
+    user = await _get_user(request)
+    response = StreamingHttpResponse(live.comment_stream(live.broker.subscribe(film.id), user),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def delete_comment_view(request):
     """AJAX view that processes a delete-comment button click"""
     if is_ajax(request) and request.method == 'POST':
@@ -140,48 +414,141 @@ def delete_comment_view(request):
     return JsonResponse({"op_succeeded": False}, status=400)
 
 
-class GenreListView(generic.ListView):
+class GenreListView(AsyncListView):
     model = Genre
 
-class GenreDetailView(generic.DetailView):
-    model = Genre
+class GenreDetailView(AsyncDetailView):
+    queryset = Genre.objects.prefetch_related('films')
 
 
-class LanguageListView(generic.ListView):
+class LanguageListView(AsyncListView):
     model = Language
 
-class LanguageDetailView(generic.DetailView):
-    model = Language
+class LanguageDetailView(AsyncDetailView):
+    queryset = Language.objects.prefetch_related('film_set')
 
 
-class DirectorListView(generic.ListView):
+class DirectorListView(AsyncListView):
     """Shows a list of directors, i.e. Persons with one or more director credits"""
-    queryset = Person.objects.all().annotate(num_directed=Count('films_directed')).filter(num_directed__gt=0)
+    queryset = Person.objects.filter(num_directed__gt=0)
     template_name = 'top_films/director_list.html'
     context_object_name = 'directors'
 
-class DirectorDetailView(generic.DetailView):
-    model = Person
+class DirectorDetailView(AsyncDetailView):
+    queryset = Person.objects.prefetch_related('films_directed')
     template_name = 'top_films/director_detail.html'
     context_object_name = 'director'
 
 
-class ActorListView(generic.ListView):
+class ActorListView(AsyncListView):
     """Shows a list of actors, i.e. Persons with one or more acting credits"""
-    queryset = Person.objects.all().annotate(num_acted=Count('films_acted_in')).filter(num_acted__gt=0)
+    queryset = Person.objects.filter(num_acted__gt=0)
     template_name = 'top_films/actor_list.html'
     context_object_name = 'actors'
     paginate_by = 15
 
-class ActorDetailView(generic.DetailView):
-    model = Person
+class ActorDetailView(AsyncDetailView):
+    queryset = Person.objects.prefetch_related('films_acted_in')
     template_name = 'top_films/actor_detail.html'
     context_object_name = 'actor'
 
 def actor_search(request):
-    """Processes a search-request from the actors-list page"""
+    """Processes a search-request from the actors-list page, using the full-text search index"""
     if request.method == "POST" and request.POST['actor_name']:
-        actors = Person.objects.all().annotate(num_acted=Count('films_acted_in')).filter(
-            num_acted__gt=0).filter(name__icontains=request.POST['actor_name']).order_by('name')
-        return render(request, 'top_films/actor_list.html', {'object_list': actors})
+        match_query = search.build_match_query(request.POST['actor_name'])
+        actors = Person.objects.filter(
+            num_acted__gt=0, id__in=RawSQL(search.matching_ids_sql('person'), [match_query])).order_by('name')
+        return render(request, 'top_films/actor_list.html', {'object_list': actors if match_query else []})
     return redirect('actors')
+
+
+@staff_member_required
+def page_cache_stats_view(request):
+    """Staff-only JSON view of this process's catalog page-cache hit/miss counters"""
+    return JsonResponse({"op_succeeded": True, "views": get_page_cache_stats()}, status=200)
+
+
+async def _aiterate(iterator):
+    """Async iterator over a sync one, advancing it in the request's worker thread"""
+    done = object()
+    advance = sync_to_async(next)
+    while (item := await advance(iterator, done)) is not done:
+        yield item
+
+
+@staff_member_required
+def export_view(request, dataset):
+    """
+    Staff-only streaming download of one of the exports.EXPORTS datasets. ?format=csv|jsonl
+    picks the encoding, ?gzip=1 compresses it, and ?after=<pk>&until=<pk> restricts it to a
+    pk range, e.g. to resume an interrupted download after the last pk received.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if dataset not in exports.EXPORTS or export_format not in exports.FORMATS:
+        raise Http404("No such export")
+    try:
+        after, until = (int(request.GET[bound]) if request.GET.get(bound) else None for bound in ('after', 'until'))
+    except ValueError:
+        return JsonResponse({"op_succeeded": False}, status=400)
+    compress = request.GET.get('gzip') == '1'
+    stream = exports.export_stream(dataset, export_format, compress, after, until)
+    if isinstance(request, ASGIRequest):
+        # Django would otherwise read a sync iterator to the end before sending any of it
+        stream = _aiterate(stream)
+    filename = f"top_films-{dataset}-{after or 0}-{until or 'end'}.{export_format}{'.gz' if compress else ''}"
+    response = StreamingHttpResponse(stream, content_type='application/gzip' if compress else exports.FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# Poster variants are named after a digest of their contents, so a URL never serves different bytes
+POSTER_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@require_safe
+def poster_view(request, filename):
+    """Serves a poster variant (see posters.py) from settings.POSTER_ROOT, cacheable for a year"""
+    response = serve(request, filename, document_root=settings.POSTER_ROOT)
+    patch_cache_control(response, public=True, max_age=POSTER_MAX_AGE, immutable=True)
+    return response
+
+
+@staff_member_required
+def metrics_view(request):
+    """Staff-only view exposing the per-route request metrics in Prometheus text format"""
+    lines = [
+        "# HELP top_films_page_cache_requests_total Catalog page-cache lookups by outcome",
+        "# TYPE top_films_page_cache_requests_total counter",
+    ]
+    for route, counts in sorted(get_page_cache_stats().items()):
+        for outcome, count in counts.items():
+            lines.append(f'top_films_page_cache_requests_total{{route="{route}",outcome="{outcome}"}} {count}')
+    user_cache_stats = user_cache.get_stats()
+    lines += [
+        "# HELP top_films_user_cache_requests_total Authenticated-user cache lookups by outcome",
+        "# TYPE top_films_user_cache_requests_total counter",
+        f'top_films_user_cache_requests_total{{outcome="hit"}} {user_cache_stats["hits"]}',
+        f'top_films_user_cache_requests_total{{outcome="miss"}} {user_cache_stats["misses"]}',
+        "# HELP top_films_user_cache_entries Users held in this process's user cache",
+        "# TYPE top_films_user_cache_entries gauge",
+        f"top_films_user_cache_entries {user_cache_stats['size']}",
+        "# HELP top_films_live_comment_subscribers Open live-comment streams",
+        "# TYPE top_films_live_comment_subscribers gauge",
+        f"top_films_live_comment_subscribers {live.broker.subscriber_count()}",
+    ]
+    return HttpResponse(metrics_registry.exposition() + "\n".join(lines) + "\n",
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def search_view(request):
+    """Site-wide search of film titles/plots, people and comments, ranked by relevance"""
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('type', '')
+    results = search.SearchResults(query, [kind] if kind in search.SEARCH_INDEXES else None)
+    page_obj = Paginator(results, 20).get_page(request.GET.get('page'))
+    return render(request, 'top_films/search_results.html', {
+        'query': query,
+        'type': kind,
+        'page_obj': page_obj,
+        'results': page_obj.object_list,
+    })
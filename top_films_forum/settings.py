@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,8 +42,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'top_films.metrics.RequestMetricsMiddleware',
+    'top_films.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'top_films.identity.CachedBackendSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -54,7 +58,7 @@ ROOT_URLCONF = 'top_films_forum.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'top_films.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,13 +78,79 @@ WSGI_APPLICATION = 'top_films_forum.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# The SQLite backend is extended with a connection profile (top_films.sqlite_backend).
+# Connections persist between requests, and are checked before being reused.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'top_films.sqlite_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# PRAGMAs run on every new SQLite connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 10000,  # ms a connection waits for a lock before failing
+    'synchronous': 'normal',  # safe in WAL mode; only the last commits can be lost on power failure
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative sizes are in KiB
+    'temp_store': 'memory',
+}
+
+# Start transactions with BEGIN IMMEDIATE, so that concurrent writers queue for the write
+# lock instead of failing with "database is locked"
+SQLITE_BEGIN_IMMEDIATE = True
+
+# Read replicas serving the catalog views (see top_films.routers). Each is a read-only SQLite
+# snapshot of the primary, installed by `python manage.py snapshot_replicas`. Set the
+# TOP_FILMS_REPLICAS environment variable to the number of replicas to use.
+
+REPLICA_DIR = BASE_DIR / 'replicas'
+
+READ_REPLICAS = [f'replica{n}' for n in range(1, int(os.environ.get('TOP_FILMS_REPLICAS', 0)) + 1)]
+
+for alias in READ_REPLICAS:
+    DATABASES[alias] = {
+        'ENGINE': 'top_films.sqlite_backend',
+        # Snapshots are replaced, never modified in place, so they can be opened immutable
+        'NAME': f"file:{REPLICA_DIR / alias}.sqlite3?mode=ro&immutable=1",
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['top_films.routers.PrimaryReplicaRouter']
+
+# Seconds a client that wrote is kept reading from the primary; should exceed the interval
+# between replica snapshots
+REPLICA_STICKY_SECONDS = 300
+
+
+# Cache used by the catalog page cache (top_films.page_cache). Deployments running more
+# than one process should point this at a shared backend such as Memcached or Redis, so
+# that a catalog change invalidates the cached pages of every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CATALOG_PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+# request.user (with its Profile) is served from a cache of users (see top_films/identity.py).
+# CachedBackendSessionMiddleware moves sessions logged in through ModelBackend over to it.
+AUTHENTICATION_BACKENDS = [
+    'top_films.identity.CachedModelBackend',
+]
+USER_CACHE_SIZE = 1000
+USER_CACHE_TIMEOUT = 5 * 60
+# A cache shared by all server processes, so that a change made in one reaches the others at once
+USER_CACHE_ALIAS = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -118,6 +188,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Resized WebP/JPEG variants of the film posters, made by `python manage.py build_posters` and
+# served by top_films.views.poster_view (or, better, by the web server in front of Django,
+# with the same far-future Cache-Control header)
+POSTER_ROOT = BASE_DIR / 'posters'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
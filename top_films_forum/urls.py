@@ -15,7 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from top_films.views import index_view, profile_view, registration_view, update_profile_view, user_info_view
+from top_films.views import index_view, profile_view, registration_view, update_profile_view, user_info_view, metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,5 +25,7 @@ urlpatterns = [
     path('account/', include('django.contrib.auth.urls')),
     path('user/<int:pk>', user_info_view, name='user-info'),
     path('films/', include('top_films.urls')),
+    path('api/v1/', include('top_films.api')),
+    path('metrics', metrics_view, name='metrics'),
     path('', index_view, name='index')
 ]